@@ -131,6 +131,8 @@ DATABASES = {
         'PASSWORD': secret_db_password(),
         'HOST': secret_db_host(),
         'PORT': secret_db_port(),
+        # Generated tables are bulk loaded with LOAD DATA LOCAL INFILE.
+        'OPTIONS': {'local_infile': 1},
     }
 }
 
@@ -204,6 +206,18 @@ MEDIA_URL = '/uploads/'
 # Where data sets are served from.
 DATA_SETS_LOCATION = 'datasets'
 
+# Where generated archives are kept, to hand out again when a project is
+# generated with the same settings and seed. Relative to BASE_DIR.
+FEDS_ARCHIVE_CACHE_LOCATION = 'archive_cache'
+# Most bytes of archives to keep. The least recently used are dropped
+# first. 0 turns the cache off.
+FEDS_ARCHIVE_CACHE_BUDGET = 2 * 1024 * 1024 * 1024
+
+# Seconds a compiled default project is kept, at most. Saving a business
+# area, table, field spec, or setting row throws it away at once, but
+# only in the process that saved it.
+FEDS_DEFAULT_PROJECT_CACHE_SECONDS = 300
+
 
 # Project convenience settings.
 FEDS_REST_HELP_URL = 'http://docutils.sourceforge.net/docs/user/rst' \
@@ -325,6 +339,26 @@ FEDS_MAX_CUST_INVOICES_PER_CUST = 100
 FEDS_CUST_INVOICES_PER_CUST_DEFAULT = 8
 
 
+# Detail lines per invoice.
+FEDS_MIN_LINES_PER_INVOICE = 1
+FEDS_MAX_LINES_PER_INVOICE = 5
+
+# Quantity of product on an invoice detail line.
+FEDS_MIN_LINE_QUANTITY = 1
+FEDS_MAX_LINE_QUANTITY = 10
+
+# Credit terms for credit invoices, with days until payment is due.
+# Cash invoices are due on the invoice date.
+FEDS_CREDIT_TERMS = (
+    ('Net 15', 15),
+    ('Net 30', 30),
+    ('Net 60', 60),
+)
+FEDS_CASH_CREDIT_TERMS = 'Due on receipt'
+
+FEDS_SHIPPING_METHODS = ('Ground', 'Air', 'Freight', 'Pickup')
+FEDS_SHIPPING_TERMS = ('FOB shipping point', 'FOB destination')
+
 # Default average number of invoices per customer.
 FEDS_DEFAULT_AVG_INVOICES_PER_CUSTOMER = 10
 
@@ -351,6 +385,41 @@ FEDS_MAX_PRODUCTS = 20
 FEDS_MIN_PRICE = 6
 FEDS_MAX_PRICE = 178
 
+# Number of rows sent to the DB in each bulk load statement.
+FEDS_BULK_LOAD_CHUNK_SIZE = 5000
+
+# Number of rows read from the DB, or written as CSV, at a time when
+# exporting a table.
+FEDS_EXPORT_BATCH_SIZE = 5000
+
+# How generated data gets to the export files.
+# Direct: written straight from memory to the export files.
+# Database: loaded into per-project SQL tables, then exported from them.
+FEDS_GENERATION_MODE_DIRECT = 'direct'
+FEDS_GENERATION_MODE_DATABASE = 'database'
+FEDS_GENERATION_MODE = FEDS_GENERATION_MODE_DIRECT
+
+# Number of customers made at a time in direct mode. Each chunk of
+# customers, their invoices and invoice details, is written to the archive
+# before the next is made, so this caps memory use.
+FEDS_GENERATION_CHUNK_SIZE = 10000
+
+# Number of worker processes that make chunks at the same time. 1 makes
+# everything in the web server's process.
+FEDS_GENERATION_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# Number of generation jobs that run at the same time. Each is a process
+# started by manage.py run_generation_workers, and has its own
+# FEDS_GENERATION_WORKERS.
+FEDS_GENERATION_JOB_WORKERS = 2
+
+# Seconds an idle job worker waits before looking for queued jobs again.
+FEDS_GENERATION_JOB_POLL_SECONDS = 2
+
+# Most per-student variants one batch job makes. Variants are made
+# FEDS_GENERATION_WORKERS at a time, each in one process.
+FEDS_MAX_VARIANTS = 500
+
 # Date range options
 FEDS_LAST_CALENDAR_YEAR = 'lastyear'
 FEDS_CUSTOM_DATE_RANGE = 'customrange'
@@ -365,9 +434,11 @@ FEDS_CHOICES_PARAM = 'choices'
 # Choices of stat distributions.
 FEDS_NORMAL_DISTRIBUTION = 'normal'
 FEDS_SKEWED_DISTRIBUTION = 'skewed'
+FEDS_MIXED_DISTRIBUTION = 'mixed'
 FEDS_STAT_DISTRIBUTION_CHOCIES = (
     (FEDS_NORMAL_DISTRIBUTION, 'Normal'),
-    (FEDS_SKEWED_DISTRIBUTION, 'Skewed')
+    (FEDS_SKEWED_DISTRIBUTION, 'Skewed'),
+    (FEDS_MIXED_DISTRIBUTION, 'Mixed: mostly routine, some large'),
 )
 # Name of the param that stores a distribution.
 # FEDS_DISTRIBUTION_VALUE_PARAM = 'distribution'
@@ -375,6 +446,50 @@ FEDS_STAT_DISTRIBUTION_CHOCIES = (
 # Normal distribution mean.
 FEDS_NORMAL_DISTRIBUTION_MEAN_TOTAL_BEFORE_TAX_DEFAULT = 800
 
+# Bounds of invoice totals before tax drawn from a distribution: from one
+# of the cheapest product, to a full invoice of the dearest.
+FEDS_MIN_TOTAL_BEFORE_TAX = FEDS_MIN_PRICE
+FEDS_MAX_TOTAL_BEFORE_TAX = FEDS_MAX_LINES_PER_INVOICE \
+    * FEDS_MAX_LINE_QUANTITY * FEDS_MAX_PRICE
+
+# Standard deviation of normal invoice totals, as a fraction of the mean.
+FEDS_NORMAL_DISTRIBUTION_SD_RATIO = 0.3
+
+# Standard deviation of the log of skewed (lognormal) invoice totals.
+FEDS_SKEWED_DISTRIBUTION_SIGMA = 0.8
+
+# Components of mixed invoice totals: weight, mean as a fraction of the
+# overall mean, and sigma of a lognormal. The means average out to the
+# overall mean.
+FEDS_MIXED_DISTRIBUTION_COMPONENTS = (
+    (0.9, 0.75, 0.3),
+    (0.1, 3.25, 0.5),
+)
+
+# Benford's law anomaly: the invoice field tampered with, the fraction of
+# invoices tampered with, and weights for the first digits, 1 to 9, given
+# to them. Made-up amounts tend to start with middle digits.
+FEDS_BENFORD_FIELD = 'TotalBTax'
+FEDS_BENFORD_TAMPERED_FRACTION = 0.15
+FEDS_BENFORD_DIGIT_WEIGHTS = (1, 1, 2, 3, 4, 4, 3, 2, 1)
+
+# Fraction of a field's rows given each anomaly, by the anomaly's setting.
+FEDS_ANOMALY_FRACTIONS = {
+    'anomaly_arithmetic_errors': 0.01,
+    'anomaly_negative_numbers': 0.005,
+    'anomaly_out_of_range': 0.005,
+    'anomaly_duplicate_values': 0.005,
+    'anomaly_missing': 0.005,
+}
+
+# Arithmetic errors change an amount by this fraction of it, at least.
+FEDS_ARITHMETIC_ERROR_MIN_RATIO = 0.01
+# And at most.
+FEDS_ARITHMETIC_ERROR_MAX_RATIO = 0.2
+
+# Out of range dates are at most this many days outside the project's dates.
+FEDS_OUT_OF_RANGE_MAX_DAYS = 60
+
 # Name of param that gives Python visibility function.
 FEDS_PYTHON_VISIBILITY_FUNCTION_PARAM = 'pythonvisfunction'
 
@@ -401,6 +516,12 @@ FEDS_WORKING_DAYS = (
     (FEDS_WORKING_DAYS_MON_SAT, 'Mon. - Sat.'),
     (FEDS_WORKING_DAYS_ALL_WEEK, 'All week')
 )
+# Week masks for working days, Monday first.
+FEDS_WORKING_DAYS_WEEKMASKS = {
+    FEDS_WORKING_DAYS_WEEKDAYS: '1111100',
+    FEDS_WORKING_DAYS_MON_SAT: '1111110',
+    FEDS_WORKING_DAYS_ALL_WEEK: '1111111',
+}
 
 FEDS_NUMBER_STYLE_SIMPLE = 'simple'
 FEDS_NUMBER_STYLE_COMPLEX = 'complex'
@@ -416,6 +537,21 @@ FEDS_EXPORT_TABLES = (
     (FEDS_EXPORT_TABLES_SEPARATE, 'Separate'),
 )
 
+# File format tables are exported in.
+FEDS_EXPORT_FORMAT_CSV = 'csv'
+FEDS_EXPORT_FORMAT_PARQUET = 'parquet'
+FEDS_EXPORT_FORMAT_ARROW = 'arrow'
+FEDS_EXPORT_FORMAT_SQLITE = 'sqlite'
+FEDS_EXPORT_FORMATS = (
+    (FEDS_EXPORT_FORMAT_CSV, 'CSV'),
+    (FEDS_EXPORT_FORMAT_PARQUET, 'Parquet'),
+    (FEDS_EXPORT_FORMAT_ARROW, 'Arrow IPC'),
+    (FEDS_EXPORT_FORMAT_SQLITE, 'SQLite'),
+)
+
+# Rows loaded into the SQLite export between commits.
+FEDS_SQLITE_TRANSACTION_ROWS = 1000000
+
 # Name of param that specifies the machine name of a setting param.
 FEDS_MACHINE_NAME_PARAM = 'machine_name'
 # Setting visibility
@@ -1,3 +1,12 @@
 from django.contrib import admin
+from .models import GenerationJobDb
 
-# Register your models here.
+
+class GenerationJobAdmin(admin.ModelAdmin):
+    # Fields to show on the list.
+    list_display = ['project', 'user', 'status', 'when_submitted',
+                    'when_finished']
+    # Let admin user filter by these fields.
+    list_filter = ['status', 'user']
+
+admin.site.register(GenerationJobDb, GenerationJobAdmin)
@@ -0,0 +1,284 @@
+"""
+Put anomalies into clean tables, a chunk at a time.
+
+Each kind of anomaly has a kernel. A kernel picks the rows it changes
+with a boolean mask, drawn from the anomaly's own stream, and changes
+the column in place, with no per-row Python work. It returns the mask,
+so every anomaly reports exactly which rows it touched.
+
+Kernels run in ANOMALY_KERNELS order, so anomalies on the same field
+compose the same way every time. Missing values run last, so no other
+kernel works on a value that isn't there.
+
+Anomalies are put into the tables as they are exported. When invoice
+lines are exported joined, anomalies on the products, customers and
+invoices are put into those tables before they're joined, so each
+invoice's lines agree, and anomalies on the detail lines are put into
+the joined table.
+
+Missing values are masked, in numpy.ma masked arrays. Exporters write
+them as empty, or null.
+
+The rows each anomaly touches go into the answer key as they're put in,
+in a RowBitmap for each table and anomaly. Rows are numbered from 1, in
+the order the table was made, which is the order of its clean keys.
+"""
+
+import csv
+import io
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from feds.settings import FEDS_ANOMALY_FRACTIONS, \
+    FEDS_ARITHMETIC_ERROR_MIN_RATIO, FEDS_ARITHMETIC_ERROR_MAX_RATIO, \
+    FEDS_OUT_OF_RANGE_MAX_DAYS
+from generate.bitmaps import RowBitmap
+from generate.columns import JOINED_TABLE, JOINED_FIELDS
+from generate.streams import ANOMALY_STREAM, make_rng
+
+ARITHMETIC_ERRORS = 'anomaly_arithmetic_errors'
+NEGATIVE_NUMBERS = 'anomaly_negative_numbers'
+OUT_OF_RANGE = 'anomaly_out_of_range'
+DUPLICATE_VALUES = 'anomaly_duplicate_values'
+MISSING = 'anomaly_missing'
+# Put in while invoices are made, by tamper_invoice_amounts() in
+# generate.columns, not by a kernel.
+BENFORDS_LAW = 'anomaly_violates_benfords_law'
+
+# Names of the kinds of anomaly in the answer key, as in the settings.
+ANOMALY_LABELS = {
+    ARITHMETIC_ERRORS: 'Arithmetic errors',
+    NEGATIVE_NUMBERS: 'Negative numbers',
+    OUT_OF_RANGE: 'Out of project range',
+    DUPLICATE_VALUES: 'Duplicate values',
+    MISSING: 'Missing',
+    BENFORDS_LAW: 'Violates Benford\'s law',
+}
+
+# An anomaly to put into a field: its kind, e.g., MISSING, and the table
+# and field.
+Anomaly = namedtuple('Anomaly', ['kind', 'table_name', 'field_name'])
+
+# The anomalies to put into a project's tables, with what their kernels
+# need: the project's seed, and its first and last invoice days.
+AnomalyPlan = namedtuple('AnomalyPlan', [
+    'seed', 'anomalies', 'first_day', 'last_day'])
+
+# Rows of a table an anomaly touched: the anomaly, the table they are in,
+# and an array of their row numbers in the table, from 0.
+AnomalyRows = namedtuple('AnomalyRows', ['anomaly', 'table_name', 'rows'])
+
+
+def pick_rows(rng, values, kind):
+    """ Pick a kind of anomaly's rows, with its fraction. """
+    return rng.random(len(values)) < FEDS_ANOMALY_FRACTIONS[kind]
+
+
+def add_arithmetic_errors(rng, columns, field_name, plan):
+    """
+    Make amounts wrong by a few percent, up or down, so they no longer
+    add up.
+    """
+    values = columns[field_name]
+    is_touched = pick_rows(rng, values, ARITHMETIC_ERRORS)
+    number_touched = int(is_touched.sum())
+    ratios = rng.uniform(FEDS_ARITHMETIC_ERROR_MIN_RATIO,
+                         FEDS_ARITHMETIC_ERROR_MAX_RATIO, number_touched)
+    signs = rng.choice([-1, 1], number_touched)
+    if np.issubdtype(values.dtype, np.floating):
+        # Money, in dollars. Off by at least a cent.
+        cents = np.rint(values[is_touched] * 100)
+        errors = np.maximum(np.rint(np.abs(cents) * ratios), 1)
+        values[is_touched] = np.round((cents + signs * errors) / 100, 2)
+    else:
+        errors = np.maximum(np.rint(np.abs(values[is_touched]) * ratios),
+                            1).astype(values.dtype)
+        values[is_touched] += signs * errors
+    return is_touched
+
+
+def make_negative_numbers(rng, columns, field_name, plan):
+    """ Flip the sign of some values. Zeros are left alone. """
+    values = columns[field_name]
+    is_touched = pick_rows(rng, values, NEGATIVE_NUMBERS) & (values > 0)
+    values[is_touched] = -values[is_touched]
+    return is_touched
+
+
+def move_out_of_range(rng, columns, field_name, plan):
+    """ Move some dates to before or after the project's dates. """
+    values = columns[field_name]
+    if not np.issubdtype(values.dtype, np.datetime64):
+        message = 'Out of range values only work on dates, not {field}.'
+        raise ValueError(message.format(field=field_name))
+    is_touched = pick_rows(rng, values, OUT_OF_RANGE)
+    number_touched = int(is_touched.sum())
+    days_out = rng.integers(1, FEDS_OUT_OF_RANGE_MAX_DAYS + 1,
+                            number_touched).astype('timedelta64[D]')
+    is_before = rng.random(number_touched) < 0.5
+    values[is_touched] = np.where(is_before, plan.first_day - days_out,
+                                  plan.last_day + days_out)
+    return is_touched
+
+
+def duplicate_values(rng, columns, field_name, plan):
+    """ Copy other rows' values into some rows. """
+    values = columns[field_name]
+    number_rows = len(values)
+    if number_rows < 2:
+        return np.zeros(number_rows, dtype=bool)
+    is_touched = pick_rows(rng, values, DUPLICATE_VALUES)
+    touched_rows = np.flatnonzero(is_touched)
+    # Any row but the row itself.
+    source_rows = rng.integers(0, number_rows - 1, len(touched_rows))
+    source_rows += source_rows >= touched_rows
+    values[touched_rows] = values[source_rows]
+    return is_touched
+
+
+def make_missing(rng, columns, field_name, plan):
+    """ Mask some values, so they're exported empty. """
+    values = columns[field_name]
+    is_touched = pick_rows(rng, values, MISSING)
+    columns[field_name] = np.ma.masked_array(
+        values, mask=np.ma.getmaskarray(values) | is_touched)
+    return is_touched
+
+
+# Kernel for each kind of anomaly, in the order they run.
+ANOMALY_KERNELS = OrderedDict([
+    (ARITHMETIC_ERRORS, add_arithmetic_errors),
+    (NEGATIVE_NUMBERS, make_negative_numbers),
+    (OUT_OF_RANGE, move_out_of_range),
+    (DUPLICATE_VALUES, duplicate_values),
+    (MISSING, make_missing),
+])
+
+
+def order_anomalies(anomalies):
+    """
+    Sort anomalies into the order their kernels run.
+    :param anomalies: Iterable of Anomaly.
+    :return: Tuple of Anomaly.
+    """
+    anomalies = list(anomalies)
+    kinds = list(ANOMALY_KERNELS)
+    for anomaly in anomalies:
+        if anomaly.kind not in ANOMALY_KERNELS:
+            message = 'Bad anomaly kind: "{kind}"'
+            raise ValueError(message.format(kind=anomaly.kind))
+    return tuple(sorted(anomalies,
+                        key=lambda anomaly: kinds.index(anomaly.kind)))
+
+
+def table_anomalies(plan, table_name):
+    """
+    Find the anomalies to put into a table.
+    :param plan: AnomalyPlan.
+    :param table_name: Name of the table, e.g., invoices.
+    :return: List of Anomaly, in the order they run.
+    """
+    if table_name == JOINED_TABLE:
+        # The joined table's rows are the detail lines.
+        return [anomaly for anomaly in plan.anomalies
+                if anomaly.table_name == 'invoice_details'
+                and anomaly.field_name in JOINED_FIELDS]
+    return [anomaly for anomaly in plan.anomalies
+            if anomaly.table_name == table_name]
+
+
+def anomaly_stream_key(anomaly):
+    """ Stream key for an anomaly, the same every run. """
+    return zlib.crc32('{kind} {table} {field}'.format(
+        kind=anomaly.kind, table=anomaly.table_name,
+        field=anomaly.field_name).encode('utf-8'))
+
+
+def inject_anomalies(plan, chunk_index, first_row, table_name, columns):
+    """
+    Put anomalies into a chunk of a table.
+    :param plan: AnomalyPlan, or None for no anomalies.
+    :param chunk_index: Which chunk of the table, from 0.
+    :param first_row: Row number of the chunk's first row in the table,
+            from 0.
+    :param table_name: Name of the table, e.g., invoices.
+    :param columns: Dict of the chunk's columns. Not changed.
+    :return: Tuple: dict of the columns with the anomalies, list of
+            AnomalyRows, one for each anomaly put in.
+    """
+    if plan is None:
+        return columns, list()
+    anomalies = table_anomalies(plan, table_name)
+    if not anomalies:
+        return columns, list()
+    # Kernels change their fields in place. Columns can be shared, like
+    # the products, so they work on copies.
+    columns = dict(columns)
+    for field_name in set(anomaly.field_name for anomaly in anomalies):
+        columns[field_name] = columns[field_name].copy()
+    anomaly_rows = list()
+    for anomaly in anomalies:
+        rng = make_rng(plan.seed, ANOMALY_STREAM, chunk_index,
+                       anomaly_stream_key(anomaly))
+        is_touched = ANOMALY_KERNELS[anomaly.kind](
+            rng, columns, anomaly.field_name, plan)
+        anomaly_rows.append(AnomalyRows(
+            anomaly, table_name, np.flatnonzero(is_touched) + first_row))
+    return columns, anomaly_rows
+
+
+def add_anomaly_rows(anomaly_bitmaps, anomaly_rows):
+    """
+    Add the rows anomalies touched in a chunk to the answer key.
+    :param anomaly_bitmaps: OrderedDict of RowBitmap, by table name and
+            Anomaly. Changed in place.
+    :param anomaly_rows: List of AnomalyRows.
+    """
+    for rows in anomaly_rows:
+        key = (rows.table_name, rows.anomaly)
+        if key not in anomaly_bitmaps:
+            anomaly_bitmaps[key] = RowBitmap()
+        anomaly_bitmaps[key].add(rows.rows)
+
+
+def bitmap_member_name(table_name, anomaly):
+    """
+    Name of the archive member for an anomaly's bitmap, e.g.,
+    answer_key/rows/invoices.InvoiceNumber.missing.roaring.
+    """
+    return 'answer_key/rows/{table}.{field}.{kind}.roaring'.format(
+        table=table_name, field=anomaly.field_name,
+        kind=anomaly.kind.replace('anomaly_', '', 1))
+
+
+def anomaly_answer_key_csv(anomaly_bitmaps):
+    """
+    Make the answer key's CSV of the rows anomalies touched.
+    :param anomaly_bitmaps: OrderedDict of RowBitmap, by table name and
+            Anomaly.
+    :return: CSV text, with a line for each anomaly in each row, by
+            table, then row.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Table', 'Row', 'Field', 'Anomaly'])
+    table_names = list(OrderedDict.fromkeys(
+        table_name for table_name, anomaly in anomaly_bitmaps))
+    for table_name in table_names:
+        anomalies = [anomaly for key_table, anomaly in anomaly_bitmaps
+                     if key_table == table_name]
+        rows = [anomaly_bitmaps[(table_name, anomaly)].rows()
+                for anomaly in anomalies]
+        anomaly_index = np.repeat(np.arange(len(anomalies)),
+                                  [len(part) for part in rows])
+        rows = np.concatenate(rows)
+        order = np.lexsort((anomaly_index, rows))
+        fields = [anomaly.field_name for anomaly in anomalies]
+        labels = [ANOMALY_LABELS[anomaly.kind] for anomaly in anomalies]
+        writer.writerows(
+            (table_name, row + 1, fields[index], labels[index])
+            for row, index in zip(rows[order].tolist(),
+                                  anomaly_index[order].tolist()))
+    return buffer.getvalue()
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class GenerateConfig(AppConfig):
     name = 'generate'
+
+    def ready(self):
+        # Load the word lists at startup, so worker processes forked later
+        # share them.
+        from generate.vocabulary import get_vocabulary_store
+        get_vocabulary_store()
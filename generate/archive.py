@@ -0,0 +1,466 @@
+"""
+Write zip archives whose members are filled a chunk at a time.
+
+Python's zipfile can only have one member open for writing at a time, but
+the generator makes a chunk of customers, invoices and invoice details
+together, and has to append each to its own file. ChunkedZipWriter
+compresses each chunk as soon as it arrives, and keeps the compressed
+bytes in a temporary spool file per member, so memory use stays flat
+however big the data set is. close() writes the members' headers and
+copies the compressed data into the archive.
+
+Each chunk is compressed on its own, as a piece of raw deflate data that
+ends with a full flush. Pieces don't refer back to earlier ones, so they
+can be compressed in worker processes with compress_piece(), and joined
+in order with write_piece(). A member's data is its pieces, then an empty
+final block.
+
+StreamingZipWriter writes members one after another instead, straight
+to its file object, with no spools. Each member's CRC and sizes follow
+its data, in a data descriptor, so the archive can be sent to a client as
+it is made, e.g., through a StreamBuffer. Its members can also be stored
+as they are, with no compression.
+
+The output is a standard zip file, with Zip64 records when a member or
+the archive is too big for the classic format.
+"""
+
+import struct
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+
+# Sizes and offsets at or above this need Zip64 records.
+ZIP64_LIMIT = 0xFFFFFFFF
+# Member counts at or above this need Zip64 records.
+ZIP64_COUNT_LIMIT = 0xFFFF
+# Written in place of values that are in the Zip64 records.
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+# zlib compression level.
+COMPRESS_LEVEL = 6
+
+# Bytes copied from spools at a time.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Flag bit 11: member names are UTF-8.
+UTF8_FLAG = 0x0800
+# Flag bit 3: CRC and sizes are in a data descriptor after the data.
+DATA_DESCRIPTOR_FLAG = 0x0008
+# Compression methods.
+STORED = 0
+DEFLATED = 8
+# External attributes: regular file, rw-r--r--.
+EXTERNAL_ATTRIBUTES = (0o100644 << 16)
+# An empty deflate block, marked as the last one.
+FINAL_DEFLATE_BLOCK = b'\x03\x00'
+
+# A compressed chunk of a member: raw deflate data, and the CRC-32 and
+# length of the uncompressed data.
+CompressedPiece = namedtuple('CompressedPiece', ['data', 'crc', 'length'])
+
+
+class ZipArchiveWriter:
+    """
+    What zip writers share: writing out, and the central directory.
+    :param file_obj: Binary file object to write the archive to. It does
+            not have to be seekable.
+    :param compress_level: zlib compression level.
+    """
+
+    def __init__(self, file_obj, compress_level=COMPRESS_LEVEL):
+        self.file_obj = file_obj
+        self.compress_level = compress_level
+        # Members, in the order they were first written to.
+        self.members = dict()
+        # Bytes written to file_obj so far.
+        self.position = 0
+        self.closed = False
+
+    def write(self, member_name, data, compress_level=None):
+        """
+        Append data to a member, creating it if needed.
+        :param member_name: Name of the member in the archive.
+        :param data: bytes, or str to encode as UTF-8.
+        :param compress_level: zlib compression level, if not the
+                archive's. 0 for data that is compressed already.
+        """
+        if compress_level is None:
+            compress_level = self.compress_level
+        self.write_piece(member_name, compress_piece(data, compress_level))
+
+    def write_central_directory(self):
+        """ Write the central directory, and the end records. """
+        central_directory_offset = self.position
+        for member in self.members.values():
+            self.write_out(member.central_header())
+        central_directory_size = self.position - central_directory_offset
+        self.write_end_records(central_directory_offset,
+                               central_directory_size)
+
+    def write_end_records(self, central_directory_offset,
+                          central_directory_size):
+        """
+        Write the end of central directory record, and the Zip64 end
+        records if they are needed.
+        """
+        count = len(self.members)
+        if count >= ZIP64_COUNT_LIMIT \
+                or central_directory_offset >= ZIP64_LIMIT \
+                or central_directory_size >= ZIP64_LIMIT:
+            zip64_end_offset = self.position
+            self.write_out(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                central_directory_size, central_directory_offset))
+            self.write_out(struct.pack(
+                '<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+            count = ZIP64_COUNT_MARKER
+            central_directory_offset = ZIP64_MARKER
+            central_directory_size = ZIP64_MARKER
+        self.write_out(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+            central_directory_size, central_directory_offset, 0))
+
+    def write_out(self, data):
+        """ Write bytes to the archive file, tracking the position. """
+        self.file_obj.write(data)
+        self.position += len(data)
+
+
+class ChunkedZipWriter(ZipArchiveWriter):
+    """
+    Write a zip archive, with data appended to members in any order.
+    :param file_obj: Binary file object to write the archive to. It does
+            not have to be seekable.
+    :param compress_level: zlib compression level.
+    """
+
+    def write_piece(self, member_name, piece):
+        """
+        Append a compressed piece to a member, creating it if needed.
+        :param member_name: Name of the member in the archive.
+        :param piece: CompressedPiece, from compress_piece().
+        """
+        if self.closed:
+            raise ValueError('ChunkedZipWriter: archive already closed.')
+        if member_name not in self.members:
+            self.members[member_name] = ZipMemberSpool(member_name)
+        self.members[member_name].write_piece(piece)
+
+    def close(self):
+        """ Write out all of the members, and the central directory. """
+        if self.closed:
+            return
+        self.closed = True
+        for member in self.members.values():
+            member.finish()
+            member.header_offset = self.position
+            self.write_out(member.local_header())
+            member.copy_data_to(self.write_out)
+        self.write_central_directory()
+
+
+class StreamingZipWriter(ZipArchiveWriter):
+    """
+    Write a zip archive as it is made, one member after another. Data for
+    a member goes out as soon as it is compressed, so nothing builds up
+    in memory or on disk.
+    :param file_obj: Binary file object to write the archive to. It does
+            not have to be seekable.
+    :param compress_level: zlib compression level.
+    """
+
+    def __init__(self, file_obj, compress_level=COMPRESS_LEVEL):
+        super().__init__(file_obj, compress_level)
+        # Member being written, or None.
+        self.current_member = None
+
+    def write_piece(self, member_name, piece, method=DEFLATED):
+        """
+        Append a compressed piece to a member. Writing to a new member
+        finishes the current one, which can't be written to again.
+        :param member_name: Name of the member in the archive.
+        :param piece: CompressedPiece, from compress_piece().
+        :param method: DEFLATED, or STORED if the piece's data is the
+                member's data as it is.
+        """
+        if self.closed:
+            raise ValueError('StreamingZipWriter: archive already closed.')
+        member = self.current_member
+        if member is None or member.name != member_name:
+            if member_name in self.members:
+                message = 'StreamingZipWriter: member "{name}" already ' \
+                          'finished.'
+                raise ValueError(message.format(name=member_name))
+            self.finish_member()
+            member = ZipMember(member_name,
+                               flags=UTF8_FLAG | DATA_DESCRIPTOR_FLAG,
+                               method=method)
+            member.header_offset = self.position
+            self.members[member_name] = member
+            self.current_member = member
+            self.write_out(member.local_header())
+        elif member.method != method:
+            message = 'StreamingZipWriter: member "{name}" is already ' \
+                      'written with another method.'
+            raise ValueError(message.format(name=member_name))
+        member.add_piece(piece)
+        self.write_out(piece.data)
+
+    def write_stored(self, member_name, data):
+        """
+        Append data to a member that is stored, not compressed, e.g.,
+        data that is compressed already.
+        :param member_name: Name of the member in the archive.
+        :param data: bytes.
+        """
+        self.write_piece(member_name,
+                         CompressedPiece(data, zlib.crc32(data), len(data)),
+                         method=STORED)
+
+    def finish_member(self):
+        """ End the current member's data, and write its descriptor. """
+        member = self.current_member
+        if member is None:
+            return
+        if member.method == DEFLATED:
+            member.compressed_size += len(FINAL_DEFLATE_BLOCK)
+            self.write_out(FINAL_DEFLATE_BLOCK)
+        self.write_out(member.data_descriptor())
+        self.current_member = None
+
+    def close(self):
+        """ Finish the last member, and write the central directory. """
+        if self.closed:
+            return
+        self.closed = True
+        self.finish_member()
+        self.write_central_directory()
+
+
+class StreamBuffer:
+    """
+    File object that keeps what's written until it's taken. Lets a
+    StreamingZipWriter feed a generator, e.g., for a
+    StreamingHttpResponse.
+    """
+
+    def __init__(self):
+        self.blocks = list()
+
+    def write(self, data):
+        self.blocks.append(data)
+        return len(data)
+
+    def take(self):
+        """
+        Take what's been written since the last take().
+        :return: bytes
+        """
+        data = b''.join(self.blocks)
+        self.blocks = list()
+        return data
+
+
+class ZipMember:
+    """
+    One member of an archive: its name, CRC, sizes and headers.
+    :param name: Name of the member in the archive.
+    :param flags: General purpose flags for the member's headers.
+    :param method: Compression method, DEFLATED or STORED.
+    """
+
+    def __init__(self, name, flags=UTF8_FLAG, method=DEFLATED):
+        self.name = name
+        self.encoded_name = name.encode('utf-8')
+        self.flags = flags
+        self.method = method
+        self.crc = 0
+        self.uncompressed_size = 0
+        self.compressed_size = 0
+        self.header_offset = 0
+        self.dos_time, self.dos_date = dos_date_time(time.localtime())
+
+    def add_piece(self, piece):
+        """ Count a compressed piece in the CRC and sizes. """
+        self.crc = crc32_combine(self.crc, piece.crc, piece.length)
+        self.uncompressed_size += piece.length
+        self.compressed_size += len(piece.data)
+
+    def sizes_need_zip64(self):
+        return self.uncompressed_size >= ZIP64_LIMIT \
+            or self.compressed_size >= ZIP64_LIMIT
+
+    def needs_zip64(self):
+        return self.sizes_need_zip64() or self.header_offset >= ZIP64_LIMIT
+
+    def local_header(self):
+        if self.flags & DATA_DESCRIPTOR_FLAG:
+            # Not known yet. They are in the data descriptor. It could need
+            # Zip64 sizes, so there's a Zip64 extra field, with zeros.
+            version = 45
+            crc = 0
+            compressed_size = uncompressed_size = ZIP64_MARKER
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        elif self.needs_zip64():
+            version = 45
+            crc = self.crc
+            compressed_size = uncompressed_size = ZIP64_MARKER
+            extra = struct.pack('<HHQQ', 0x0001, 16, self.uncompressed_size,
+                                self.compressed_size)
+        else:
+            version = 20
+            crc = self.crc
+            compressed_size = self.compressed_size
+            uncompressed_size = self.uncompressed_size
+            extra = b''
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, self.flags, self.method,
+            self.dos_time, self.dos_date, crc & 0xFFFFFFFF,
+            compressed_size, uncompressed_size, len(self.encoded_name),
+            len(extra)) + self.encoded_name + extra
+
+    def data_descriptor(self):
+        """
+        CRC and sizes, written after the data of a streamed member. Always
+        Zip64, as the local header has a Zip64 extra field.
+        """
+        return struct.pack('<IIQQ', 0x08074b50, self.crc & 0xFFFFFFFF,
+                           self.compressed_size, self.uncompressed_size)
+
+    def central_header(self):
+        if self.needs_zip64():
+            version = 45
+            compressed_size = uncompressed_size = header_offset = ZIP64_MARKER
+            extra = struct.pack('<HHQQQ', 0x0001, 24, self.uncompressed_size,
+                                self.compressed_size, self.header_offset)
+        else:
+            version = 20
+            compressed_size = self.compressed_size
+            uncompressed_size = self.uncompressed_size
+            header_offset = self.header_offset
+            extra = b''
+        # Made by: Unix (3), so the external attributes are file modes.
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+            self.flags, self.method, self.dos_time, self.dos_date,
+            self.crc & 0xFFFFFFFF, compressed_size, uncompressed_size,
+            len(self.encoded_name), len(extra), 0, 0, 0,
+            EXTERNAL_ATTRIBUTES, header_offset) + self.encoded_name + extra
+
+
+class ZipMemberSpool(ZipMember):
+    """
+    One member of a ChunkedZipWriter archive. Keeps the member's
+    compressed pieces in a temporary file.
+    :param name: Name of the member in the archive.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.spool = tempfile.TemporaryFile()
+
+    def write_piece(self, piece):
+        """ Add a compressed piece to the spool. """
+        self.add_piece(piece)
+        self.spool.write(piece.data)
+
+    def finish(self):
+        """ End the member's deflate data. """
+        self.spool.write(FINAL_DEFLATE_BLOCK)
+        self.compressed_size += len(FINAL_DEFLATE_BLOCK)
+
+    def copy_data_to(self, write):
+        """
+        Copy the compressed data out of the spool, then drop the spool.
+        :param write: Function to write bytes with.
+        """
+        self.spool.seek(0)
+        while True:
+            block = self.spool.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            write(block)
+        self.spool.close()
+
+
+def dos_date_time(local_time):
+    """
+    Convert a time.struct_time to MS-DOS time and date words.
+    :return: Tuple: time, date.
+    """
+    year = max(local_time.tm_year, 1980)
+    dos_time = (local_time.tm_hour << 11) | (local_time.tm_min << 5) \
+        | (local_time.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (local_time.tm_mon << 5) \
+        | local_time.tm_mday
+    return dos_time, dos_date
+
+
+def compress_piece(data, compress_level=COMPRESS_LEVEL):
+    """
+    Compress a chunk of a member, so it can be joined to other pieces.
+    :param data: bytes, or str to encode as UTF-8.
+    :param compress_level: zlib compression level.
+    :return: CompressedPiece
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    # Negative window bits: raw deflate, the format zip uses.
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    # A full flush ends on a byte boundary, with nothing that refers to
+    # data in the piece for later pieces to depend on.
+    compressed = compressor.compress(data) \
+        + compressor.flush(zlib.Z_FULL_FLUSH)
+    return CompressedPiece(compressed, zlib.crc32(data), len(data))
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    Work out the CRC-32 of two pieces of data joined together, from the
+    CRC-32s of the pieces. Same as zlib's crc32_combine(), which Python's
+    zlib module doesn't have.
+    :param crc1: CRC-32 of the first piece.
+    :param crc2: CRC-32 of the second piece.
+    :param length2: Length of the second piece.
+    :return: CRC-32 of both pieces.
+    """
+    if length2 == 0:
+        return crc1
+    # Operator for one zero bit, then squared for two and four.
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = gf2_matrix_square(odd)
+    odd = gf2_matrix_square(even)
+    # Apply length2 zero bytes to crc1, squaring the operator each time.
+    while True:
+        even = gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+        odd = gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+    return crc1 ^ crc2
+
+
+def gf2_matrix_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def gf2_matrix_square(matrix):
+    return [gf2_matrix_times(matrix, matrix[row]) for row in range(32)]
@@ -0,0 +1,238 @@
+"""
+A store of generated archives, named by a hash of everything that goes
+into them.
+
+The same project settings, business area structure, seed and word lists
+always make the same archive, so an archive made before can be handed
+out again, without making it. Archives are kept until the store is over
+its disk budget, then the least recently used ones are dropped.
+
+Archives are hard linked between the store and the data sets dir where
+they can, so a hit costs no copying. Files in the store are never
+changed in place, only replaced, so a link stays good.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from feds.settings import BASE_DIR, FEDS_ARCHIVE_CACHE_LOCATION, \
+    FEDS_ARCHIVE_CACHE_BUDGET, FEDS_GENERATION_CHUNK_SIZE, \
+    FEDS_GENERATION_MODE
+
+logger = logging.getLogger(__name__)
+
+# Part of every key. Change it when the generator's output changes for
+# the same inputs, so old archives aren't handed out.
+ARCHIVE_FORMAT_VERSION = 8
+
+
+def archive_key(project, seed, visible_settings, vocabularies, date_range):
+    """
+    Work out the key of a project's archive.
+    :param project: FedsProject, with the user's settings merged.
+    :param seed: The project's seed.
+    :param visible_settings: Dict of the settings the user can see, as
+            posted to generate.
+    :param vocabularies: VocabularyStore the data is made from.
+    :param date_range: Tuple: the project's first and last days, as
+            datetime.date. Resolved, since options like last year depend
+            on today's date.
+    :return: Hex SHA-256 of the inputs, as canonical JSON.
+    """
+    owner = project.owner
+    inputs = {
+        'version': ARCHIVE_FORMAT_VERSION,
+        'mode': FEDS_GENERATION_MODE,
+        'chunk_size': FEDS_GENERATION_CHUNK_SIZE,
+        'seed': seed,
+        'vocabularies': vocabularies.digest(),
+        'date_range': [day.isoformat() for day in date_range],
+        'visible_settings': visible_settings,
+        'owner': [owner.username, owner.first_name, owner.last_name],
+        'project': describe_item(project),
+        'business_area': describe_item(project.business_area),
+        'tables': [
+            dict(describe_item(table), field_specs=[
+                dict(describe_item(field_spec),
+                     field_type=field_spec.field_type)
+                for field_spec in table.field_specs])
+            for table in project.notional_tables
+        ],
+    }
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'),
+                           default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def describe_item(item):
+    """
+    Describe a project, business area, table or field spec, and its
+    settings, for hashing.
+    :return: Dict.
+    """
+    return {
+        'machine_name': item.machine_name,
+        'title': item.title,
+        'description': item.description,
+        'settings': {setting.machine_name: setting.params
+                     for setting in getattr(item, 'settings', list())},
+    }
+
+
+class ArchiveCache:
+    """
+    Archives on disk, by key, with least recently used eviction.
+    :param dir_path: Dir to keep the archives in.
+    :param budget: Most bytes to keep. 0 turns the cache off.
+    """
+
+    def __init__(self, dir_path, budget):
+        self.dir_path = dir_path
+        self.budget = budget
+
+    def path_for(self, key):
+        # Spread over subdirs, so no dir gets huge.
+        return os.path.join(self.dir_path, key[:2], key + '.zip')
+
+    def get(self, key, target_path):
+        """
+        Put a stored archive at target_path, if there is one.
+        :return: True on a hit.
+        """
+        if not self.budget:
+            return False
+        path = self.path_for(key)
+        try:
+            link_or_copy(path, target_path)
+        except FileNotFoundError:
+            return False
+        # Mark it as just used.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since it was linked. The target is still good.
+            pass
+        logger.info('Archive cache hit: ' + key)
+        return True
+
+    def open(self, key):
+        """
+        Open a stored archive, if there is one.
+        :return: Binary file object, or None.
+        """
+        if not self.budget:
+            return None
+        path = self.path_for(key)
+        try:
+            archive_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(archive_file.fileno())
+        logger.info('Archive cache hit: ' + key)
+        return archive_file
+
+    def put(self, key, source_path):
+        """ Store the archive at source_path, then evict if need be. """
+        if not self.budget:
+            return
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(source_path, path)
+        self.evict(keep_path=path)
+
+    def tee(self, key, blocks):
+        """
+        Pass an archive's blocks through, and store the archive when the
+        last one has gone by. It's written under a temporary name, so a
+        stream that's cut short doesn't leave a broken archive behind.
+        :param blocks: Iterator of bytes of the archive.
+        :return: Iterator of the same bytes.
+        """
+        if not self.budget:
+            yield from blocks
+            return
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Two streams of the same archive don't share a part file.
+        part_fd, part_file_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(part_fd, 'wb') as part_file:
+                for block in blocks:
+                    part_file.write(block)
+                    yield block
+            os.replace(part_file_path, path)
+        finally:
+            if os.path.exists(part_file_path):
+                os.unlink(part_file_path)
+        self.evict(keep_path=path)
+
+    def evict(self, keep_path=None):
+        """
+        Drop the least recently used archives until the store is within
+        its budget. keep_path is never dropped.
+        :return: Number of archives dropped.
+        """
+        entries = list()
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(self.dir_path):
+            for file_name in file_names:
+                # Archives still being written.
+                if file_name.endswith('.part'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        dropped = 0
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.budget:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            dropped += 1
+        return dropped
+
+
+def link_or_copy(source_path, target_path):
+    """
+    Make target_path the same file as source_path, replacing anything
+    there. Hard links if it can, else copies.
+    """
+    # A name of its own, so it doesn't clash with other links to the same
+    # target, or with an archive being written there.
+    part_fd, part_path = tempfile.mkstemp(
+        dir=os.path.dirname(target_path), suffix='.part')
+    os.close(part_fd)
+    try:
+        # mkstemp made the file, and links can't replace one.
+        os.unlink(part_path)
+        try:
+            os.link(source_path, part_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Different file systems, or no hard links.
+            shutil.copyfile(source_path, part_path)
+        os.replace(part_path, target_path)
+    finally:
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+
+
+def get_archive_cache():
+    """ Get the cache in the dir set in settings. """
+    return ArchiveCache(os.path.join(BASE_DIR, FEDS_ARCHIVE_CACHE_LOCATION),
+                        FEDS_ARCHIVE_CACHE_BUDGET)
@@ -0,0 +1,227 @@
+"""
+Benford's law, for the anomaly that breaks it.
+
+In many sets of amounts, the first digit is 1 about 30% of the time, and
+9 less than 5% of the time: digit d comes up log10(1 + 1/d) of the time.
+The first two digits follow the same rule, for 10 to 99. Made-up amounts
+don't, which is what auditors test for.
+
+Tampering gives some amounts a new first digit. The digit counts for the
+clean and tampered amounts come out of the same pass: the clean counts,
+less the old digits of the tampered amounts, plus their new ones. Counts
+are added up over chunks, and the statistics worked out at the end.
+"""
+
+import csv
+import io
+from collections import namedtuple
+
+import numpy as np
+
+# Tampering with a field: its name, the fraction of rows tampered with,
+# and weights for the first digits, 1 to 9, the rows get.
+BenfordTampering = namedtuple('BenfordTampering',
+                              ['field_name', 'fraction', 'digit_weights'])
+
+# Counts of first digits, indexed by digit, 0 to 9, and of first two
+# digits, 0 to 99, for the clean and the tampered amounts. Amounts with no
+# first digit, or no first two, like 0, are counted under 0.
+BenfordCounts = namedtuple('BenfordCounts', [
+    'clean_first', 'clean_first_two', 'tampered_first', 'tampered_first_two'])
+
+# Mean absolute deviation limits for close, acceptable, and marginally
+# acceptable conformity, from Nigrini. Above that is nonconformity.
+FIRST_DIGIT_MAD_LIMITS = (0.006, 0.012, 0.015)
+FIRST_TWO_DIGITS_MAD_LIMITS = (0.0012, 0.0018, 0.0022)
+CONFORMITY_LABELS = ('Close conformity', 'Acceptable conformity',
+                     'Marginally acceptable conformity', 'Nonconformity')
+
+# Chi-square critical values at 5% significance, for 8 and 89 degrees of
+# freedom.
+FIRST_DIGIT_CHI_SQUARE_CRITICAL = 15.507
+FIRST_TWO_DIGITS_CHI_SQUARE_CRITICAL = 112.022
+
+# Powers of ten, to find where an amount's first digit is.
+POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+
+def benford_proportions(digits):
+    """
+    Expected proportion of amounts starting with each of some digits.
+    :param digits: Array of digits, e.g., 1 to 9, or 10 to 99.
+    :return: Array of proportions.
+    """
+    return np.log10(1 + 1 / digits)
+
+
+def leading_digits(cents):
+    """
+    Find the first digit, and first two digits, of amounts.
+    :param cents: Array of amounts, in whole cents.
+    :return: Tuple: array of first digits, array of first two digits,
+            array of the power of ten of each amount's first digit.
+            Digits are 0 where there aren't any.
+    """
+    cents = np.abs(cents)
+    magnitudes = np.searchsorted(POWERS_OF_TEN, cents, side='right') - 1
+    np.clip(magnitudes, 0, None, out=magnitudes)
+    first_digits = cents // POWERS_OF_TEN[magnitudes]
+    first_two_digits = cents // POWERS_OF_TEN[np.maximum(magnitudes - 1, 0)]
+    # Amounts under 10 have no first two digits.
+    first_two_digits[magnitudes == 0] = 0
+    return first_digits, first_two_digits, POWERS_OF_TEN[magnitudes]
+
+
+def count_digits(digits, length):
+    """ Count how often each digit comes up. """
+    return np.bincount(digits, minlength=length)
+
+
+def tamper_amounts(rng, cents, fraction, digit_weights):
+    """
+    Give a fraction of amounts a new first digit, drawn with the given
+    weights, and count the first digits before and after.
+    :param rng: numpy.random.Generator to draw from.
+    :param cents: Array of amounts, in whole cents. Changed in place.
+    :param fraction: Fraction of amounts to tamper with.
+    :param digit_weights: Weights of the first digits, 1 to 9.
+    :return: Tuple: boolean mask of the amounts tampered with,
+            BenfordCounts.
+    """
+    first_digits, first_two_digits, first_powers = leading_digits(cents)
+    clean_first = count_digits(first_digits, 10)
+    clean_first_two = count_digits(first_two_digits, 100)
+    # Amounts with no first digit are left alone.
+    tampered = (rng.random(len(cents)) < fraction) & (first_digits > 0)
+    weights = np.asarray(digit_weights, dtype=float)
+    new_digits = rng.choice(np.arange(1, 10), int(tampered.sum()),
+                            p=weights / weights.sum())
+    old_digits = first_digits[tampered]
+    old_first_two = first_two_digits[tampered]
+    signs = np.sign(cents[tampered])
+    cents[tampered] += signs * (new_digits - old_digits) \
+        * first_powers[tampered]
+    # Second digits stay the same.
+    new_first_two = np.where(old_first_two > 0,
+                             new_digits * 10 + old_first_two % 10, 0)
+    tampered_first = clean_first - count_digits(old_digits, 10) \
+        + count_digits(new_digits, 10)
+    tampered_first_two = clean_first_two \
+        - count_digits(old_first_two, 100) + count_digits(new_first_two, 100)
+    return tampered, BenfordCounts(clean_first, clean_first_two,
+                                   tampered_first, tampered_first_two)
+
+
+def add_benford_counts(counts, more_counts):
+    """ Add up the counts from two chunks. Either can be None. """
+    if counts is None:
+        return more_counts
+    if more_counts is None:
+        return counts
+    return BenfordCounts(*(count + more for count, more
+                           in zip(counts, more_counts)))
+
+
+def conformity_statistics(digit_counts, first_digit, last_digit,
+                          mad_limits, chi_square_critical):
+    """
+    Work out how well counts of first digits fit Benford's law.
+    :param digit_counts: Array of counts, indexed by digit.
+    :param first_digit: Lowest digit to test, e.g., 1.
+    :param last_digit: Highest digit to test, e.g., 9.
+    :param mad_limits: MAD limits for conformity, see CONFORMITY_LABELS.
+    :param chi_square_critical: Chi-square critical value at 5%.
+    :return: Dict: count, chi_square, chi_square_critical, mad, and
+            conformity.
+    """
+    digits = np.arange(first_digit, last_digit + 1)
+    observed = digit_counts[first_digit:last_digit + 1]
+    count = int(observed.sum())
+    if count == 0:
+        return {'count': 0, 'chi_square': None,
+                'chi_square_critical': chi_square_critical, 'mad': None,
+                'conformity': None}
+    expected_proportions = benford_proportions(digits)
+    expected = count * expected_proportions
+    chi_square = float((((observed - expected) ** 2) / expected).sum())
+    mad = float(np.abs(observed / count - expected_proportions).mean())
+    conformity = CONFORMITY_LABELS[int(np.searchsorted(mad_limits, mad))]
+    return {'count': count, 'chi_square': chi_square,
+            'chi_square_critical': chi_square_critical, 'mad': mad,
+            'conformity': conformity}
+
+
+def benford_statistics(counts):
+    """
+    Work out the conformity statistics for clean and tampered amounts.
+    :param counts: BenfordCounts.
+    :return: List of dicts, see conformity_statistics(), each with data,
+            clean or tampered, and digits, first or first two.
+    """
+    statistics = list()
+    for data, first_counts, first_two_counts in [
+            ('clean', counts.clean_first, counts.clean_first_two),
+            ('tampered', counts.tampered_first, counts.tampered_first_two)]:
+        first_statistics = conformity_statistics(
+            first_counts, 1, 9, FIRST_DIGIT_MAD_LIMITS,
+            FIRST_DIGIT_CHI_SQUARE_CRITICAL)
+        first_statistics.update(data=data, digits='first')
+        statistics.append(first_statistics)
+        first_two_statistics = conformity_statistics(
+            first_two_counts, 10, 99, FIRST_TWO_DIGITS_MAD_LIMITS,
+            FIRST_TWO_DIGITS_CHI_SQUARE_CRITICAL)
+        first_two_statistics.update(data=data, digits='first two')
+        statistics.append(first_two_statistics)
+    return statistics
+
+
+def benford_summary_csv(table_name, field_name, counts):
+    """
+    Make the answer key's CSV of conformity statistics.
+    :param table_name: Table tampered with, e.g., invoices.
+    :param field_name: Field tampered with, e.g., TotalBTax.
+    :param counts: BenfordCounts, for the whole table.
+    :return: CSV text.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Table', 'Field', 'Data', 'Digits', 'Count',
+                     'Chi-square', 'Chi-square critical (5%)', 'MAD',
+                     'Conformity'])
+    for statistics in benford_statistics(counts):
+        writer.writerow([
+            table_name, field_name, statistics['data'], statistics['digits'],
+            statistics['count'], format_statistic(statistics['chi_square']),
+            statistics['chi_square_critical'],
+            format_statistic(statistics['mad']), statistics['conformity']])
+    return buffer.getvalue()
+
+
+def benford_digits_csv(counts):
+    """
+    Make the answer key's CSV of digit counts, for charts.
+    :param counts: BenfordCounts, for the whole table.
+    :return: CSV text.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Digits', 'Expected proportion', 'Clean count',
+                     'Tampered count'])
+    for digits in range(1, 100):
+        if digits < 10:
+            clean_count = counts.clean_first[digits]
+            tampered_count = counts.tampered_first[digits]
+        else:
+            clean_count = counts.clean_first_two[digits]
+            tampered_count = counts.tampered_first_two[digits]
+        writer.writerow([
+            digits, format_statistic(benford_proportions(digits)),
+            clean_count, tampered_count])
+    return buffer.getvalue()
+
+
+def format_statistic(value):
+    """ Format a statistic for a CSV. None, for no data, is blank. """
+    if value is None:
+        return ''
+    return '{value:.6f}'.format(value=value)
@@ -0,0 +1,154 @@
+"""
+Compressed bitmaps of row numbers, for the anomaly answer key.
+
+A RowBitmap is a Roaring bitmap. Row numbers are split by their high 16
+bits into containers of up to 65,536 rows. A container with few rows is
+a sorted array of their low 16 bits, two bytes a row. One with more than
+ARRAY_CONTAINER_MAX rows is a bitset, 8 KB whatever the count. Anomalies
+touch a small, scattered fraction of rows, so containers are mostly
+arrays, and a bitmap takes about two bytes per row touched.
+
+Bitmaps are serialized in the portable Roaring format, so any Roaring
+library can read them, e.g., pyroaring's BitMap.deserialize().
+"""
+
+import struct
+
+import numpy as np
+
+# Most rows in an array container. Bigger containers are bitsets.
+ARRAY_CONTAINER_MAX = 4096
+# Rows in a container.
+CONTAINER_ROWS = 1 << 16
+# Cookie that starts a portable Roaring bitmap with no run containers.
+SERIAL_COOKIE_NO_RUNCONTAINER = 12346
+
+
+class RowBitmap:
+    """
+    Set of row numbers, from 0 to 2 ** 32 - 1, added a chunk at a time.
+    """
+
+    def __init__(self):
+        # Containers by the high 16 bits of their rows. Each is a sorted
+        # uint16 array of the low 16 bits, or a boolean array of
+        # CONTAINER_ROWS, for a bitset.
+        self.containers = dict()
+
+    def __len__(self):
+        return sum(container_size(container)
+                   for container in self.containers.values())
+
+    def add(self, rows):
+        """
+        Add rows to the set.
+        :param rows: Array of row numbers. Needn't be sorted.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if len(rows) == 0:
+            return
+        if rows[0] < 0 or rows[-1] >= 1 << 32:
+            message = 'Row numbers must be from 0 to 2 ** 32 - 1, not {row}.'
+            raise ValueError(message.format(
+                row=rows[0] if rows[0] < 0 else rows[-1]))
+        keys = rows >> 16
+        lows = (rows & 0xFFFF).astype(np.uint16)
+        key_starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        key_ends = np.append(key_starts[1:], len(rows))
+        for start, end in zip(key_starts, key_ends):
+            key = int(keys[start])
+            container = self.containers.get(key)
+            if container is None:
+                container = lows[start:end]
+            elif container.dtype == bool:
+                container[lows[start:end]] = True
+            else:
+                container = np.union1d(container, lows[start:end])
+            if container.dtype != bool \
+                    and len(container) > ARRAY_CONTAINER_MAX:
+                bits = np.zeros(CONTAINER_ROWS, dtype=bool)
+                bits[container] = True
+                container = bits
+            self.containers[key] = container
+
+    def rows(self):
+        """
+        Get the rows in the set.
+        :return: Sorted array of row numbers.
+        """
+        parts = list()
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            if container.dtype == bool:
+                container = np.flatnonzero(container)
+            parts.append((key << 16) + container.astype(np.int64))
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def serialize(self):
+        """
+        Write the set in the portable Roaring format.
+        :return: bytes
+        """
+        keys = sorted(self.containers)
+        sizes = [container_size(self.containers[key]) for key in keys]
+        payloads = list()
+        for key in keys:
+            container = self.containers[key]
+            if container.dtype == bool:
+                payloads.append(np.packbits(container,
+                                            bitorder='little').tobytes())
+            else:
+                payloads.append(container.astype('<u2').tobytes())
+        # Cookie and number of containers, each container's key and size
+        # less one, then where each container starts.
+        header_size = 8 + 4 * len(keys) + 4 * len(keys)
+        offsets = np.cumsum([header_size]
+                            + [len(payload) for payload in payloads[:-1]])
+        header = [struct.pack('<II', SERIAL_COOKIE_NO_RUNCONTAINER,
+                              len(keys))]
+        header.extend(struct.pack('<HH', key, size - 1)
+                      for key, size in zip(keys, sizes))
+        header.extend(struct.pack('<I', offset)
+                      for offset in offsets[:len(keys)])
+        return b''.join(header + payloads)
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        Read a set written by serialize().
+        :param data: bytes in the portable Roaring format, with no run
+                containers.
+        :return: RowBitmap
+        """
+        cookie, number_containers = struct.unpack_from('<II', data)
+        if cookie != SERIAL_COOKIE_NO_RUNCONTAINER:
+            message = 'Not a Roaring bitmap without run containers: {cookie}'
+            raise ValueError(message.format(cookie=cookie))
+        descriptions = np.frombuffer(data, dtype='<u2',
+                                     count=2 * number_containers, offset=8)
+        offsets = np.frombuffer(data, dtype='<u4', count=number_containers,
+                                offset=8 + 4 * number_containers)
+        bitmap = cls()
+        for index in range(number_containers):
+            key = int(descriptions[2 * index])
+            size = int(descriptions[2 * index + 1]) + 1
+            offset = int(offsets[index])
+            if size > ARRAY_CONTAINER_MAX:
+                bitmap.containers[key] = np.unpackbits(
+                    np.frombuffer(data, dtype=np.uint8,
+                                  count=CONTAINER_ROWS // 8, offset=offset),
+                    bitorder='little').astype(bool)
+            else:
+                bitmap.containers[key] = np.frombuffer(
+                    data, dtype='<u2', count=size,
+                    offset=offset).astype(np.uint16)
+        return bitmap
+
+
+def container_size(container):
+    """ Number of rows in a container. """
+    if container.dtype == bool:
+        return int(container.sum())
+    return len(container)
@@ -0,0 +1,186 @@
+import io
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+from django.db import connection, transaction
+
+from feds.settings import DATABASES, FEDS_BULK_LOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class BulkLoader:
+    """
+    Load rows into a generated table in chunks.
+
+    Rows are sent with parameterized executemany() calls, chunk_size rows
+    at a time, so values are never pasted into the SQL, and no statement
+    grows with the size of the table. Each table is loaded in one
+    transaction.
+    :param chunk_size: Number of rows sent per executemany() call.
+    """
+
+    def __init__(self, chunk_size=FEDS_BULK_LOAD_CHUNK_SIZE):
+        if chunk_size < 1:
+            message = 'BulkLoader: bad chunk size: {size}'
+            raise ValueError(message.format(size=chunk_size))
+        self.chunk_size = chunk_size
+
+    def load(self, table_name, field_names, rows):
+        """
+        Insert rows into a table.
+        :param table_name: Name of the table.
+        :param field_names: Fields in each row, in order.
+        :param rows: Iterable of row tuples.
+        :return: Dict with load stats: table, rows, seconds, rows_per_sec.
+        """
+        sql = 'INSERT INTO {table} ({fields}) VALUES ({params})'.format(
+            table=table_name,
+            fields=', '.join(field_names),
+            params=', '.join(['%s'] * len(field_names))
+        )
+        number_rows = 0
+        start_time = time.perf_counter()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for chunk in self.chunks(rows):
+                    cursor.executemany(sql, chunk)
+                    number_rows += len(chunk)
+        return self.report(table_name, number_rows, start_time)
+
+    def chunks(self, rows):
+        """
+        Split rows into lists of at most chunk_size rows.
+        :param rows: Iterable of row tuples.
+        :return: Iterator of lists of rows.
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def report(self, table_name, number_rows, start_time):
+        """
+        Compute and log the stats for a table load.
+        :param table_name: Name of the table.
+        :param number_rows: Number of rows loaded.
+        :param start_time: time.perf_counter() when the load started.
+        :return: Dict with load stats.
+        """
+        seconds = time.perf_counter() - start_time
+        rows_per_sec = number_rows / seconds if seconds > 0 else 0
+        stats = {
+            'table': table_name,
+            'rows': number_rows,
+            'seconds': seconds,
+            'rows_per_sec': rows_per_sec,
+        }
+        message = 'Loaded {rows} rows into {table} in {seconds:.2f}s ' \
+                  '({rows_per_sec:.0f} rows/sec, chunk size {chunk_size}).'
+        logger.info(message.format(chunk_size=self.chunk_size, **stats))
+        return stats
+
+
+class PostgresCopyLoader(BulkLoader):
+    """
+    Load rows with PostgreSQL's COPY ... FROM STDIN.
+
+    Each chunk is encoded as CSV into an in-memory buffer, and streamed
+    to the server with psycopg2's copy_expert().
+    """
+
+    def load(self, table_name, field_names, rows):
+        sql = 'COPY {table} ({fields}) FROM STDIN WITH (FORMAT csv)'.format(
+            table=table_name,
+            fields=', '.join(field_names)
+        )
+        number_rows = 0
+        start_time = time.perf_counter()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for chunk in self.chunks(rows):
+                    buffer = io.StringIO(encode_rows(chunk, null_text=''))
+                    cursor.copy_expert(sql, buffer)
+                    number_rows += len(chunk)
+        return self.report(table_name, number_rows, start_time)
+
+
+class MysqlLoadDataLoader(BulkLoader):
+    """
+    Load rows with MySQL/MariaDB's LOAD DATA LOCAL INFILE.
+
+    The MySQL client library only reads LOCAL INFILE data from a file
+    path, so each chunk is encoded into a temporary file that is removed
+    once it is loaded. The connection needs the local_infile option.
+    """
+
+    def load(self, table_name, field_names, rows):
+        sql = """LOAD DATA LOCAL INFILE %s INTO TABLE {table}
+            CHARACTER SET utf8
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({fields})""".format(
+            table=table_name,
+            fields=', '.join(field_names)
+        )
+        number_rows = 0
+        start_time = time.perf_counter()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for chunk in self.chunks(rows):
+                    with tempfile.NamedTemporaryFile(
+                            'w', encoding='utf-8', suffix='.csv',
+                            delete=False) as chunk_file:
+                        chunk_file.write(encode_rows(chunk, null_text='NULL'))
+                    try:
+                        cursor.execute(sql, [chunk_file.name])
+                    finally:
+                        os.unlink(chunk_file.name)
+                    number_rows += len(chunk)
+        return self.report(table_name, number_rows, start_time)
+
+
+def make_bulk_loader(chunk_size=FEDS_BULK_LOAD_CHUNK_SIZE):
+    """
+    Make the fastest loader for the active DB backend.
+
+    PostgreSQL uses COPY, MySQL/MariaDB use LOAD DATA, anything else,
+    like SQLite, uses batched INSERTs.
+    :param chunk_size: Number of rows per chunk.
+    :return: BulkLoader
+    """
+    engine = DATABASES['default']['ENGINE']
+    if 'postgresql' in engine:
+        return PostgresCopyLoader(chunk_size)
+    if 'mysql' in engine:
+        return MysqlLoadDataLoader(chunk_size)
+    return BulkLoader(chunk_size)
+
+
+def encode_rows(rows, null_text):
+    """
+    Encode rows as CSV text for a native loader.
+
+    Strings are always quoted, with embedded quotes doubled, so they
+    can't be mistaken for NULL. Other values are written bare.
+    :param rows: List of row tuples.
+    :param null_text: What to write for None.
+    :return: CSV text, one line per row.
+    """
+    lines = list()
+    for row in rows:
+        values = list()
+        for value in row:
+            if value is None:
+                values.append(null_text)
+            elif isinstance(value, str):
+                values.append('"' + value.replace('"', '""') + '"')
+            else:
+                values.append(str(value))
+        lines.append(','.join(values))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,277 @@
+"""
+Make the chunks of a data set from the project's seed.
+
+These functions only take plain values: the seed, a ChunkPlan, settings
+already read from the project. They don't touch the DB or the project's
+settings, so they can run in worker processes, and a chunk comes out the
+same wherever it's made.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from generate.anomalies import Anomaly, AnomalyRows, BENFORDS_LAW, \
+    inject_anomalies
+from generate.columns import CUSTOMER_FIELDS, PRODUCT_FIELDS, \
+    INVOICE_FIELDS, INVOICE_DETAIL_FIELDS, JOINED_TABLE, JOINED_FIELDS, \
+    make_customer_columns, make_product_columns, make_invoice_columns, \
+    make_lines_per_invoice, join_invoice_lines, tamper_invoice_amounts
+from generate.streams import PRODUCT_STREAM, CUSTOMER_STREAM, \
+    INVOICE_COUNT_STREAM, LINE_COUNT_STREAM, INVOICE_STREAM, \
+    BENFORD_STREAM, make_rng
+
+# Where a chunk of customers starts, and where the numbers of its invoices
+# and detail lines start.
+ChunkPlan = namedtuple('ChunkPlan', [
+    'index', 'first_customer_id', 'number_customers',
+    'first_invoice_number', 'first_detail_number'])
+
+# A chunk's invoices: invoice columns, detail columns, offsets array
+# linking them, BenfordCounts for the Benford's law anomaly, or None, and
+# a list of AnomalyRows for the invoices tampered with for it.
+InvoiceChunk = namedtuple('InvoiceChunk', [
+    'invoice_columns', 'detail_columns', 'offsets', 'benford_counts',
+    'anomaly_rows'])
+
+
+def plan_chunks(seed, number_customers, invoice_count_range, chunk_size):
+    """
+    Split the customers into chunks, and work out where each chunk's ids
+    and numbers start. Only the counts are drawn, from their own streams,
+    so any chunk can be made without making the ones before it.
+    :param seed: The project's seed.
+    :param number_customers: Number of customers in the data set.
+    :param invoice_count_range: Tuple: min, max invoices per customer.
+    :param chunk_size: Number of customers per chunk.
+    :return: Iterator of ChunkPlan, in row order.
+    """
+    next_invoice_number = 1
+    next_detail_number = 1
+    chunk_starts = range(1, number_customers + 1, chunk_size)
+    for index, first_customer_id in enumerate(chunk_starts):
+        plan = ChunkPlan(
+            index, first_customer_id,
+            min(chunk_size, number_customers + 1 - first_customer_id),
+            next_invoice_number, next_detail_number)
+        _, lines_per_invoice = draw_chunk_counts(seed, plan,
+                                                 invoice_count_range)
+        yield plan
+        next_invoice_number += len(lines_per_invoice)
+        next_detail_number += int(lines_per_invoice.sum())
+
+
+def draw_chunk_counts(seed, plan, invoice_count_range):
+    """
+    Draw the number of invoices for each customer in a chunk, and the
+    number of lines on each invoice.
+    :param seed: The project's seed.
+    :param plan: ChunkPlan for the chunk.
+    :param invoice_count_range: Tuple: min, max invoices per customer.
+    :return: Tuple: invoices per customer, lines per invoice.
+    """
+    min_invoices, max_invoices = invoice_count_range
+    invoices_per_customer = make_rng(
+        seed, INVOICE_COUNT_STREAM, plan.index).integers(
+        min_invoices, max_invoices + 1, plan.number_customers)
+    lines_per_invoice = make_lines_per_invoice(
+        make_rng(seed, LINE_COUNT_STREAM, plan.index),
+        int(invoices_per_customer.sum()))
+    return invoices_per_customer, lines_per_invoice
+
+
+def make_product_table(seed, number_products, vocabularies, min_price,
+                       max_price):
+    """
+    Make the products. There are few, so they are one chunk.
+    :return: Dict of column arrays.
+    """
+    return make_product_columns(make_rng(seed, PRODUCT_STREAM),
+                                number_products, vocabularies,
+                                min_price, max_price)
+
+
+def make_customer_chunk(seed, plan, vocabularies):
+    """
+    Make the customers in a chunk.
+    :param seed: The project's seed.
+    :param plan: ChunkPlan for the chunk.
+    :param vocabularies: VocabularyStore with the names lists.
+    :return: Dict of column arrays.
+    """
+    return make_customer_columns(make_rng(seed, CUSTOMER_STREAM, plan.index),
+                                 plan.number_customers, vocabularies,
+                                 plan.first_customer_id)
+
+
+def make_invoice_chunk(seed, plan, invoice_count_range, sales_tax_rate,
+                       invoice_days, total_distribution, benford_tampering,
+                       product_columns):
+    """
+    Make the invoices and detail lines for a chunk of customers.
+    :param seed: The project's seed.
+    :param plan: ChunkPlan for the chunk.
+    :param invoice_count_range: Tuple: min, max invoices per customer.
+    :param sales_tax_rate: Sales tax rate, e.g., 0.06.
+    :param invoice_days: Array of days invoices can be on.
+    :param total_distribution: Distribution of invoice totals, or None.
+    :param benford_tampering: BenfordTampering for the Benford's law
+            anomaly, or None.
+    :param product_columns: The product table's columns.
+    :return: InvoiceChunk.
+    """
+    invoices_per_customer, lines_per_invoice = draw_chunk_counts(
+        seed, plan, invoice_count_range)
+    customer_ids = np.arange(plan.first_customer_id,
+                             plan.first_customer_id + plan.number_customers)
+    invoice_columns, detail_columns, offsets = make_invoice_columns(
+        make_rng(seed, INVOICE_STREAM, plan.index),
+        customer_ids,
+        invoices_per_customer,
+        product_columns['ProdPrice'],
+        sales_tax_rate,
+        invoice_days,
+        first_invoice_number=plan.first_invoice_number,
+        first_detail_number=plan.first_detail_number,
+        lines_per_invoice=lines_per_invoice,
+        total_distribution=total_distribution
+    )
+    benford_counts = None
+    anomaly_rows = list()
+    if benford_tampering is not None:
+        tampered, benford_counts = tamper_invoice_amounts(
+            make_rng(seed, BENFORD_STREAM, plan.index), invoice_columns,
+            benford_tampering, sales_tax_rate)
+        anomaly_rows.append(AnomalyRows(
+            Anomaly(BENFORDS_LAW, 'invoices', benford_tampering.field_name),
+            'invoices',
+            np.flatnonzero(tampered) + first_table_row(plan, 'invoices')))
+    return InvoiceChunk(invoice_columns, detail_columns, offsets,
+                        benford_counts, anomaly_rows)
+
+
+def first_table_row(plan, table_name):
+    """
+    Find the row number of a chunk's first row in one of the tables.
+    :param plan: ChunkPlan for the chunk.
+    :param table_name: Name of the table, e.g., invoices.
+    :return: Row number, from 0.
+    """
+    if table_name == 'customers':
+        return plan.first_customer_id - 1
+    if table_name == 'invoices':
+        return plan.first_invoice_number - 1
+    # Detail lines, or the invoice lines joined to them.
+    return plan.first_detail_number - 1
+
+
+def inject_chunk_anomalies(anomaly_plan, plan, table_name, columns):
+    """
+    Put anomalies into a chunk of a table.
+    :param anomaly_plan: AnomalyPlan, or None for no anomalies.
+    :param plan: ChunkPlan for the chunk.
+    :return: Tuple: dict of columns, list of AnomalyRows. See
+            generate.anomalies.inject_anomalies().
+    """
+    return inject_anomalies(anomaly_plan, plan.index,
+                            first_table_row(plan, table_name), table_name,
+                            columns)
+
+
+def join_chunk_anomalies(anomaly_plan, plan, product_columns,
+                         customer_columns, invoice_chunk):
+    """
+    Join a chunk's invoice lines to their invoices, customers and
+    products, with anomalies put in.
+
+    Anomalies on the products, customers and invoices are put into those
+    tables before they're joined, so an invoice has the same values on
+    each of its lines, and the answer key has rows of those tables. Only
+    anomalies on the detail lines are put into the joined table.
+    :param anomaly_plan: AnomalyPlan, or None for no anomalies.
+    :param plan: ChunkPlan for the chunk.
+    :param product_columns: The clean product table.
+    :param customer_columns: The chunk's clean customers.
+    :param invoice_chunk: InvoiceChunk for the chunk.
+    :return: Tuple: dict of the joined columns, list of AnomalyRows.
+    """
+    # Every chunk puts the same anomalies into the products, so only the
+    # first chunk's product rows go into the answer key.
+    products, product_rows = inject_anomalies(
+        anomaly_plan, 0, 0, 'products', product_columns)
+    if plan.index != 0:
+        product_rows = list()
+    customers, customer_rows = inject_chunk_anomalies(
+        anomaly_plan, plan, 'customers', customer_columns)
+    invoices, invoice_rows = inject_chunk_anomalies(
+        anomaly_plan, plan, 'invoices', invoice_chunk.invoice_columns)
+    joined, line_rows = inject_chunk_anomalies(
+        anomaly_plan, plan, JOINED_TABLE, join_invoice_lines(
+            product_columns, customer_columns, invoice_chunk,
+            (products, customers, invoices)))
+    return joined, product_rows + customer_rows + invoice_rows + line_rows
+
+
+def iterate_table_chunks(seed, number_products, number_customers,
+                         vocabularies, invoice_count_range, sales_tax_rate,
+                         invoice_days, total_distribution, benford_tampering,
+                         anomaly_plan, min_price, max_price, chunk_size,
+                         joined=False, tally=None):
+    """
+    Make all of the tables, one table after another, a chunk at a time.
+    Invoices and their detail lines are made together, so each invoice
+    chunk is made twice, once for the invoices and again for the details.
+    That costs time, but nothing has to be kept between tables.
+    :param anomaly_plan: AnomalyPlan for the anomalies to put in, or None.
+    :param joined: True to make one table of invoice lines, joined to
+            their invoices, customers and products, instead.
+    :param tally: Optional function called with the InvoiceChunk, once
+            per chunk, when it's made for the invoices, or None, and the
+            list of AnomalyRows, for each chunk of each table.
+    :return: Iterator of tuples: table name, field names, columns.
+    """
+    product_columns = make_product_table(seed, number_products, vocabularies,
+                                         min_price, max_price)
+    plans = list(plan_chunks(seed, number_customers, invoice_count_range,
+                             chunk_size))
+    if joined:
+        for plan in plans:
+            invoice_chunk = make_invoice_chunk(
+                seed, plan, invoice_count_range, sales_tax_rate,
+                invoice_days, total_distribution, benford_tampering,
+                product_columns)
+            columns, anomaly_rows = join_chunk_anomalies(
+                anomaly_plan, plan, product_columns,
+                make_customer_chunk(seed, plan, vocabularies),
+                invoice_chunk)
+            if tally is not None:
+                tally(invoice_chunk, anomaly_rows)
+            yield JOINED_TABLE, JOINED_FIELDS, columns
+        return
+    # Invoices are made from the clean products.
+    columns, anomaly_rows = inject_anomalies(anomaly_plan, 0, 0, 'products',
+                                             product_columns)
+    if tally is not None:
+        tally(None, anomaly_rows)
+    yield 'products', PRODUCT_FIELDS, columns
+    for plan in plans:
+        columns, anomaly_rows = inject_chunk_anomalies(
+            anomaly_plan, plan, 'customers',
+            make_customer_chunk(seed, plan, vocabularies))
+        if tally is not None:
+            tally(None, anomaly_rows)
+        yield 'customers', CUSTOMER_FIELDS, columns
+    for table_name, field_names, chunk_part in [
+            ('invoices', INVOICE_FIELDS, 0),
+            ('invoice_details', INVOICE_DETAIL_FIELDS, 1)]:
+        for plan in plans:
+            invoice_chunk = make_invoice_chunk(
+                seed, plan, invoice_count_range, sales_tax_rate,
+                invoice_days, total_distribution, benford_tampering,
+                product_columns)
+            columns, anomaly_rows = inject_chunk_anomalies(
+                anomaly_plan, plan, table_name, invoice_chunk[chunk_part])
+            if tally is not None:
+                tally(invoice_chunk if chunk_part == 0 else None,
+                      anomaly_rows)
+            yield table_name, field_names, columns
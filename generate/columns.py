@@ -0,0 +1,443 @@
+"""
+Vectorized makers for the columns of generated tables.
+
+Each maker draws all of the random values for a table as NumPy arrays in
+one go, with no per-row Python work. Text made of words is kept as
+WordColumns of vocabulary indices, and only looked up when it's
+exported. Columns come back in a dict, keyed by field name, in the same
+order as the fields in the table.
+
+Invoices and their detail lines are laid out like a CSR sparse matrix:
+the detail columns are flat arrays, and an offsets array links them to
+invoices. The lines for invoice i are rows offsets[i] to offsets[i + 1] - 1
+of the detail columns.
+
+Money is computed in integer cents, so the roll-ups add up exactly, and
+converted to dollars at the end.
+
+Tables are joined by their integer keys. Ids and numbers are dense, so
+an array laid out by key finds each row with one indexing step, with no
+sorting or hashing.
+"""
+
+import numpy as np
+
+from feds.settings import FEDS_MIN_LINES_PER_INVOICE, \
+    FEDS_MAX_LINES_PER_INVOICE, FEDS_MIN_LINE_QUANTITY, \
+    FEDS_MAX_LINE_QUANTITY, FEDS_PAYMENT_TYPES, FEDS_CASH, \
+    FEDS_CREDIT_TERMS, FEDS_CASH_CREDIT_TERMS, FEDS_SHIPPING_METHODS, \
+    FEDS_SHIPPING_TERMS
+from generate.benford import tamper_amounts
+from generate.distributions import sample_distribution, fit_lines
+from generate.vocabulary import WordColumn, WordIndices, resolve_column, \
+    take_column
+
+# Fields in the customer table, in table order.
+CUSTOMER_FIELDS = ('CustomerId', 'CName', 'CStreetAndNumber', 'CZipCode',
+                   'CPhone', 'CEmail')
+
+# Fields in the product table, in table order.
+PRODUCT_FIELDS = ('ProductId', 'ProductName', 'Description', 'ProdPrice')
+
+# Fields in the invoice table, in table order.
+INVOICE_FIELDS = ('InvoiceNumber', 'CustomerId', 'InvoiceDate',
+                  'PaymentType', 'CreditTerms', 'DueDate', 'ShippingMethod',
+                  'ShippingTerms', 'TotalBTax', 'SalesTax', 'Total')
+
+# Fields in the invoice detail table, in table order.
+INVOICE_DETAIL_FIELDS = ('InvDetailNumber', 'InvoiceNumber', 'ProductId',
+                         'Quantity', 'SubtotalProduct')
+
+# Table of invoice lines joined to their invoices, customers and
+# products, for the "Joined" export objects setting.
+JOINED_TABLE = 'invoice_lines'
+
+# Fields in the joined table, in table order.
+JOINED_FIELDS = ('InvDetailNumber', 'InvoiceNumber', 'InvoiceDate',
+                 'CustomerId', 'CName', 'CStreetAndNumber', 'CZipCode',
+                 'CPhone', 'CEmail', 'PaymentType', 'CreditTerms', 'DueDate',
+                 'ShippingMethod', 'ShippingTerms', 'TotalBTax', 'SalesTax',
+                 'Total', 'ProductId', 'ProductName', 'Description',
+                 'ProdPrice', 'Quantity', 'SubtotalProduct')
+
+# Money fields, in dollars, exact to the cent.
+MONEY_FIELDS = ('ProdPrice', 'TotalBTax', 'SalesTax', 'Total',
+                'SubtotalProduct')
+
+# Fields that only take a few values, and what the values are.
+CATEGORY_FIELDS = {
+    'PaymentType': tuple(code for code, label in FEDS_PAYMENT_TYPES),
+    'CreditTerms': (FEDS_CASH_CREDIT_TERMS,)
+    + tuple(terms for terms, days in FEDS_CREDIT_TERMS),
+    'ShippingMethod': tuple(FEDS_SHIPPING_METHODS),
+    'ShippingTerms': tuple(FEDS_SHIPPING_TERMS),
+}
+
+
+def make_customer_columns(rng, number_customers, vocabularies, first_id=1):
+    """
+    Make the columns for a block of customers.
+    :param rng: numpy.random.Generator to draw from.
+    :param number_customers: How many customers to make.
+    :param vocabularies: VocabularyStore with the names lists.
+    :param first_id: CustomerId of the first customer in the block.
+    :return: Dict of columns, keyed by field name.
+    """
+    first_names = vocabularies['first_names']
+    last_names = vocabularies['last_names']
+    street_names = vocabularies['street_names']
+    street_types = vocabularies['street_types']
+    town_names = vocabularies['town_names']
+    zip_codes = vocabularies['zip_codes']
+    tlds = vocabularies['tlds']
+    # Draw every index for the block at once.
+    first_name_index = rng.integers(0, len(first_names), number_customers)
+    last_name_index = rng.integers(0, len(last_names), number_customers)
+    street_numbers = rng.integers(10, 1000, number_customers)
+    street_name_index = rng.integers(0, len(street_names), number_customers)
+    street_type_index = rng.integers(0, len(street_types), number_customers)
+    town_index = rng.integers(0, len(town_names), number_customers)
+    zip_index = rng.integers(0, len(zip_codes), number_customers)
+    area_codes = rng.integers(211, 800, number_customers)
+    exchanges = rng.integers(211, 800, number_customers)
+    line_numbers = rng.integers(2111, 8000, number_customers)
+    tld_index = rng.integers(0, len(tlds), number_customers)
+    # All three phone parts are fixed width, so do the arithmetic once.
+    phones = (area_codes * 10000000 + exchanges * 10000 + line_numbers) \
+        .astype(str)
+    return {
+        'CustomerId': np.arange(first_id, first_id + number_customers),
+        'CName': WordColumn([
+            WordIndices(first_names, first_name_index, None), ' ',
+            WordIndices(last_names, last_name_index, None),
+        ]),
+        'CStreetAndNumber': WordColumn([
+            street_numbers, ' ',
+            WordIndices(street_names, street_name_index, None), ' ',
+            WordIndices(street_types, street_type_index, None), ', ',
+            WordIndices(town_names, town_index, None),
+        ]),
+        'CZipCode': WordColumn([WordIndices(zip_codes, zip_index, None)]),
+        'CPhone': phones,
+        'CEmail': WordColumn([
+            WordIndices(first_names, first_name_index, 'lower'), '@',
+            WordIndices(last_names, last_name_index, 'lower'), '.',
+            WordIndices(tlds, tld_index, None),
+        ]),
+    }
+
+
+def make_product_columns(rng, number_products, vocabularies, min_price,
+                         max_price, first_id=1):
+    """
+    Make the columns for a block of products.
+    :param rng: numpy.random.Generator to draw from.
+    :param number_products: How many products to make.
+    :param vocabularies: VocabularyStore with the names lists.
+    :param min_price: Lowest product price.
+    :param max_price: Highest product price.
+    :param first_id: ProductId of the first product in the block.
+    :return: Dict of columns, keyed by field name.
+    """
+    adjectives = vocabularies['product_adjectives']
+    product_types = vocabularies['product_types']
+    descriptions = vocabularies['product_descriptions']
+    adjective_index = rng.integers(0, len(adjectives), number_products)
+    type_index = rng.integers(0, len(product_types), number_products)
+    description_index = rng.integers(0, len(descriptions), number_products)
+    prices = min_price + rng.random(number_products) * (max_price - min_price)
+    return {
+        'ProductId': np.arange(first_id, first_id + number_products),
+        'ProductName': WordColumn([
+            WordIndices(adjectives, adjective_index, 'capitalize'), ' ',
+            WordIndices(product_types, type_index, None),
+        ]),
+        'Description': WordColumn([
+            WordIndices(descriptions, description_index, None)]),
+        'ProdPrice': np.round(prices, 2),
+    }
+
+
+def make_invoice_columns(rng, customer_ids, invoices_per_customer,
+                         product_prices, sales_tax_rate, invoice_days,
+                         first_invoice_number=1, first_detail_number=1,
+                         lines_per_invoice=None, total_distribution=None):
+    """
+    Make the columns for the invoices of a block of customers, and their
+    detail lines.
+    :param rng: numpy.random.Generator to draw from.
+    :param customer_ids: Array of the customers' ids.
+    :param invoices_per_customer: Array, number of invoices for each customer.
+    :param product_prices: Array of product prices. Product ids start at 1.
+    :param sales_tax_rate: Sales tax rate, e.g., 0.06.
+    :param invoice_days: Array of datetime64[D] days invoices can be on.
+    :param first_invoice_number: InvoiceNumber of the first invoice.
+    :param first_detail_number: InvDetailNumber of the first detail line.
+    :param lines_per_invoice: Array, number of detail lines on each invoice.
+            Drawn from rng if None.
+    :param total_distribution: Distribution to draw TotalBTax from, see
+            generate.distributions. If None, products and quantities are
+            drawn uniformly, and the totals are what they add up to.
+    :return: Tuple: invoice columns, detail columns, offsets array.
+    """
+    invoices_per_customer = np.asarray(invoices_per_customer, dtype=np.int64)
+    number_invoices = int(invoices_per_customer.sum())
+    invoice_numbers = np.arange(first_invoice_number,
+                                first_invoice_number + number_invoices)
+    if lines_per_invoice is None:
+        lines_per_invoice = make_lines_per_invoice(rng, number_invoices)
+    # Line counts, then their running sum, link invoices to their lines.
+    offsets = np.zeros(number_invoices + 1, dtype=np.int64)
+    np.cumsum(lines_per_invoice, out=offsets[1:])
+    number_lines = int(offsets[-1])
+    # Detail lines.
+    price_cents = np.rint(np.asarray(product_prices) * 100).astype(np.int64)
+    if total_distribution is None:
+        product_index = rng.integers(0, len(price_cents), number_lines)
+        quantities = rng.integers(FEDS_MIN_LINE_QUANTITY,
+                                  FEDS_MAX_LINE_QUANTITY + 1, number_lines)
+    else:
+        # Draw the totals, then fit the lines to them.
+        target_cents = np.rint(sample_distribution(
+            rng, total_distribution, number_invoices) * 100)
+        product_index, quantities = fit_lines(
+            rng, target_cents, np.asarray(lines_per_invoice), price_cents)
+    subtotal_cents = quantities * price_cents[product_index]
+    # Roll the lines up into the invoice totals.
+    total_bt_cents = sum_lines(subtotal_cents, offsets)
+    sales_tax_cents = np.rint(total_bt_cents * sales_tax_rate) \
+        .astype(np.int64)
+    # Payment, credit terms and due dates.
+    payment_types = np.array([code for code, label in FEDS_PAYMENT_TYPES])
+    payment_type_index = rng.integers(0, len(payment_types), number_invoices)
+    is_cash = payment_types[payment_type_index] == FEDS_CASH
+    credit_terms = np.array([FEDS_CASH_CREDIT_TERMS]
+                            + [terms for terms, days in FEDS_CREDIT_TERMS])
+    credit_days = np.array([0] + [days for terms, days in FEDS_CREDIT_TERMS])
+    # Cash invoices get terms 0, credit ones a random entry after that.
+    terms_index = rng.integers(1, len(credit_terms), number_invoices)
+    terms_index[is_cash] = 0
+    invoice_dates = invoice_days[rng.integers(0, len(invoice_days),
+                                              number_invoices)]
+    due_dates = invoice_dates + credit_days[terms_index].astype(
+        'timedelta64[D]')
+    shipping_methods = np.array(FEDS_SHIPPING_METHODS)
+    shipping_terms = np.array(FEDS_SHIPPING_TERMS)
+    invoice_columns = {
+        'InvoiceNumber': invoice_numbers,
+        'CustomerId': np.repeat(customer_ids, invoices_per_customer),
+        'InvoiceDate': invoice_dates,
+        'PaymentType': payment_types[payment_type_index],
+        'CreditTerms': credit_terms[terms_index],
+        'DueDate': due_dates,
+        'ShippingMethod': shipping_methods[
+            rng.integers(0, len(shipping_methods), number_invoices)],
+        'ShippingTerms': shipping_terms[
+            rng.integers(0, len(shipping_terms), number_invoices)],
+        'TotalBTax': cents_to_dollars(total_bt_cents),
+        'SalesTax': cents_to_dollars(sales_tax_cents),
+        'Total': cents_to_dollars(total_bt_cents + sales_tax_cents),
+    }
+    detail_columns = {
+        'InvDetailNumber': np.arange(first_detail_number,
+                                     first_detail_number + number_lines),
+        'InvoiceNumber': np.repeat(invoice_numbers, lines_per_invoice),
+        'ProductId': product_index + 1,
+        'Quantity': quantities,
+        'SubtotalProduct': cents_to_dollars(subtotal_cents),
+    }
+    return invoice_columns, detail_columns, offsets
+
+
+def tamper_invoice_amounts(rng, invoice_columns, tampering, sales_tax_rate):
+    """
+    Tamper with the first digits of one of the invoices' money fields, for
+    the Benford's law anomaly. If it's TotalBTax, SalesTax and Total are
+    worked out again from it, so only the detail lines don't add up.
+    :param rng: numpy.random.Generator to draw from.
+    :param invoice_columns: The invoices' columns. Changed in place.
+    :param tampering: BenfordTampering, see generate.benford.
+    :param sales_tax_rate: Sales tax rate, e.g., 0.06.
+    :return: Tuple: boolean mask of the invoices tampered with,
+            BenfordCounts.
+    """
+    cents = np.rint(invoice_columns[tampering.field_name] * 100) \
+        .astype(np.int64)
+    tampered, counts = tamper_amounts(rng, cents, tampering.fraction,
+                                      tampering.digit_weights)
+    invoice_columns[tampering.field_name] = cents_to_dollars(cents)
+    if tampering.field_name == 'TotalBTax':
+        total_bt_cents = cents[tampered]
+        sales_tax_cents = np.rint(total_bt_cents * sales_tax_rate) \
+            .astype(np.int64)
+        invoice_columns['SalesTax'][tampered] = cents_to_dollars(
+            sales_tax_cents)
+        invoice_columns['Total'][tampered] = cents_to_dollars(
+            total_bt_cents + sales_tax_cents)
+    return tampered, counts
+
+
+def make_lines_per_invoice(rng, number_invoices):
+    """
+    Draw the number of detail lines on each of a block of invoices.
+    :param rng: numpy.random.Generator to draw from.
+    :param number_invoices: Number of invoices.
+    :return: Array, one line count per invoice.
+    """
+    return rng.integers(FEDS_MIN_LINES_PER_INVOICE,
+                        FEDS_MAX_LINES_PER_INVOICE + 1, number_invoices)
+
+
+def sum_lines(line_values, offsets):
+    """
+    Add up the detail line values for each invoice.
+    :param line_values: Array, one value per detail line.
+    :param offsets: Offsets array linking invoices to their lines.
+    :return: Array, one total per invoice.
+    """
+    # Cumulative sums avoid reduceat()'s trouble with empty slices.
+    running = np.zeros(len(line_values) + 1, dtype=line_values.dtype)
+    np.cumsum(line_values, out=running[1:])
+    return running[offsets[1:]] - running[offsets[:-1]]
+
+
+def cents_to_dollars(cents):
+    """
+    Convert integer cents to dollars.
+    :param cents: Array of cents.
+    :return: Array of dollars, rounded to the cent.
+    """
+    return np.round(cents / 100, 2)
+
+
+def days_in_range(start_date, end_date, weekmask):
+    """
+    List the days in a date range that fall on working days.
+    :param start_date: First day, datetime.date.
+    :param end_date: Last day, datetime.date, included.
+    :param weekmask: Working days, Monday first, e.g., '1111100'.
+    :return: Array of datetime64[D].
+    """
+    days = np.arange(np.datetime64(start_date, 'D'),
+                     np.datetime64(end_date, 'D') + 1)
+    days = days[np.is_busday(days, weekmask=weekmask)]
+    if len(days) == 0:
+        message = 'No working days between {start} and {end}.'
+        raise ValueError(message.format(start=start_date, end=end_date))
+    return days
+
+
+def concatenate_columns(blocks):
+    """
+    Join blocks of columns for the same table into one set of columns.
+    :param blocks: Iterable of dicts of column arrays, in row order.
+    :return: Dict of column arrays.
+    """
+    blocks = list(blocks)
+    columns = dict()
+    for field_name in blocks[0]:
+        parts = [resolve_column(block[field_name]) for block in blocks]
+        # Masked arrays, with missing values, stay masked.
+        if any(np.ma.isMaskedArray(part) for part in parts):
+            columns[field_name] = np.ma.concatenate(parts)
+        else:
+            columns[field_name] = np.concatenate(parts)
+    return columns
+
+
+def concatenate_offsets(offsets_list):
+    """
+    Join the offsets arrays of blocks of invoices, in row order.
+    :param offsets_list: Iterable of offsets arrays, each starting at 0.
+    :return: Offsets array for all of the invoices.
+    """
+    pieces = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for offsets in offsets_list:
+        pieces.append(offsets[1:] + base)
+        base += offsets[-1]
+    return np.concatenate(pieces)
+
+
+def key_positions(keys, table_keys):
+    """
+    Find the rows of a table with the given keys, by indexing an array
+    laid out by key.
+    :param keys: Array of integer keys to look up.
+    :param table_keys: The table's key column. Keys are unique, and close
+            together, like ids.
+    :return: Array of row positions, one for each key.
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if len(table_keys) == 0:
+        raise ValueError('key_positions: key not in table.')
+    first_key = table_keys.min()
+    # -1 where there's no row with the key.
+    lookup = np.full(table_keys.max() - first_key + 1, -1, dtype=np.int64)
+    lookup[table_keys - first_key] = np.arange(len(table_keys))
+    shifted = keys - first_key
+    if shifted.min() < 0 or shifted.max() >= len(lookup):
+        raise ValueError('key_positions: key not in table.')
+    positions = lookup[shifted]
+    if (positions < 0).any():
+        raise ValueError('key_positions: key not in table.')
+    return positions
+
+
+def join_invoice_lines(product_columns, customer_columns, invoice_chunk,
+                       value_tables=None):
+    """
+    Join a chunk's invoice lines to their invoices, their invoices'
+    customers, and their products. Words stay as vocabulary indices.
+
+    Each field comes from the table it belongs to: customer fields, like
+    CustomerId, from the customers, invoice fields, like InvoiceNumber,
+    from the invoices, and product fields from the products. Only the
+    lines' own fields come from the detail lines.
+    :param product_columns: The product table's columns.
+    :param customer_columns: The chunk's customers.
+    :param invoice_chunk: InvoiceChunk with the customers' invoices, see
+            generate.chunks.
+    :param value_tables: Optional tuple of the product, customer and
+            invoice columns to take values from, e.g., with anomalies put
+            in. Rows are still matched on the keys in product_columns,
+            customer_columns and invoice_chunk.
+    :return: Dict of columns, keyed by field name, in JOINED_FIELDS order.
+    """
+    invoice_columns = invoice_chunk.invoice_columns
+    detail_columns = invoice_chunk.detail_columns
+    invoice_positions = key_positions(detail_columns['InvoiceNumber'],
+                                      invoice_columns['InvoiceNumber'])
+    customer_positions = key_positions(invoice_columns['CustomerId'],
+                                       customer_columns['CustomerId'])[
+        invoice_positions]
+    product_positions = key_positions(detail_columns['ProductId'],
+                                      product_columns['ProductId'])
+    if value_tables is not None:
+        product_columns, customer_columns, invoice_columns = value_tables
+    joined = dict()
+    for field_name in JOINED_FIELDS:
+        if field_name in customer_columns:
+            joined[field_name] = take_column(customer_columns[field_name],
+                                             customer_positions)
+        elif field_name in invoice_columns:
+            joined[field_name] = take_column(invoice_columns[field_name],
+                                             invoice_positions)
+        elif field_name in product_columns:
+            joined[field_name] = take_column(product_columns[field_name],
+                                             product_positions)
+        else:
+            joined[field_name] = detail_columns[field_name]
+    return joined
+
+
+def column_rows(columns, field_names):
+    """
+    Iterate over the rows in a set of columns.
+    :param columns: Dict of columns.
+    :param field_names: Fields to include, in order.
+    :return: Iterator of tuples of Python values.
+    """
+    return zip(*[resolve_column(columns[field_name]).tolist()
+                 for field_name in field_names])
@@ -0,0 +1,170 @@
+"""
+Draw amounts, like invoice totals, from statistical distributions, for a
+whole block of rows in one go.
+
+Distributions are plain tuples, so they can be sent to worker processes.
+Bounds are applied by drawing again for the values outside them, a
+vectorized step that only touches the values still out of bounds.
+
+Invoice totals are drawn first. Then each invoice's detail lines are
+fitted to its total: the total is split across the lines, and each line
+gets a product and quantity that come close to its share. The invoice's
+TotalBTax is what its lines add up to, so the arithmetic is always right.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from feds.settings import FEDS_NORMAL_DISTRIBUTION, \
+    FEDS_SKEWED_DISTRIBUTION, FEDS_MIXED_DISTRIBUTION, \
+    FEDS_NORMAL_DISTRIBUTION_SD_RATIO, FEDS_SKEWED_DISTRIBUTION_SIGMA, \
+    FEDS_MIXED_DISTRIBUTION_COMPONENTS, FEDS_MIN_TOTAL_BEFORE_TAX, \
+    FEDS_MAX_TOTAL_BEFORE_TAX, FEDS_MIN_LINE_QUANTITY, FEDS_MAX_LINE_QUANTITY
+
+# Normal distribution, cut off at low and high.
+TruncatedNormal = namedtuple('TruncatedNormal',
+                             ['mean', 'sd', 'low', 'high'])
+
+# Lognormal distribution, skewed right, cut off at low and high. mean is
+# the mean before the cut, sigma the log's standard deviation.
+LogNormal = namedtuple('LogNormal', ['mean', 'sigma', 'low', 'high'])
+
+# Mix of distributions. Each value comes from one of the components,
+# picked with the given weights.
+Mixture = namedtuple('Mixture', ['weights', 'components'])
+
+# Times to draw again for values out of bounds, before clipping them.
+MAX_REDRAWS = 20
+
+
+def make_total_distribution(kind, mean, low=FEDS_MIN_TOTAL_BEFORE_TAX,
+                            high=FEDS_MAX_TOTAL_BEFORE_TAX):
+    """
+    Make the distribution for invoice totals from a project's settings.
+    :param kind: FEDS_NORMAL_DISTRIBUTION, FEDS_SKEWED_DISTRIBUTION, or
+            FEDS_MIXED_DISTRIBUTION.
+    :param mean: Mean total, in dollars.
+    :param low: Lowest total.
+    :param high: Highest total.
+    :return: Distribution.
+    """
+    if kind == FEDS_NORMAL_DISTRIBUTION:
+        return TruncatedNormal(mean, mean * FEDS_NORMAL_DISTRIBUTION_SD_RATIO,
+                               low, high)
+    if kind == FEDS_SKEWED_DISTRIBUTION:
+        return LogNormal(mean, FEDS_SKEWED_DISTRIBUTION_SIGMA, low, high)
+    if kind == FEDS_MIXED_DISTRIBUTION:
+        # Components are given relative to the mean.
+        weights = list()
+        components = list()
+        for weight, mean_ratio, sigma in FEDS_MIXED_DISTRIBUTION_COMPONENTS:
+            weights.append(weight)
+            components.append(LogNormal(mean * mean_ratio, sigma, low, high))
+        return Mixture(tuple(weights), tuple(components))
+    message = 'Bad distribution: "{kind}"'
+    raise ValueError(message.format(kind=kind))
+
+
+def sample_distribution(rng, distribution, size):
+    """
+    Draw values from a distribution.
+    :param rng: numpy.random.Generator to draw from.
+    :param distribution: TruncatedNormal, LogNormal, or Mixture.
+    :param size: Number of values.
+    :return: Array of floats.
+    """
+    if isinstance(distribution, TruncatedNormal):
+        return draw_bounded(
+            lambda count: rng.normal(distribution.mean, distribution.sd,
+                                     count),
+            distribution.low, distribution.high, size)
+    if isinstance(distribution, LogNormal):
+        # The log's mean that gives the wanted mean.
+        log_mean = np.log(distribution.mean) - distribution.sigma ** 2 / 2
+        return draw_bounded(
+            lambda count: rng.lognormal(log_mean, distribution.sigma, count),
+            distribution.low, distribution.high, size)
+    if isinstance(distribution, Mixture):
+        weights = np.asarray(distribution.weights, dtype=float)
+        picks = rng.choice(len(weights), size, p=weights / weights.sum())
+        values = np.empty(size)
+        for index, component in enumerate(distribution.components):
+            is_picked = picks == index
+            values[is_picked] = sample_distribution(rng, component,
+                                                    int(is_picked.sum()))
+        return values
+    message = 'Bad distribution: {distribution}'
+    raise ValueError(message.format(distribution=distribution))
+
+
+def draw_bounded(draw, low, high, size):
+    """
+    Draw values, and draw again for those outside the bounds, which
+    gives the distribution cut off at the bounds. Values still out of
+    bounds after MAX_REDRAWS are clipped.
+    :param draw: Function that takes a count, and returns that many values.
+    :param low: Lowest value.
+    :param high: Highest value.
+    :param size: Number of values.
+    :return: Array of floats.
+    """
+    values = draw(size)
+    out_of_bounds = np.flatnonzero((values < low) | (values > high))
+    for attempt in range(MAX_REDRAWS):
+        if len(out_of_bounds) == 0:
+            break
+        redrawn = draw(len(out_of_bounds))
+        values[out_of_bounds] = redrawn
+        out_of_bounds = out_of_bounds[(redrawn < low) | (redrawn > high)]
+    np.clip(values, low, high, out=values)
+    return values
+
+
+def fit_lines(rng, target_cents, lines_per_invoice, price_cents):
+    """
+    Pick products and quantities for invoice lines, so each invoice's
+    lines add up to close to its target total.
+
+    Each target is split across its invoice's lines, at random. Each line
+    draws the quantity it would like, and takes a product priced near its
+    share over that quantity. Its quantity is then the one that comes
+    closest to its share, within the quantity limits.
+    :param rng: numpy.random.Generator to draw from.
+    :param target_cents: Array of target totals, one per invoice.
+    :param lines_per_invoice: Array, number of lines on each invoice.
+    :param price_cents: Array of product prices, in cents.
+    :return: Tuple: array of product indices, array of quantities, one of
+            each per line.
+    """
+    number_lines = int(lines_per_invoice.sum())
+    # Random shares of each invoice's total.
+    weights = rng.exponential(size=number_lines)
+    invoice_index = np.repeat(np.arange(len(lines_per_invoice)),
+                              lines_per_invoice)
+    weight_totals = np.bincount(invoice_index, weights,
+                                len(lines_per_invoice))
+    share_cents = target_cents[invoice_index] * weights \
+        / weight_totals[invoice_index]
+    # Products, in price order, and where the price each line would like
+    # falls among them.
+    price_order = np.argsort(price_cents, kind='stable')
+    sorted_prices = price_cents[price_order]
+    wanted_quantities = rng.integers(FEDS_MIN_LINE_QUANTITY,
+                                     FEDS_MAX_LINE_QUANTITY + 1, number_lines)
+    # Prices are whole cents, and few, so a table of positions by cent
+    # takes the place of a binary search for each line.
+    position_by_cent = np.searchsorted(
+        sorted_prices, np.arange(sorted_prices[-1] + 2))
+    wanted_cents = np.ceil(share_cents / wanted_quantities).astype(np.int64)
+    np.clip(wanted_cents, 0, len(position_by_cent) - 1, out=wanted_cents)
+    positions = position_by_cent[wanted_cents]
+    # Take the product just above or below the wanted price, at random.
+    positions -= rng.integers(0, 2, number_lines)
+    np.clip(positions, 0, len(sorted_prices) - 1, out=positions)
+    product_index = price_order[positions]
+    quantities = np.rint(share_cents / price_cents[product_index]) \
+        .astype(np.int64)
+    np.clip(quantities, FEDS_MIN_LINE_QUANTITY, FEDS_MAX_LINE_QUANTITY,
+            out=quantities)
+    return product_index, quantities
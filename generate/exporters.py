@@ -0,0 +1,561 @@
+"""
+Exporters turn chunks of generated tables into export files.
+
+The generator calls write_chunk() once for each chunk of each table, as
+soon as the chunk is made. Chunks of a table arrive in row order.
+
+An exporter can also do the slow part of the work in worker processes.
+Its encode_tables is then a module level function that takes a list of
+(table_name, field_names, columns) tuples, and returns something to pass
+to its write_encoded(), which runs in the generator's process, in row
+order.
+
+close() is called once every chunk has been written.
+
+The SQLite exporter loads every table into one database file, and adds
+it to the archive when it's closed. It has separate_tables set, so it's
+always sent the separate tables, and joins them with a view.
+
+The Parquet and Arrow IPC exporters need pyarrow. It's only imported when
+one of them is used.
+"""
+
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+
+from feds.settings import FEDS_EXPORT_FORMAT_CSV, \
+    FEDS_EXPORT_FORMAT_PARQUET, FEDS_EXPORT_FORMAT_ARROW, \
+    FEDS_EXPORT_FORMAT_SQLITE, FEDS_SQLITE_TRANSACTION_ROWS, \
+    FEDS_EXPORT_BATCH_SIZE
+from generate.anomalies import DUPLICATE_VALUES, MISSING
+from generate.archive import COPY_BUFFER_SIZE, compress_piece
+from generate.columns import MONEY_FIELDS, CATEGORY_FIELDS, column_rows
+from generate.vocabulary import WordColumn, WordIndices, resolve_column, \
+    take_column
+
+
+def encode_csv(field_names, columns):
+    """
+    Encode a chunk of rows as CSV.
+    :param field_names: Fields to write, in order.
+    :param columns: Dict of column arrays.
+    :return: CSV text.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=',', quotechar='"',
+                        quoting=csv.QUOTE_NONNUMERIC)
+    # A batch of rows at a time, so only a batch is ever Python objects.
+    number_rows = len(columns[field_names[0]])
+    for start in range(0, number_rows, FEDS_EXPORT_BATCH_SIZE):
+        rows = slice(start, start + FEDS_EXPORT_BATCH_SIZE)
+        writer.writerows(column_rows(
+            {field_name: take_column(columns[field_name], rows)
+             for field_name in field_names}, field_names))
+    return buffer.getvalue()
+
+
+def encode_csv_tables(tables):
+    """
+    Encode and compress chunks of tables as CSV members. Runs in worker
+    processes.
+    :param tables: List of tuples: table name, field names, columns.
+    :return: List of tuples: member name, CompressedPiece.
+    """
+    return [(table_name + '.csv',
+             compress_piece(encode_csv(field_names, columns)))
+            for table_name, field_names, columns in tables]
+
+
+class CsvArchiveExporter:
+    """
+    Write chunks of tables as CSV members of a ChunkedZipWriter archive,
+    one member per table.
+    :param archive: ChunkedZipWriter to write to.
+    """
+
+    # Module level, so it can be sent to worker processes.
+    encode_tables = staticmethod(encode_csv_tables)
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def write_chunk(self, table_name, field_names, columns):
+        """
+        Append a chunk of rows to a table's CSV member.
+        :param table_name: Name of the table, e.g., customers.
+        :param field_names: Fields to write, in order.
+        :param columns: Dict of column arrays.
+        """
+        self.archive.write(table_name + '.csv',
+                           encode_csv(field_names, columns))
+
+    def write_encoded(self, pieces):
+        """
+        Append encoded chunks to their members.
+        :param pieces: Result of encode_tables().
+        """
+        for member_name, piece in pieces:
+            self.archive.write_piece(member_name, piece)
+
+    def close(self):
+        pass
+
+
+class ArchiveMemberFile:
+    """
+    Write-only file object that appends to an archive member, so file
+    writers, like pyarrow's, can write into an archive. Small writes are
+    gathered up, and compressed in blocks.
+    :param archive: ChunkedZipWriter or StreamingZipWriter.
+    :param member_name: Name of the member in the archive.
+    :param compress_level: zlib compression level, or None for the
+            archive's.
+    """
+
+    def __init__(self, archive, member_name, compress_level=None):
+        self.archive = archive
+        self.member_name = member_name
+        self.compress_level = compress_level
+        self.buffer = io.BytesIO()
+        self.position = 0
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        if self.buffer.tell() >= COPY_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        if self.buffer.tell():
+            self.archive.write(self.member_name, self.buffer.getvalue(),
+                               self.compress_level)
+            self.buffer = io.BytesIO()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+
+class ColumnarArchiveExporter:
+    """
+    Write chunks of tables as Arrow record batches, one archive member per
+    table. Subclasses open the file writer for a table.
+
+    Money is decimal(12, 2), dates are date32, and text from a single
+    word list, or with few values, is dictionary encoded. Each dictionary
+    is made once, and shared by every chunk.
+    :param archive: ChunkedZipWriter or StreamingZipWriter to write to.
+    :param sequential: True if tables arrive one after another, and each
+            has to be finished before the next starts, as with a
+            StreamingZipWriter.
+    """
+
+    # Member name extension, e.g., '.parquet'.
+    extension = None
+    # zlib level for members. None for the archive's.
+    compress_level = None
+
+    def __init__(self, archive, sequential=False):
+        self.archive = archive
+        self.sequential = sequential
+        # Open file writers and member files, by table name.
+        self.writers = dict()
+        self.member_files = dict()
+        # Dictionary arrays, by vocabulary and case, or by field name.
+        self.dictionaries = dict()
+
+    def write_chunk(self, table_name, field_names, columns):
+        """
+        Append a chunk of rows to a table's member.
+        :param table_name: Name of the table, e.g., customers.
+        :param field_names: Fields to write, in order.
+        :param columns: Dict of column arrays.
+        """
+        import pyarrow as pa
+        batch = pa.RecordBatch.from_arrays(
+            [self.arrow_column(field_name, columns[field_name])
+             for field_name in field_names],
+            names=list(field_names))
+        if table_name not in self.writers:
+            if self.sequential:
+                self.close()
+            member_file = ArchiveMemberFile(
+                self.archive, table_name + self.extension,
+                self.compress_level)
+            self.member_files[table_name] = member_file
+            self.writers[table_name] = self.open_writer(member_file,
+                                                        batch.schema)
+        self.write_batch(self.writers[table_name], batch)
+
+    def open_writer(self, member_file, schema):
+        raise NotImplementedError
+
+    def write_batch(self, writer, batch):
+        writer.write_batch(batch)
+
+    def close(self):
+        """ Finish the open tables' members. """
+        for table_name, writer in self.writers.items():
+            writer.close()
+            self.member_files[table_name].close()
+        self.writers = dict()
+        self.member_files = dict()
+
+    def arrow_column(self, field_name, column):
+        """
+        Convert a column to an Arrow array.
+        :param field_name: Name of the field.
+        :param column: Array, or WordColumn.
+        :return: pyarrow.Array
+        """
+        import pyarrow as pa
+        if field_name in MONEY_FIELDS:
+            return money_array(column)
+        if isinstance(column, WordColumn) and len(column.parts) == 1 \
+                and isinstance(column.parts[0], WordIndices):
+            # The indices are dictionary indices already.
+            part = column.parts[0]
+            key = (part.vocabulary.name, part.case)
+            if key not in self.dictionaries:
+                self.dictionaries[key] = pa.array(
+                    part.vocabulary.strings(part.case))
+            return pa.DictionaryArray.from_arrays(
+                pa.array(part.indices, pa.int32()), self.dictionaries[key])
+        if field_name in CATEGORY_FIELDS:
+            if field_name not in self.dictionaries:
+                self.dictionaries[field_name] = pa.array(
+                    CATEGORY_FIELDS[field_name])
+            return pa.DictionaryArray.from_arrays(
+                pa.array(category_indices(CATEGORY_FIELDS[field_name],
+                                          column), pa.int32()),
+                self.dictionaries[field_name])
+        return pa.array(resolve_column(column))
+
+
+class ParquetArchiveExporter(ColumnarArchiveExporter):
+    """
+    Write each table as a Parquet file, one row group per chunk, with
+    zstd compressed pages.
+    """
+
+    extension = '.parquet'
+    # Pages are zstd compressed already.
+    compress_level = 0
+
+    def open_writer(self, member_file, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(member_file, schema, compression='zstd')
+
+    def write_batch(self, writer, batch):
+        import pyarrow as pa
+        writer.write_table(pa.Table.from_batches([batch]))
+
+
+class ArrowArchiveExporter(ColumnarArchiveExporter):
+    """
+    Write each table as an Arrow IPC file, one batch per chunk. Buffers
+    are zstd compressed, which readers support from Arrow 2.0.
+    """
+
+    extension = '.arrow'
+    compress_level = 0
+
+    def open_writer(self, member_file, schema):
+        import pyarrow as pa
+        return pa.ipc.new_file(
+            member_file, schema,
+            options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+
+# Tables in the SQLite export, by name. Keys go in the {field}
+# placeholders, from SQLITE_KEYS.
+SQLITE_TABLES = (
+    ('products', '''CREATE TABLE products (
+      ProductId         INTEGER{ProductId},
+      ProductName       VARCHAR(50),
+      Description       VARCHAR(100),
+      ProdPrice         NUMERIC(7,2)
+      )'''),
+    ('customers', '''CREATE TABLE customers (
+      CustomerId        INTEGER{CustomerId},
+      CName             VARCHAR(50),
+      CStreetAndNumber  VARCHAR(255),
+      CZipCode          VARCHAR(7),
+      CPhone            VARCHAR(10),
+      CEmail            VARCHAR(50)
+      )'''),
+    ('invoices', '''CREATE TABLE invoices (
+      InvoiceNumber     INTEGER{InvoiceNumber},
+      CustomerId        INTEGER{CustomerId},
+      InvoiceDate       DATE,
+      PaymentType       VARCHAR(10),
+      CreditTerms       VARCHAR(20),
+      DueDate           DATE,
+      ShippingMethod    VARCHAR(20),
+      ShippingTerms     VARCHAR(20),
+      TotalBTax         NUMERIC(12,2),
+      SalesTax          NUMERIC(12,2),
+      Total             NUMERIC(12,2)
+      )'''),
+    ('invoice_details', '''CREATE TABLE invoice_details (
+      InvDetailNumber   INTEGER{InvDetailNumber},
+      InvoiceNumber     INTEGER{InvoiceNumber},
+      ProductId         INTEGER{ProductId},
+      Quantity          INTEGER,
+      SubtotalProduct   NUMERIC(12,2)
+      )'''),
+)
+
+# Keys in the SQLite export, by table, then field: the constraint, and
+# the key it refers to, as table and field, or None.
+SQLITE_KEYS = {
+    'products': {'ProductId': ('PRIMARY KEY', None)},
+    'customers': {'CustomerId': ('PRIMARY KEY', None)},
+    'invoices': {
+        'InvoiceNumber': ('PRIMARY KEY', None),
+        'CustomerId': ('NOT NULL REFERENCES customers (CustomerId)',
+                       ('customers', 'CustomerId')),
+    },
+    'invoice_details': {
+        'InvDetailNumber': ('PRIMARY KEY', None),
+        'InvoiceNumber': ('NOT NULL REFERENCES invoices (InvoiceNumber)',
+                          ('invoices', 'InvoiceNumber')),
+        'ProductId': ('NOT NULL REFERENCES products (ProductId)',
+                      ('products', 'ProductId')),
+    },
+}
+
+# Kinds of anomaly that break a key. The key isn't declared when one of
+# them is put into it, or into the key it refers to. It's still indexed.
+SQLITE_KEY_ANOMALIES = (DUPLICATE_VALUES, MISSING)
+
+# Views on the SQLite export.
+SQLITE_VIEWS = (
+    '''CREATE VIEW invoice_lines AS
+      SELECT d.InvDetailNumber, d.InvoiceNumber, i.InvoiceDate,
+        i.CustomerId, c.CName, c.CStreetAndNumber, c.CZipCode, c.CPhone,
+        c.CEmail, i.PaymentType, i.CreditTerms, i.DueDate, i.ShippingMethod,
+        i.ShippingTerms, i.TotalBTax, i.SalesTax, i.Total, d.ProductId,
+        p.ProductName, p.Description, p.ProdPrice, d.Quantity,
+        d.SubtotalProduct
+      FROM invoice_details d
+        JOIN invoices i ON i.InvoiceNumber = d.InvoiceNumber
+        JOIN customers c ON c.CustomerId = i.CustomerId
+        JOIN products p ON p.ProductId = d.ProductId''',
+)
+
+# Indexes on the SQLite export, made after the tables are loaded, so
+# they're built in one pass rather than row by row.
+SQLITE_INDEXES = (
+    'CREATE INDEX products_id ON products (ProductId)',
+    'CREATE INDEX customers_id ON customers (CustomerId)',
+    'CREATE INDEX invoices_number ON invoices (InvoiceNumber)',
+    'CREATE INDEX invoices_customer ON invoices (CustomerId)',
+    'CREATE INDEX invoices_date ON invoices (InvoiceDate)',
+    'CREATE INDEX invoice_details_number '
+    'ON invoice_details (InvDetailNumber)',
+    'CREATE INDEX invoice_details_invoice ON invoice_details (InvoiceNumber)',
+    'CREATE INDEX invoice_details_product ON invoice_details (ProductId)',
+)
+
+# Settings for loading the SQLite export. The file is thrown away if the
+# load fails, so there is no need for a journal, or to wait for the disk.
+SQLITE_LOAD_PRAGMAS = (
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+)
+
+
+class SqliteArchiveExporter:
+    """
+    Load chunks of tables into a SQLite database, with its keys indexed,
+    and add it to the archive as project.sqlite when every table is
+    loaded.
+
+    The database is built in a temporary file, with no journal, and many
+    chunks to a transaction.
+    :param archive: ChunkedZipWriter or StreamingZipWriter to write to.
+    :param anomaly_plan: AnomalyPlan for the anomalies in the tables, or
+            None. Keys they break aren't declared.
+    :param transaction_rows: Rows to load between commits.
+    """
+
+    member_name = 'project.sqlite'
+    # Joined export objects are a view, not a table.
+    separate_tables = True
+
+    def __init__(self, archive, anomaly_plan=None,
+                 transaction_rows=FEDS_SQLITE_TRANSACTION_ROWS):
+        self.archive = archive
+        self.transaction_rows = transaction_rows
+        file_descriptor, self.database_path = tempfile.mkstemp(
+            suffix='.sqlite')
+        os.close(file_descriptor)
+        # Transactions are begun and committed here, not by sqlite3.
+        self.connection = sqlite3.connect(self.database_path,
+                                          isolation_level=None)
+        for pragma in SQLITE_LOAD_PRAGMAS:
+            self.connection.execute(pragma)
+        for create_table in sqlite_tables(anomaly_plan):
+            self.connection.execute(create_table)
+        # Rows loaded since the last commit, or None if no transaction
+        # is open.
+        self.uncommitted_rows = None
+
+    def write_chunk(self, table_name, field_names, columns):
+        """
+        Load a chunk of rows into a table.
+        :param table_name: Name of the table, e.g., customers.
+        :param field_names: Fields to write, in order.
+        :param columns: Dict of column arrays.
+        """
+        if self.uncommitted_rows is None:
+            self.connection.execute('BEGIN')
+            self.uncommitted_rows = 0
+        insert = 'INSERT INTO {table} ({fields}) VALUES ({params})'.format(
+            table=table_name, fields=', '.join(field_names),
+            params=', '.join('?' * len(field_names)))
+        self.connection.executemany(insert,
+                                    sqlite_rows(columns, field_names))
+        self.uncommitted_rows += len(columns[field_names[0]])
+        if self.uncommitted_rows >= self.transaction_rows:
+            self.commit()
+
+    def commit(self):
+        if self.uncommitted_rows is not None:
+            self.connection.execute('COMMIT')
+            self.uncommitted_rows = None
+
+    def close(self):
+        """ Index the tables, and copy the database into the archive. """
+        try:
+            try:
+                self.commit()
+                for create_index in SQLITE_INDEXES:
+                    self.connection.execute(create_index)
+            finally:
+                self.connection.close()
+            with open(self.database_path, 'rb') as database_file:
+                while True:
+                    block = database_file.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    self.archive.write(self.member_name, block)
+        finally:
+            os.unlink(self.database_path)
+
+
+def sqlite_tables(anomaly_plan):
+    """
+    Make the SQLite export's tables and views, declaring the keys that
+    no anomaly breaks.
+    :param anomaly_plan: AnomalyPlan, or None for no anomalies.
+    :return: List of SQL statements.
+    """
+    broken_keys = set()
+    if anomaly_plan is not None:
+        broken_keys = set((anomaly.table_name, anomaly.field_name)
+                          for anomaly in anomaly_plan.anomalies
+                          if anomaly.kind in SQLITE_KEY_ANOMALIES)
+    statements = list()
+    for table_name, create_table in SQLITE_TABLES:
+        constraints = dict()
+        for field_name, (constraint, referenced_key) \
+                in SQLITE_KEYS[table_name].items():
+            if (table_name, field_name) in broken_keys \
+                    or referenced_key in broken_keys:
+                constraints[field_name] = ''
+            else:
+                constraints[field_name] = ' ' + constraint
+        statements.append(create_table.format(**constraints))
+    return statements + list(SQLITE_VIEWS)
+
+
+def sqlite_rows(columns, field_names):
+    """
+    Iterate over the rows in a set of columns, with values sqlite3 can
+    store. Dates become ISO 8601 strings, SQLite's usual form for them.
+    :param columns: Dict of columns.
+    :param field_names: Fields to include, in order.
+    :return: Iterator of tuples of Python values.
+    """
+    values = []
+    for field_name in field_names:
+        column = resolve_column(columns[field_name])
+        if np.issubdtype(column.dtype, np.datetime64):
+            column = np.datetime_as_string(column, unit='D')
+        values.append(column.tolist())
+    return zip(*values)
+
+
+def money_array(column):
+    """
+    Make an Arrow decimal(12, 2) array from dollars, exact to the cent.
+    :param column: Array of dollars. Masked values are null.
+    :return: pyarrow.Array
+    """
+    import pyarrow as pa
+    cents = np.rint(np.ma.getdata(column) * 100).astype('<i8')
+    # Decimals are 128-bit integers of cents: low word, then the sign.
+    words = np.empty((len(cents), 2), dtype='<i8')
+    words[:, 0] = cents
+    words[:, 1] = cents >> 63
+    validity = None
+    is_missing = np.ma.getmaskarray(column)
+    if is_missing.any():
+        validity = pa.py_buffer(np.packbits(~is_missing, bitorder='little'))
+    return pa.Array.from_buffers(pa.decimal128(12, 2), len(cents),
+                                 [validity, pa.py_buffer(words)])
+
+
+def category_indices(categories, column):
+    """
+    Find where each of a column's values is in a list of categories.
+    :param categories: Tuple of the values the column can have.
+    :param column: Array of values.
+    :return: Array of indices into categories.
+    """
+    categories = np.asarray(categories)
+    order = np.argsort(categories)
+    positions = np.searchsorted(categories[order], column)
+    return order[positions]
+
+
+def make_archive_exporter(export_format, archive, sequential=False,
+                          anomaly_plan=None):
+    """
+    Make the exporter for a project's export format.
+    :param export_format: E.g., FEDS_EXPORT_FORMAT_PARQUET.
+    :param archive: ChunkedZipWriter or StreamingZipWriter to write to.
+    :param sequential: True if tables arrive one after another.
+    :param anomaly_plan: AnomalyPlan for the anomalies in the tables, or
+            None.
+    :return: Exporter.
+    """
+    if export_format == FEDS_EXPORT_FORMAT_CSV:
+        return CsvArchiveExporter(archive)
+    if export_format == FEDS_EXPORT_FORMAT_PARQUET:
+        return ParquetArchiveExporter(archive, sequential)
+    if export_format == FEDS_EXPORT_FORMAT_ARROW:
+        return ArrowArchiveExporter(archive, sequential)
+    if export_format == FEDS_EXPORT_FORMAT_SQLITE:
+        return SqliteArchiveExporter(archive, anomaly_plan)
+    message = 'Bad export format: "{format}"'
+    raise ValueError(message.format(format=export_format))
@@ -1,21 +1,77 @@
 import os
 import csv
+import datetime
 import time
-import random
+from collections import OrderedDict
+import numpy as np
 from feds.settings import FEDS_NUM_CUSTOMERS_STANDARD, \
     FEDS_NUM_CUSTOMERS_STANDARD_LOW, FEDS_NUM_CUSTOMERS_STANDARD_HIGH, \
     FEDS_VALUE_PARAM, FEDS_NUM_CUSTOMERS_CUSTOM, FEDS_NUM_PRODUCTS_STANDARD, \
     FEDS_NUM_PRODUCTS_STANDARD_LOW, FEDS_NUM_PRODUCTS_STANDARD_HIGH, \
     FEDS_MAX_PRICE, FEDS_MIN_PRICE, FEDS_NUM_PRODUCTS_CUSTOM, \
     FEDS_NUM_INVOICES_PER_CUST_STANDARD, FEDS_NUM_INVOICES_PER_CUST_CUSTOM, \
-    FEDS_MIN_STANDARD_INVOICES_PER_CUST, FEDS_MAX_STANDARD_INVOICES_PER_CUST
-from projects.internal_representation_classes import FedsSetting
+    FEDS_MIN_STANDARD_INVOICES_PER_CUST, FEDS_MAX_STANDARD_INVOICES_PER_CUST, \
+    FEDS_LAST_CALENDAR_YEAR, FEDS_CUSTOM_DATE_RANGE, \
+    FEDS_WORKING_DAYS_WEEKMASKS, FEDS_GENERATION_CHUNK_SIZE, \
+    FEDS_GENERATION_WORKERS, FEDS_EXPORT_FORMAT_CSV, \
+    FEDS_EXPORT_TABLES_JOINED, FEDS_EXPORT_TABLES_SEPARATE, \
+    FEDS_NORMAL_DISTRIBUTION_MEAN_TOTAL_BEFORE_TAX_DEFAULT, \
+    FEDS_BOOLEAN_VALUE_TRUE, FEDS_BENFORD_FIELD, \
+    FEDS_BENFORD_TAMPERED_FRACTION, FEDS_BENFORD_DIGIT_WEIGHTS
+from generate.anomalies import Anomaly, AnomalyPlan, ARITHMETIC_ERRORS, \
+    NEGATIVE_NUMBERS, OUT_OF_RANGE, DUPLICATE_VALUES, MISSING, \
+    inject_anomalies, order_anomalies, add_anomaly_rows, \
+    bitmap_member_name, anomaly_answer_key_csv
+from generate.archive_cache import archive_key
+from generate.benford import BenfordTampering, add_benford_counts, \
+    benford_summary_csv, benford_digits_csv
+from generate.bulk_load import make_bulk_loader
+from generate.chunks import plan_chunks, make_product_table, \
+    make_customer_chunk, make_invoice_chunk, iterate_table_chunks, \
+    inject_chunk_anomalies, join_chunk_anomalies
+from generate.columns import CUSTOMER_FIELDS, PRODUCT_FIELDS, \
+    INVOICE_FIELDS, INVOICE_DETAIL_FIELDS, JOINED_TABLE, JOINED_FIELDS, \
+    days_in_range, concatenate_columns, concatenate_offsets, column_rows
+from generate.distributions import make_total_distribution
+from generate.scheduler import StageScheduler
+from generate.streams import PROJECT_SIZE_STREAM, make_rng
+from generate.table_export import iterate_table_rows
+from generate.vocabulary import get_vocabulary_store
 from projects.models import ProjectDb
 from projects.read_write_project import read_project
 from django.db import connection
 from django.shortcuts import render
 from django.template.loader import render_to_string
 
+# Anomaly each anomaly setting puts into the data, by the machine name of
+# the setting's link to its field.
+ANOMALY_SETTINGS = (
+    ('fld_spec_customer_pk_anomaly_duplicate_values',
+     Anomaly(DUPLICATE_VALUES, 'customers', 'CustomerId')),
+    ('fld_spec_invc_num_anomaly_missing',
+     Anomaly(MISSING, 'invoices', 'InvoiceNumber')),
+    ('fld_spec_invc_num_anomaly_duplicate_values',
+     Anomaly(DUPLICATE_VALUES, 'invoices', 'InvoiceNumber')),
+    ('fld_spec_invoice_date_anomaly_out_of_range',
+     Anomaly(OUT_OF_RANGE, 'invoices', 'InvoiceDate')),
+    ('fld_spec_invc_tot_bt_anomaly_arithmetic_errors',
+     Anomaly(ARITHMETIC_ERRORS, 'invoices', 'TotalBTax')),
+    ('fld_spec_invc_tot_bt_anomaly_negative_numbers',
+     Anomaly(NEGATIVE_NUMBERS, 'invoices', 'TotalBTax')),
+    ('fld_spec_invc_sales_tax_anomaly_arithmetic_errors',
+     Anomaly(ARITHMETIC_ERRORS, 'invoices', 'SalesTax')),
+    ('fld_spec_invc_sales_tax_anomaly_negative_numbers',
+     Anomaly(NEGATIVE_NUMBERS, 'invoices', 'SalesTax')),
+    ('fld_spec_invc_total_anomaly_arithmetic_errors',
+     Anomaly(ARITHMETIC_ERRORS, 'invoices', 'Total')),
+    ('fld_spec_invc_total_anomaly_negative_numbers',
+     Anomaly(NEGATIVE_NUMBERS, 'invoices', 'Total')),
+    ('fld_spec_invc_deets_subtotal_anomaly_arithmetic_errors',
+     Anomaly(ARITHMETIC_ERRORS, 'invoice_details', 'SubtotalProduct')),
+    ('fld_spec_invc_deets_subtotal_anomaly_negative_numbers',
+     Anomaly(NEGATIVE_NUMBERS, 'invoice_details', 'SubtotalProduct')),
+)
+
 
 class FedsGenerator:
     def __init__(self, project_id):
@@ -26,8 +82,30 @@ class FedsGenerator:
         self.number_customers = 0
         # Number of products to make.
         self.number_products = 0
-        # How many invoices per customer.
-        self.invoices_per_customer = dict()
+        # Seed for all of the project's random numbers.
+        self.seed = self.project_db.seed
+        # Loads rows into the generated tables, using the DB's native loader.
+        self.bulk_loader = make_bulk_loader()
+        # Stats for each table load: rows, seconds, rows_per_sec.
+        self.load_stats = list()
+        # Stage timings and critical path of the last generate_tables().
+        self.stage_report = None
+        # Digit counts of the amounts tampered with for the Benford's law
+        # anomaly, added up over the chunks made. None if it's off.
+        self.benford_counts = None
+        # Bitmaps of the rows each anomaly touched, in the chunks made, by
+        # table name and Anomaly.
+        self.anomaly_bitmaps = OrderedDict()
+        # Worker processes generate_tables() makes chunks on.
+        self.generation_workers = FEDS_GENERATION_WORKERS
+        # Generated data, as dicts of column arrays.
+        self.customer_columns = dict()
+        self.product_columns = dict()
+        self.invoice_columns = dict()
+        self.invoice_detail_columns = dict()
+        # Links invoices to their detail lines. Lines for invoice i are
+        # offsets[i] to offsets[i + 1] - 1.
+        self.invoice_offsets = None
 
     def create_customer_table(self):
         # Compute the name of the customer table, unique for this project.
@@ -111,21 +189,21 @@ class FedsGenerator:
         option_setting_name = 'tbl_customer_setting_num_cust_options'
         custom_option_name = 'tbl_customer_setting_cust_num_custs'
         # Did the user choose the default: number chosen by FEDS?
-        if option_setting_name not in FedsSetting.setting_machine_names:
-            message = '"{setting}" not in FedsSetting.setting_machine_names'
+        if option_setting_name not in self.project.registry.settings:
+            message = '"{setting}" not in the project\'s settings'
             raise LookupError(message.format(setting=option_setting_name))
-        chosen_option = FedsSetting.setting_machine_names[
+        chosen_option = self.project.registry.settings[
             option_setting_name].params[FEDS_VALUE_PARAM]
         if chosen_option == FEDS_NUM_CUSTOMERS_STANDARD:
             # Let FEDS choose number of customers.
-            num_custs = random.randint(
+            num_custs = self.make_rng(PROJECT_SIZE_STREAM, 0).integers(
                 FEDS_NUM_CUSTOMERS_STANDARD_LOW,
-                FEDS_NUM_CUSTOMERS_STANDARD_HIGH
+                FEDS_NUM_CUSTOMERS_STANDARD_HIGH + 1
             )
         elif chosen_option == FEDS_NUM_CUSTOMERS_CUSTOM:
             # Get the user's value for number of customers.
             num_custs = \
-                FedsSetting.setting_machine_names[custom_option_name].params[
+                self.project.registry.settings[custom_option_name].params[
                     FEDS_VALUE_PARAM]
         else:
             message = 'Bad value "{v}" for setting {s}'
@@ -140,21 +218,21 @@ class FedsGenerator:
         option_setting_name = 'tbl_products_setting_num_product_options'
         custom_option_name = 'tbl_product_setting_cust_num_products'
         # Did the user choose the default: number chosen by FEDS?
-        if option_setting_name not in FedsSetting.setting_machine_names:
-            message = '"{setting}" not in FedsSetting.setting_machine_names'
+        if option_setting_name not in self.project.registry.settings:
+            message = '"{setting}" not in the project\'s settings'
             raise LookupError(message.format(setting=option_setting_name))
-        chosen_option = FedsSetting.setting_machine_names[
+        chosen_option = self.project.registry.settings[
             option_setting_name].params[FEDS_VALUE_PARAM]
         if chosen_option == FEDS_NUM_PRODUCTS_STANDARD:
             # Let FEDS choose number of customers.
-            num_products = random.randint(
+            num_products = self.make_rng(PROJECT_SIZE_STREAM, 1).integers(
                 FEDS_NUM_PRODUCTS_STANDARD_LOW,
-                FEDS_NUM_PRODUCTS_STANDARD_HIGH
+                FEDS_NUM_PRODUCTS_STANDARD_HIGH + 1
             )
         elif chosen_option == FEDS_NUM_PRODUCTS_CUSTOM:
             # Get the user's value for number of customers.
             num_products = \
-                FedsSetting.setting_machine_names[custom_option_name].params[
+                self.project.registry.settings[custom_option_name].params[
                     FEDS_VALUE_PARAM]
         else:
             message = 'Bad value "{v}" for setting {s}'
@@ -164,140 +242,491 @@ class FedsGenerator:
         # Int because JSON option is string.
         self.number_products = int(num_products)
 
+    def make_customers(self):
+        """ Make the customers' data, as columns in memory. """
+        self.get_num_customers_to_make()
+        anomaly_plan = self.get_anomaly_plan()
+        # Same chunks as generate_tables(), so the data is the same.
+        chunks = list()
+        for plan in self.plan_chunks():
+            customer_columns, anomaly_rows = inject_chunk_anomalies(
+                anomaly_plan, plan, 'customers',
+                make_customer_chunk(self.seed, plan, get_vocabulary_store()))
+            self.tally_chunk(None, anomaly_rows)
+            chunks.append(customer_columns)
+        self.customer_columns = concatenate_columns(chunks)
+
     def create_customers(self):
-            self.get_num_customers_to_make()
-            # Load name options.
-            first_names = self.read_names_list('first_names.txt')
-            last_names = self.read_names_list('last_names.txt')
-            street_names = self.read_names_list('street_names.txt')
-            street_types = self.read_names_list('street_types.txt')
-            town_names = self.read_names_list('town_names.txt')
-            zip_codes = self.read_names_list('zip_codes.txt')
-            tlds = self.read_names_list('tlds.txt')
-            sql = '''
-    insert into customer{project_id} (CustomerId, CName, CStreetAndNumber, 
-    CZipCode, CPhone, CEmail) values '''.format(project_id=self.project_id)
-            for customer_id in range(1, self.number_customers + 1):
-                if customer_id == 1:
-                    record = '('
-                else:
-                    record = ',('
-                fn = random.choice(first_names)
-                ln = random.choice(last_names)
-                cust_name = fn + ' ' + ln
-                cust_address = str(random.randint(10, 999)) + ' ' \
-                               + random.choice(street_names) + ' ' \
-                               + random.choice(street_types) + ', ' \
-                               + random.choice(town_names)
-                cust_zip = random.choice(zip_codes)
-                cust_phone = str(random.randint(211, 799)) \
-                             + str(random.randint(211, 799)) \
-                             + str(random.randint(2111, 7999))
-                cust_email = fn.lower() + '@' + ln.lower() + '.' \
-                             + random.choice(tlds)
-                record += str(customer_id) + ",'" + cust_name + "','" \
-                          + cust_address + "','" + cust_zip + "','" \
-                          + cust_phone + "','" + cust_email + "')"
-                sql += record
-            sql += ';'
-            self.run_sql(sql)
+        """ Make the customers, and load them into the customer table. """
+        self.make_customers()
+        self.load_stats.append(self.bulk_loader.load(
+            'customer{id}'.format(id=self.project_id),
+            CUSTOMER_FIELDS,
+            column_rows(self.customer_columns, CUSTOMER_FIELDS)
+        ))
 
-    def create_products(self):
+    def make_products(self):
+        """ Make the products' data, as columns in memory. """
         self.get_num_products_to_make()
-        # Load name options.
-        product_adjectives = self.read_names_list('product_adjectives.txt')
-        product_types = self.read_names_list('product_types.txt')
-        product_descriptions = self.read_names_list('product_descriptions.txt')
-        sql = '''
-    insert into product{project_id} (ProductId, ProductName, Description, 
-    ProdPrice) values '''.format(project_id=self.project_id)
-        price_range = FEDS_MAX_PRICE - FEDS_MIN_PRICE
-        for product_id in range(1, self.number_products + 1):
-            if product_id == 1:
-                record = '('
-            else:
-                record = ',('
-            adj = random.choice(product_adjectives)
-            typ = random.choice(product_types)
-            product_name = adj.capitalize() + ' ' + typ
-            description = random.choice(product_descriptions)
-            price = FEDS_MIN_PRICE + random.random() * price_range
-            record += str(product_id) + ",'" + product_name + "','" \
-                      + description + "'," + '{0:.2f}'.format(price) + ")"
-            sql += record
-        sql += ';'
-        self.run_sql(sql)
+        self.product_columns = make_product_table(
+            self.seed, self.number_products, get_vocabulary_store(),
+            FEDS_MIN_PRICE, FEDS_MAX_PRICE)
+
+    def create_products(self):
+        """ Make the products, and load them into the product table. """
+        self.make_products()
+        # Invoices are made from the clean products.
+        product_columns, anomaly_rows = inject_anomalies(
+            self.get_anomaly_plan(), 0, 0, 'products', self.product_columns)
+        self.tally_chunk(None, anomaly_rows)
+        self.load_stats.append(self.bulk_loader.load(
+            'product{id}'.format(id=self.project_id),
+            PRODUCT_FIELDS,
+            column_rows(product_columns, PRODUCT_FIELDS)
+        ))
 
-    def read_names_list(self, file_name):
-        module_dir = os.path.dirname(__file__)  # get current directory
-        result = []
-        file_path = os.path.join(module_dir, 'names_lists/' + file_name)
-        with open(file_path) as file:
-            for line in file:
-                result.append(line.strip())
-        return result
-
-    def get_num_invoices_per_customer(self):
-        # Work out how many invoices per customer.
-        # Make a dictionary, key is customer id.
-        self.invoices_per_customer = dict()
+    def get_invoice_count_range(self):
+        """
+        Work out the least and most invoices a customer can have.
+        :return: Tuple: min, max.
+        """
         # What option did the user choose?
         option_setting_name = 'tbl_customer_setting_num_invc_per_cust_options'
         custom_option_name = 'tbl_customer_setting_cust_num_invc_per_cust'
-        # Did the user choose the default: number chosen by FEDS?
-        if option_setting_name not in FedsSetting.setting_machine_names:
-            message = '"{setting}" not in FedsSetting.setting_machine_names'
-            raise LookupError(message.format(setting=option_setting_name))
-        chosen_option = FedsSetting.setting_machine_names[
-            option_setting_name].params[FEDS_VALUE_PARAM]
-        for customer_id in range(1, self.number_customers + 1):
-            if chosen_option == FEDS_NUM_INVOICES_PER_CUST_STANDARD:
-                # Let FEDS choose number of invoices per customer.
-                self.invoices_per_customer[customer_id] = random.randint(
-                    FEDS_MIN_STANDARD_INVOICES_PER_CUST,
-                    FEDS_MAX_STANDARD_INVOICES_PER_CUST
-                )
-            elif chosen_option == FEDS_NUM_INVOICES_PER_CUST_CUSTOM:
-                # Get the user's value for number of invoices per customer.
-                self.invoices_per_customer[customer_id] = \
-                    FedsSetting.setting_machine_names[
-                        custom_option_name].params[
-                        FEDS_VALUE_PARAM]
+        chosen_option = self.get_setting_value(option_setting_name)
+        if chosen_option == FEDS_NUM_INVOICES_PER_CUST_STANDARD:
+            # Let FEDS choose number of invoices per customer.
+            return (FEDS_MIN_STANDARD_INVOICES_PER_CUST,
+                    FEDS_MAX_STANDARD_INVOICES_PER_CUST)
+        if chosen_option == FEDS_NUM_INVOICES_PER_CUST_CUSTOM:
+            # Get the user's value for number of invoices per customer.
+            # Int because JSON option is string.
+            number_invoices = int(self.get_setting_value(custom_option_name))
+            return number_invoices, number_invoices
+        message = 'Bad value "{v}" for setting {s}'
+        raise ValueError(
+            message.format(v=chosen_option, s=option_setting_name)
+        )
+
+    def get_setting_value(self, machine_name):
+        """
+        Get the value of one of the project's settings.
+        :param machine_name: Machine name of the setting.
+        :return: The value.
+        """
+        if machine_name not in self.project.registry.settings:
+            message = '"{setting}" not in the project\'s settings'
+            raise LookupError(message.format(setting=machine_name))
+        return self.project.registry.settings[machine_name].params[
+            FEDS_VALUE_PARAM]
+
+    def setting_is_on(self, machine_name):
+        """
+        Check whether one of the project's boolean settings is on.
+        :param machine_name: Machine name of the setting.
+        :return: True if it's on. False if it's off, or the business area
+                doesn't have it.
+        """
+        try:
+            value = self.get_setting_value(machine_name)
+        except LookupError:
+            return False
+        return value.strip().lower() == FEDS_BOOLEAN_VALUE_TRUE
+
+    def get_export_format(self):
+        """ Get the file format to export tables in, e.g., 'parquet'. """
+        try:
+            return self.get_setting_value('ba_revenue_setting_export_format')
+        except LookupError:
+            # Business areas set up before there was a choice.
+            return FEDS_EXPORT_FORMAT_CSV
+
+    def get_export_objects(self):
+        """ Get whether tables are exported joined or separate. """
+        try:
+            return self.get_setting_value('ba_revenue_setting_export_objects')
+        except LookupError:
+            return FEDS_EXPORT_TABLES_SEPARATE
+
+    def exports_joined(self, exporter):
+        """
+        Check whether to export one table of joined invoice lines, rather
+        than the separate tables. Exporters that can join the tables
+        themselves, like the SQLite one, always get them separate.
+        :param exporter: The exporter the tables will go to.
+        :return: True to join.
+        """
+        if getattr(exporter, 'separate_tables', False):
+            return False
+        return self.get_export_objects() == FEDS_EXPORT_TABLES_JOINED
+
+    def get_sales_tax_rate(self):
+        """ Get the sales tax rate, e.g., 0.06. """
+        # Float because JSON option can be string.
+        return float(self.get_setting_value('ba_revenue_setting_sales_tax'))
+
+    def get_total_distribution(self):
+        """
+        Get the distribution to draw invoice totals before tax from, from
+        the total before tax field's settings.
+        :return: Distribution, see generate.distributions, or None for
+                business areas without the settings.
+        """
+        try:
+            kind = self.get_setting_value(
+                'fld_spec_invc_tot_bt_setting_stat_distrib')
+        except LookupError:
+            return None
+        try:
+            # Float because JSON option can be string.
+            mean = float(self.get_setting_value(
+                'fld_spec_invc_tot_bt_setting_norm_distrib_mean'))
+        except LookupError:
+            mean = FEDS_NORMAL_DISTRIBUTION_MEAN_TOTAL_BEFORE_TAX_DEFAULT
+        return make_total_distribution(kind, mean)
+
+    def get_benford_tampering(self):
+        """
+        Get how to tamper with invoice amounts for the Benford's law
+        anomaly.
+        :return: BenfordTampering, or None if the anomaly is off.
+        """
+        if not self.setting_is_on(
+                'fld_spec_invc_tot_bt_anomaly_violates_benfords_law'):
+            return None
+        return BenfordTampering(FEDS_BENFORD_FIELD,
+                                FEDS_BENFORD_TAMPERED_FRACTION,
+                                FEDS_BENFORD_DIGIT_WEIGHTS)
+
+    def get_anomaly_plan(self):
+        """
+        Get the anomalies to put into the data, from the anomaly settings.
+        :return: AnomalyPlan, or None if every anomaly is off.
+        """
+        anomalies = [anomaly for machine_name, anomaly in ANOMALY_SETTINGS
+                     if self.setting_is_on(machine_name)]
+        if not anomalies:
+            return None
+        start_date, end_date = self.get_project_date_range()
+        return AnomalyPlan(self.seed, order_anomalies(anomalies),
+                           np.datetime64(start_date, 'D'),
+                           np.datetime64(end_date, 'D'))
+
+    def reset_answer_key(self):
+        """ Start the answer key again, before making the tables. """
+        self.benford_counts = None
+        self.anomaly_bitmaps = OrderedDict()
+
+    def tally_chunk(self, invoice_chunk, anomaly_rows):
+        """
+        Add what was done to a chunk to the answer key.
+        :param invoice_chunk: InvoiceChunk, or None for chunks of other
+                tables.
+        :param anomaly_rows: List of AnomalyRows for the chunk.
+        """
+        if invoice_chunk is not None:
+            self.benford_counts = add_benford_counts(
+                self.benford_counts, invoice_chunk.benford_counts)
+            add_anomaly_rows(self.anomaly_bitmaps, invoice_chunk.anomaly_rows)
+        add_anomaly_rows(self.anomaly_bitmaps, anomaly_rows)
+
+    def make_answer_key(self):
+        """
+        Make the instructor's answer key, for the tables made last.
+        :return: List of tuples: file name, CSV text or bytes. Empty if
+                no anomaly was put into the data.
+        """
+        answer_key = list()
+        if self.benford_counts is not None:
+            answer_key.append((
+                'answer_key/benford_statistics.csv',
+                benford_summary_csv('invoices', FEDS_BENFORD_FIELD,
+                                    self.benford_counts)))
+            answer_key.append((
+                'answer_key/benford_digits.csv',
+                benford_digits_csv(self.benford_counts)))
+        if self.anomaly_bitmaps:
+            answer_key.append((
+                'answer_key/anomalies.csv',
+                anomaly_answer_key_csv(self.anomaly_bitmaps)))
+            for (table_name, anomaly), bitmap \
+                    in self.anomaly_bitmaps.items():
+                answer_key.append((bitmap_member_name(table_name, anomaly),
+                                   bitmap.serialize()))
+        return answer_key
+
+    def get_project_date_range(self):
+        """
+        Work out the project's dates.
+        :return: Tuple: first day, last day, datetime.date.
+        """
+        date_option = self.get_setting_value(
+            'ba_revenue_setting_project_date_choices')
+        if date_option == FEDS_LAST_CALENDAR_YEAR:
+            last_year = datetime.date.today().year - 1
+            start_date = datetime.date(last_year, 1, 1)
+            end_date = datetime.date(last_year, 12, 31)
+        elif date_option == FEDS_CUSTOM_DATE_RANGE:
+            start_date = parse_setting_date(self.get_setting_value(
+                'ba_revenue_setting_project_custom_start_date'))
+            end_date = parse_setting_date(self.get_setting_value(
+                'ba_revenue_setting_project_custom_end_date'))
+        else:
+            message = 'Bad value "{v}" for setting {s}'
+            raise ValueError(message.format(
+                v=date_option, s='ba_revenue_setting_project_date_choices'))
+        return start_date, end_date
+
+    def get_invoice_days(self):
+        """
+        Work out the days invoices can be dated, from the project date range
+        and the working days.
+        :return: Array of datetime64[D].
+        """
+        start_date, end_date = self.get_project_date_range()
+        working_days = self.get_setting_value(
+            'ba_revenue_setting_working_days')
+        if working_days not in FEDS_WORKING_DAYS_WEEKMASKS:
+            message = 'Bad value "{v}" for setting {s}'
+            raise ValueError(message.format(
+                v=working_days, s='ba_revenue_setting_working_days'))
+        return days_in_range(start_date, end_date,
+                             FEDS_WORKING_DAYS_WEEKMASKS[working_days])
+
+    def archive_key(self, visible_settings):
+        """
+        Work out the key of the archive these settings make, to look it up
+        in the archive cache.
+        :param visible_settings: Dict of the settings the user can see.
+        :return: Hex string.
+        """
+        return archive_key(self.project, self.seed, visible_settings,
+                           get_vocabulary_store(),
+                           self.get_project_date_range())
+
+    def make_rng(self, stream_key, chunk_index=0):
+        """
+        Make the random number generator for one chunk of one stream,
+        from the project's seed.
+        :param stream_key: Which stream, e.g., CUSTOMER_STREAM.
+        :param chunk_index: Which chunk of the stream, from 0.
+        :return: numpy.random.Generator
+        """
+        return make_rng(self.seed, stream_key, chunk_index)
+
+    def plan_chunks(self):
+        """
+        Split the customers into chunks. The number of customers must be
+        known first.
+        :return: Iterator of ChunkPlan, in row order.
+        """
+        return plan_chunks(self.seed, self.number_customers,
+                           self.get_invoice_count_range(),
+                           FEDS_GENERATION_CHUNK_SIZE)
+
+    def make_invoices(self):
+        """
+        Make the invoices and their detail lines, as columns in memory.
+        Customers and products must be made first.
+        """
+        invoice_count_range = self.get_invoice_count_range()
+        sales_tax_rate = self.get_sales_tax_rate()
+        invoice_days = self.get_invoice_days()
+        total_distribution = self.get_total_distribution()
+        benford_tampering = self.get_benford_tampering()
+        anomaly_plan = self.get_anomaly_plan()
+        # Same chunks as generate_tables(), so the data is the same.
+        invoice_blocks = list()
+        detail_blocks = list()
+        offsets_list = list()
+        for plan in self.plan_chunks():
+            chunk = make_invoice_chunk(self.seed, plan, invoice_count_range,
+                                       sales_tax_rate, invoice_days,
+                                       total_distribution, benford_tampering,
+                                       self.product_columns)
+            invoice_columns, invoice_rows = inject_chunk_anomalies(
+                anomaly_plan, plan, 'invoices', chunk.invoice_columns)
+            detail_columns, detail_rows = inject_chunk_anomalies(
+                anomaly_plan, plan, 'invoice_details', chunk.detail_columns)
+            self.tally_chunk(chunk, invoice_rows + detail_rows)
+            invoice_blocks.append(invoice_columns)
+            detail_blocks.append(detail_columns)
+            offsets_list.append(chunk.offsets)
+        self.invoice_columns = concatenate_columns(invoice_blocks)
+        self.invoice_detail_columns = concatenate_columns(detail_blocks)
+        self.invoice_offsets = concatenate_offsets(offsets_list)
+
+    def create_invoices(self):
+        """ Make the invoices, and load them into the invoice tables. """
+        self.make_invoices()
+        self.load_stats.append(self.bulk_loader.load(
+            'invoice{id}'.format(id=self.project_id),
+            INVOICE_FIELDS,
+            column_rows(self.invoice_columns, INVOICE_FIELDS)
+        ))
+        self.load_stats.append(self.bulk_loader.load(
+            'invoicedetail{id}'.format(id=self.project_id),
+            INVOICE_DETAIL_FIELDS,
+            column_rows(self.invoice_detail_columns, INVOICE_DETAIL_FIELDS)
+        ))
+
+    def generate_tables(self, exporter, progress=None):
+        """
+        Make all of the tables, a chunk of customers at a time, without
+        going through the DB, and pass the chunks to an exporter.
+
+        Chunks are made on a pool of worker processes. Each chunk's
+        customers and invoices are separate stages, and invoices need the
+        products. If the exporter can encode in workers, that's a stage
+        too. Chunks are written here, in row order, as soon as they are
+        ready, so memory use doesn't grow with the number of customers.
+        :param exporter: Object with a write_chunk(table_name, field_names,
+                columns) method, e.g., CsvArchiveExporter. See
+                generate.exporters.
+        :param progress: Optional function called with the number of
+                chunks exported so far, and the number of chunks, after
+                each chunk is exported.
+        """
+        self.get_num_products_to_make()
+        self.get_num_customers_to_make()
+        # Sent to workers by name. They have the store already.
+        vocabularies = get_vocabulary_store()
+        invoice_count_range = self.get_invoice_count_range()
+        sales_tax_rate = self.get_sales_tax_rate()
+        invoice_days = self.get_invoice_days()
+        total_distribution = self.get_total_distribution()
+        benford_tampering = self.get_benford_tampering()
+        anomaly_plan = self.get_anomaly_plan()
+        self.reset_answer_key()
+        encode_tables = getattr(exporter, 'encode_tables', None)
+        joined = self.exports_joined(exporter)
+        scheduler = StageScheduler(self.generation_workers)
+        scheduler.add_stage(
+            'products', make_product_table,
+            args=(self.seed, self.number_products, vocabularies,
+                  FEDS_MIN_PRICE, FEDS_MAX_PRICE))
+        if joined:
+            # Products are joined to each chunk's lines, not exported.
+            previous_export = 'products'
+            chunk_inputs = ('products',)
+        else:
+            scheduler.add_stage(
+                'export products', export_products,
+                args=(exporter, anomaly_plan), inputs=('products',),
+                local=True)
+            scheduler.add_stage(
+                'tally products', self.tally_chunk, args=(None,),
+                inputs=('export products',), local=True)
+            previous_export = 'export products'
+            chunk_inputs = ()
+        plans = list(self.plan_chunks())
+        for plan in plans:
+            customers = 'customers {index}'.format(index=plan.index)
+            invoices = 'invoices {index}'.format(index=plan.index)
+            export = 'export {index}'.format(index=plan.index)
+            scheduler.add_stage(
+                customers, make_customer_chunk,
+                args=(self.seed, plan, vocabularies))
+            scheduler.add_stage(
+                invoices, make_invoice_chunk,
+                args=(self.seed, plan, invoice_count_range, sales_tax_rate,
+                      invoice_days, total_distribution, benford_tampering),
+                inputs=('products',))
+            # Chained to the last export, so chunks are written in order.
+            # Anomalies are put in as chunks are exported, or encoded.
+            if encode_tables is None:
+                scheduler.add_stage(
+                    export, export_chunk,
+                    args=(exporter, anomaly_plan, plan),
+                    inputs=(previous_export, customers, invoices)
+                    + chunk_inputs, local=True)
             else:
-                message = 'Bad value "{v}" for setting {s}'
-                raise ValueError(
-                    message.format(v=chosen_option, s=option_setting_name)
-                )
-
-    def save_customer_data(self, export_dir_path, file_name):
-        sql = 'select * from customer{id} order by CustomerId'.format(
-            id=self.project_id)
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [])
-            rows = cursor.fetchall()
-        file_path = os.path.join(export_dir_path, file_name)
-        with open(file_path, 'w') as csv_file:
-            customer_writer = csv.writer(csv_file, delimiter=',', quotechar='"',
-                                         quoting=csv.QUOTE_NONNUMERIC)
-            for customer in rows:
-                customer_writer.writerow(customer)
-
-    def save_product_data(self, export_dir_path, file_name):
-        # Combine customer and product into one generic method?
-        sql = 'select * from product{id} order by ProductId'.format(
-            id=self.project_id)
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [])
-            rows = cursor.fetchall()
+                encode = 'encode {index}'.format(index=plan.index)
+                scheduler.add_stage(
+                    encode, encode_chunk,
+                    args=(encode_tables, anomaly_plan, plan),
+                    inputs=(customers, invoices) + chunk_inputs)
+                scheduler.add_stage(
+                    export, export_encoded_chunk, args=(exporter,),
+                    inputs=(previous_export, encode), local=True)
+            scheduler.add_stage(
+                'tally {index}'.format(index=plan.index), self.tally_chunk,
+                inputs=(invoices, export), local=True)
+            if progress is not None:
+                scheduler.add_stage(
+                    'progress {index}'.format(index=plan.index),
+                    report_progress,
+                    args=(progress, plan.index + 1, len(plans)),
+                    inputs=(export,), local=True)
+            previous_export = export
+        if progress is not None:
+            progress(0, len(plans))
+        scheduler.run()
+        self.stage_report = scheduler.report()
+
+    def iterate_table_chunks(self, joined=False):
+        """
+        Make all of the tables, one table after another, a chunk at a
+        time, for exporters that have to write each table in one go, like
+        StreamingZipWriter. Chunks come out the same as in
+        generate_tables().
+        :param joined: True for one table of joined invoice lines. See
+                exports_joined().
+        :return: Iterator of tuples: table name, field names, columns.
+        """
+        self.get_num_products_to_make()
+        self.get_num_customers_to_make()
+        self.reset_answer_key()
+        return iterate_table_chunks(
+            self.seed, self.number_products, self.number_customers,
+            get_vocabulary_store(), self.get_invoice_count_range(),
+            self.get_sales_tax_rate(), self.get_invoice_days(),
+            self.get_total_distribution(), self.get_benford_tampering(),
+            self.get_anomaly_plan(), FEDS_MIN_PRICE, FEDS_MAX_PRICE,
+            FEDS_GENERATION_CHUNK_SIZE, joined, self.tally_chunk)
+
+    def save_table_data(self, table_name, field_names, order_by,
+                        export_dir_path, file_name):
+        """
+        Export a generated table to a CSV file, streaming rows from the DB.
+        :param table_name: Name of the table, e.g., customer12.
+        :param field_names: Fields to export, in order.
+        :param order_by: Field to sort the rows by.
+        :param export_dir_path: Dir to write to.
+        :param file_name: Name of the CSV file.
+        """
         file_path = os.path.join(export_dir_path, file_name)
         with open(file_path, 'w') as csv_file:
-            product_writer = csv.writer(csv_file, delimiter=',', quotechar='"',
-                                         quoting=csv.QUOTE_NONNUMERIC)
-            for product in rows:
-                product_writer.writerow(product)
+            writer = csv.writer(csv_file, delimiter=',', quotechar='"',
+                                quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerows(iterate_table_rows(table_name, field_names,
+                                                order_by))
+
+    def save_tables_data(self, export_dir_path):
+        """ Export all of the generated tables to CSV files. """
+        self.save_table_data(self.customer_table_name, CUSTOMER_FIELDS,
+                             'CustomerId', export_dir_path, 'customers.csv')
+        self.save_table_data(self.product_table_name, PRODUCT_FIELDS,
+                             'ProductId', export_dir_path, 'products.csv')
+        self.save_table_data(self.invoice_table_name, INVOICE_FIELDS,
+                             'InvoiceNumber', export_dir_path, 'invoices.csv')
+        self.save_table_data(self.invoice_deets_table_name,
+                             INVOICE_DETAIL_FIELDS, 'InvDetailNumber',
+                             export_dir_path, 'invoice_details.csv')
 
     def save_proj_spec_file(self, visible_settings,
                             export_dir_path, file_name):
+        content = self.make_proj_spec(visible_settings)
+        file_path = os.path.join(export_dir_path, file_name)
+        with open(file_path, 'w+') as proj_spec_file:
+            proj_spec_file.write(content)
+
+    def make_proj_spec(self, visible_settings):
+        """
+        Render the project description document.
+        :param visible_settings: Dict of the settings the user can see.
+        :return: HTML.
+        """
         # Compute user label to show.
         owner = self.project.owner
         user_label = owner.username
@@ -356,8 +785,98 @@ class FedsGenerator:
             'project_settings': project_settings,
             'tables': tables,
         }
+        return render_to_string('generate/project_spec.html', context)
 
-        content = render_to_string('generate/project_spec.html', context)
-        file_path = os.path.join(export_dir_path, file_name)
-        with open(file_path, 'w+') as proj_spec_file:
-            proj_spec_file.write(content)
+
+def export_products(exporter, anomaly_plan, product_columns):
+    """
+    Export stage for the products.
+    :return: List of AnomalyRows, for the anomalies put in.
+    """
+    product_columns, anomaly_rows = inject_anomalies(
+        anomaly_plan, 0, 0, 'products', product_columns)
+    exporter.write_chunk('products', PRODUCT_FIELDS, product_columns)
+    return anomaly_rows
+
+
+def chunk_tables(anomaly_plan, plan, customer_columns, invoice_chunk,
+                 product_columns=None):
+    """
+    List the tables in a chunk, with their anomalies.
+    :param anomaly_plan: AnomalyPlan, or None for no anomalies.
+    :param plan: ChunkPlan of the chunk.
+    :param product_columns: The product table, to join the chunk's
+            invoice lines to their invoices, customers and products, as
+            one table. None for separate tables.
+    :return: Tuple: list of tuples of table name, field names, columns;
+            list of AnomalyRows.
+    """
+    if product_columns is not None:
+        columns, anomaly_rows = join_chunk_anomalies(
+            anomaly_plan, plan, product_columns, customer_columns,
+            invoice_chunk)
+        return [(JOINED_TABLE, JOINED_FIELDS, columns)], anomaly_rows
+    tables = [
+        ('customers', CUSTOMER_FIELDS, customer_columns),
+        ('invoices', INVOICE_FIELDS, invoice_chunk.invoice_columns),
+        ('invoice_details', INVOICE_DETAIL_FIELDS,
+         invoice_chunk.detail_columns),
+    ]
+    anomalous_tables = list()
+    anomaly_rows = list()
+    for table_name, field_names, columns in tables:
+        columns, table_rows = inject_chunk_anomalies(
+            anomaly_plan, plan, table_name, columns)
+        anomalous_tables.append((table_name, field_names, columns))
+        anomaly_rows.extend(table_rows)
+    return anomalous_tables, anomaly_rows
+
+
+def export_chunk(exporter, anomaly_plan, plan, previous_export,
+                 customer_columns, invoice_chunk, product_columns=None):
+    """
+    Export stage for a chunk of customers and their invoices.
+    :return: List of AnomalyRows, for the anomalies put in.
+    """
+    tables, anomaly_rows = chunk_tables(anomaly_plan, plan, customer_columns,
+                                        invoice_chunk, product_columns)
+    for table_name, field_names, columns in tables:
+        exporter.write_chunk(table_name, field_names, columns)
+    return anomaly_rows
+
+
+def encode_chunk(encode_tables, anomaly_plan, plan, customer_columns,
+                 invoice_chunk, product_columns=None):
+    """
+    Encode stage for a chunk, run in a worker.
+    :return: Tuple: the encoded chunk, list of AnomalyRows.
+    """
+    tables, anomaly_rows = chunk_tables(anomaly_plan, plan, customer_columns,
+                                        invoice_chunk, product_columns)
+    return encode_tables(tables), anomaly_rows
+
+
+def export_encoded_chunk(exporter, previous_export, encoded_chunk):
+    """
+    Export stage for a chunk encoded in a worker.
+    :return: List of AnomalyRows, for the anomalies put in.
+    """
+    encoded, anomaly_rows = encoded_chunk
+    exporter.write_encoded(encoded)
+    return anomaly_rows
+
+
+def report_progress(progress, chunks_done, chunks_total, export_result):
+    """ Progress stage, run after a chunk is exported. """
+    progress(chunks_done, chunks_total)
+
+
+def parse_setting_date(date_value):
+    """
+    Convert a date setting value to a date.
+    :param date_value: Date string in Y/M/D form.
+    :return: datetime.date
+    """
+    date_parts = date_value.split('/')
+    return datetime.date(int(date_parts[0]), int(date_parts[1]),
+                         int(date_parts[2]))
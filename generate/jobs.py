@@ -0,0 +1,115 @@
+"""
+Run generation jobs off the queue in the DB.
+
+Each worker is a process that claims the oldest queued job, runs it, and
+looks for another. The number of workers caps the number of jobs running
+at once. Jobs are claimed with a conditional UPDATE, so workers never run
+the same job, without a broker or DB-specific row locks.
+"""
+
+import json
+import logging
+import multiprocessing
+import time
+
+from django.db import connections
+from django.utils import timezone
+
+from feds.settings import FEDS_GENERATION_JOB_POLL_SECONDS
+from generate.feds_generator import FedsGenerator
+from generate.models import GenerationJobDb
+from generate.variants import bundle_file_name
+from generate.views import make_project_archive, make_variant_archives, \
+    get_path_to_project_archive, get_project_archive_url, get_data_set_url
+
+logger = logging.getLogger(__name__)
+
+
+def claim_next_job():
+    """
+    Take the oldest queued job, and mark it running.
+    :return: GenerationJobDb, or None if the queue is empty.
+    """
+    queued_ids = GenerationJobDb.objects.filter(
+        status=GenerationJobDb.STATUS_QUEUED
+    ).order_by('pk').values_list('pk', flat=True)
+    for job_id in queued_ids[:10]:
+        # Only one worker's update finds the job still queued.
+        claimed = GenerationJobDb.objects.filter(
+            pk=job_id, status=GenerationJobDb.STATUS_QUEUED
+        ).update(status=GenerationJobDb.STATUS_RUNNING,
+                 when_started=timezone.now())
+        if claimed:
+            return GenerationJobDb.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    """ Generate a job's data set, recording progress and the result. """
+    project_id = str(job.project_id)
+
+    def progress(chunks_done, chunks_total):
+        GenerationJobDb.objects.filter(pk=job.pk).update(
+            chunks_done=chunks_done, chunks_total=chunks_total)
+
+    try:
+        visible_settings = json.loads(job.visible_settings or '{}')
+        generator = FedsGenerator(project_id)
+        if job.variants:
+            make_variant_archives(generator, visible_settings, project_id,
+                                  json.loads(job.variants), progress)
+            archive_url = get_data_set_url(bundle_file_name(project_id))
+        else:
+            zip_file_path = get_path_to_project_archive(project_id)
+            make_project_archive(generator, visible_settings, project_id,
+                                 zip_file_path, progress)
+            archive_url = get_project_archive_url(project_id)
+    except Exception as e:
+        logger.exception('Generation job {id} failed.'.format(id=job.pk))
+        GenerationJobDb.objects.filter(pk=job.pk).update(
+            status=GenerationJobDb.STATUS_FAILED, message=e.__str__(),
+            when_finished=timezone.now())
+        return
+    GenerationJobDb.objects.filter(pk=job.pk).update(
+        status=GenerationJobDb.STATUS_DONE, archive_url=archive_url,
+        when_finished=timezone.now())
+
+
+def work(poll_seconds=FEDS_GENERATION_JOB_POLL_SECONDS):
+    """ Worker process: run queued jobs, forever. """
+    while True:
+        job = claim_next_job()
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+        run_job(job)
+
+
+def requeue_running_jobs():
+    """
+    Put jobs left running by workers that stopped back on the queue.
+    Only call this when no workers are running.
+    :return: Number of jobs requeued.
+    """
+    return GenerationJobDb.objects.filter(
+        status=GenerationJobDb.STATUS_RUNNING
+    ).update(status=GenerationJobDb.STATUS_QUEUED, chunks_done=0,
+             when_started=None)
+
+
+def start_workers(number_workers,
+                  poll_seconds=FEDS_GENERATION_JOB_POLL_SECONDS):
+    """
+    Start worker processes.
+    :return: List of multiprocessing.Process.
+    """
+    # Forked workers must not share this process' DB connections.
+    connections.close_all()
+    workers = list()
+    for worker_index in range(number_workers):
+        worker = multiprocessing.Process(
+            target=work, args=(poll_seconds,),
+            name='feds-generation-{index}'.format(index=worker_index))
+        worker.start()
+        workers.append(worker)
+    return workers
@@ -0,0 +1,128 @@
+import datetime
+import time
+
+import numpy as np
+from django.core.management import BaseCommand
+
+from feds.settings import FEDS_EXPORT_FORMATS, FEDS_MIN_PRICE, \
+    FEDS_MAX_PRICE, FEDS_MIN_STANDARD_INVOICES_PER_CUST, \
+    FEDS_MAX_STANDARD_INVOICES_PER_CUST, FEDS_SALES_TAX_SETTING_DEFAULT, \
+    FEDS_WORKING_DAYS_WEEKMASKS, FEDS_WORKING_DAYS_WEEKDAYS, \
+    FEDS_GENERATION_CHUNK_SIZE, FEDS_STAT_DISTRIBUTION_CHOCIES, \
+    FEDS_NORMAL_DISTRIBUTION, \
+    FEDS_NORMAL_DISTRIBUTION_MEAN_TOTAL_BEFORE_TAX_DEFAULT, \
+    FEDS_BENFORD_FIELD, FEDS_BENFORD_TAMPERED_FRACTION, \
+    FEDS_BENFORD_DIGIT_WEIGHTS
+from generate.anomalies import AnomalyPlan, order_anomalies
+from generate.archive import ChunkedZipWriter
+from generate.benford import BenfordTampering
+from generate.chunks import iterate_table_chunks
+from generate.columns import days_in_range
+from generate.distributions import make_total_distribution
+from generate.exporters import make_archive_exporter
+from generate.feds_generator import ANOMALY_SETTINGS
+from generate.vocabulary import get_vocabulary_store
+
+
+class ByteCounter:
+    """ File object that counts the bytes written to it, and drops them. """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+# The class must be named Command, and subclass BaseCommand
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Compare the size and write speed of the export formats."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50000,
+                            help='Number of customers to make.')
+        parser.add_argument('--products', type=int, default=10,
+                            help='Number of products to make.')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed for the data.')
+        parser.add_argument('--distribution', default=FEDS_NORMAL_DISTRIBUTION,
+                            choices=[kind for kind, label
+                                     in FEDS_STAT_DISTRIBUTION_CHOCIES],
+                            help='Distribution of invoice totals.')
+        parser.add_argument('--benford', action='store_true',
+                            help='Tamper with invoice totals for the '
+                                 'Benford\'s law anomaly.')
+        parser.add_argument('--anomalies', action='store_true',
+                            help='Put every other anomaly into the data.')
+
+    # A command must define handle()
+    def handle(self, *args, **options):
+        """ Make the same data set in each format, and time it. """
+        last_year = datetime.date.today().year - 1
+        first_day = datetime.date(last_year, 1, 1)
+        last_day = datetime.date(last_year, 12, 31)
+        invoice_days = days_in_range(
+            first_day, last_day,
+            FEDS_WORKING_DAYS_WEEKMASKS[FEDS_WORKING_DAYS_WEEKDAYS])
+        total_distribution = make_total_distribution(
+            options['distribution'],
+            FEDS_NORMAL_DISTRIBUTION_MEAN_TOTAL_BEFORE_TAX_DEFAULT)
+        benford_tampering = None
+        if options['benford']:
+            benford_tampering = BenfordTampering(
+                FEDS_BENFORD_FIELD, FEDS_BENFORD_TAMPERED_FRACTION,
+                FEDS_BENFORD_DIGIT_WEIGHTS)
+        anomaly_plan = None
+        if options['anomalies']:
+            anomaly_plan = AnomalyPlan(
+                options['seed'],
+                order_anomalies(anomaly for machine_name, anomaly
+                                in ANOMALY_SETTINGS),
+                np.datetime64(first_day, 'D'), np.datetime64(last_day, 'D'))
+
+        def tables():
+            return iterate_table_chunks(
+                options['seed'], options['products'], options['customers'],
+                get_vocabulary_store(),
+                (FEDS_MIN_STANDARD_INVOICES_PER_CUST,
+                 FEDS_MAX_STANDARD_INVOICES_PER_CUST),
+                FEDS_SALES_TAX_SETTING_DEFAULT, invoice_days,
+                total_distribution, benford_tampering, anomaly_plan,
+                FEDS_MIN_PRICE, FEDS_MAX_PRICE, FEDS_GENERATION_CHUNK_SIZE)
+
+        # Time making the data alone, to take it out of the export times.
+        start = time.time()
+        rows = 0
+        for table_name, field_names, columns in tables():
+            rows += len(columns[field_names[0]])
+        make_seconds = time.time() - start
+        self.stdout.write('Made {rows} rows in {seconds:.2f}s.'.format(
+            rows=rows, seconds=make_seconds))
+        self.stdout.write('{format:<10} {seconds:>10} {export:>10} '
+                          '{size:>14} {ratio:>8}'.format(
+                              format='Format', seconds='Total s',
+                              export='Export s', size='Archive bytes',
+                              ratio='vs CSV'))
+        csv_size = None
+        for export_format, label in FEDS_EXPORT_FORMATS:
+            counter = ByteCounter()
+            archive = ChunkedZipWriter(counter)
+            start = time.time()
+            exporter = make_archive_exporter(export_format, archive,
+                                             anomaly_plan=anomaly_plan)
+            for table_name, field_names, columns in tables():
+                exporter.write_chunk(table_name, field_names, columns)
+            exporter.close()
+            archive.close()
+            seconds = time.time() - start
+            if csv_size is None:
+                csv_size = counter.size
+            self.stdout.write('{format:<10} {seconds:>10.2f} {export:>10.2f} '
+                              '{size:>14,} {ratio:>8.2f}'.format(
+                                  format=label, seconds=seconds,
+                                  export=seconds - make_seconds,
+                                  size=counter.size,
+                                  ratio=counter.size / csv_size))
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+from generate.vocabulary import VocabularyStore, BINARY_PATH
+
+
+# The class must be named Command, and subclass BaseCommand
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Build the memory-mapped vocabulary binary from the names lists."
+
+    # A command must define handle()
+    def handle(self, *args, **options):
+        """ Compile names_lists/*.txt into one binary file. """
+        store = VocabularyStore.from_text_files()
+        store.write_binary(BINARY_PATH)
+        self.stdout.write('Wrote {count} lists to {path}.'.format(
+            count=len(store.names()), path=BINARY_PATH))
@@ -0,0 +1,38 @@
+from django.core.management import BaseCommand
+
+from feds.settings import FEDS_GENERATION_JOB_WORKERS, \
+    FEDS_GENERATION_JOB_POLL_SECONDS
+from generate.jobs import requeue_running_jobs, start_workers
+
+
+# The class must be named Command, and subclass BaseCommand
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Run generation jobs from the queue, in worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=FEDS_GENERATION_JOB_WORKERS,
+            help='Number of jobs to run at the same time.')
+        parser.add_argument(
+            '--poll-seconds', type=float,
+            default=FEDS_GENERATION_JOB_POLL_SECONDS,
+            help='Seconds between looks at an empty queue.')
+
+    # A command must define handle()
+    def handle(self, *args, **options):
+        """ Start the workers, and wait for them. """
+        requeued = requeue_running_jobs()
+        if requeued:
+            self.stdout.write('Requeued {count} unfinished jobs.'.format(
+                count=requeued))
+        workers = start_workers(options['workers'], options['poll_seconds'])
+        self.stdout.write('Started {count} generation workers.'.format(
+            count=len(workers)))
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
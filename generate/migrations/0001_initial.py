@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('projects', '0002_projectdb_seed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJobDb',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('visible_settings', models.TextField(blank=True, default='', help_text='JSON of the settings shown to the user, for the project description document.')),
+                ('chunks_done', models.IntegerField(default=0, help_text='Number of chunks of customers exported so far.')),
+                ('chunks_total', models.IntegerField(default=0, help_text='Number of chunks of customers in the data set.')),
+                ('archive_url', models.CharField(blank=True, default='', help_text='URL of the archive, once the job is done.', max_length=200)),
+                ('message', models.TextField(blank=True, default='', help_text='Why the job failed.')),
+                ('when_submitted', models.DateTimeField(auto_now_add=True)),
+                ('when_started', models.DateTimeField(blank=True, null=True)),
+                ('when_finished', models.DateTimeField(blank=True, null=True)),
+                ('project', models.ForeignKey(help_text='Project to generate a data set for.', on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='projects.ProjectDb')),
+                ('user', models.ForeignKey(help_text='User who submitted the job.', on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generate', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjobdb',
+            name='variants',
+            field=models.TextField(blank=True, default='', help_text='JSON list of the labels of per-student variants to make. Blank for one data set.'),
+        ),
+    ]
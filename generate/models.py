@@ -1,3 +1,90 @@
+"""
+Generation jobs. Users submit jobs, and worker processes started by
+manage.py run_generation_workers take them off the queue, oldest first.
+"""
+
 from django.db import models
+from django.conf import settings
+
+from projects.models import ProjectDb
+
+
+class GenerationJobDb(models.Model):
+    """ A request to generate a project's data set. """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    # Statuses of jobs that are not finished.
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    project = models.ForeignKey(
+        ProjectDb,
+        related_name='generation_jobs',
+        help_text='Project to generate a data set for.'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='generation_jobs',
+        help_text='User who submitted the job.'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+        db_index=True,
+    )
+    visible_settings = models.TextField(
+        blank=True,
+        default='',
+        help_text='JSON of the settings shown to the user, for the project '
+                  'description document.'
+    )
+    variants = models.TextField(
+        blank=True,
+        default='',
+        help_text='JSON list of the labels of per-student variants to make. '
+                  'Blank for one data set.'
+    )
+    chunks_done = models.IntegerField(
+        default=0,
+        help_text='Number of chunks of customers exported so far, or of '
+                  'variants made.'
+    )
+    chunks_total = models.IntegerField(
+        default=0,
+        help_text='Number of chunks of customers in the data set, or of '
+                  'variants.'
+    )
+    archive_url = models.CharField(
+        max_length=200,
+        blank=True,
+        default='',
+        help_text='URL of the archive, once the job is done.'
+    )
+    message = models.TextField(
+        blank=True,
+        default='',
+        help_text='Why the job failed.'
+    )
+    when_submitted = models.DateTimeField(auto_now_add=True)
+    when_started = models.DateTimeField(null=True, blank=True)
+    when_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Job {id} for project {project}: {status}'.format(
+            id=self.pk, project=self.project_id, status=self.status)
 
-# Create your models here.
+    def progress(self):
+        """ Fraction of the job done, from 0 to 1. """
+        if self.status == self.STATUS_DONE:
+            return 1
+        if not self.chunks_total:
+            return 0
+        return self.chunks_done / self.chunks_total
@@ -0,0 +1,234 @@
+"""
+Run the stages of generating a data set, each as soon as its inputs are
+ready.
+
+Stages are declared with the names of the stages whose results they need.
+Stages that don't depend on each other run at the same time, on a pool of
+worker processes. Local stages, like writing to an export file that is
+open in this process, run here instead, in between handing out work.
+
+A stage's result is dropped once every stage that needs it has started,
+and no more than max_workers stages are handed out at a time, so results
+don't pile up in memory.
+"""
+
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from feds.settings import FEDS_GENERATION_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# A stage: its function, fixed arguments, the names of the stages whose
+# results are passed after the fixed arguments, and whether it has to run
+# in this process.
+Stage = namedtuple('Stage', ['name', 'func', 'args', 'inputs', 'local'])
+
+
+class StageScheduler:
+    """
+    Run a DAG of stages, in parallel where it can.
+    :param max_workers: Number of worker processes. 1 runs every stage in
+            this process, in the order they were added.
+    """
+
+    def __init__(self, max_workers=FEDS_GENERATION_WORKERS):
+        if max_workers < 1:
+            message = 'StageScheduler: bad number of workers: {workers}'
+            raise ValueError(message.format(workers=max_workers))
+        self.max_workers = max_workers
+        # Stages, in the order they were added. Inputs must be added before
+        # the stages that use them, so this is a topological order.
+        self.stages = OrderedDict()
+        # Wall-clock start and end time of each stage that has run.
+        self.timings = dict()
+        self.run_start = None
+
+    def add_stage(self, name, func, args=(), inputs=(), local=False):
+        """
+        Add a stage.
+        :param name: Unique name of the stage.
+        :param func: Function to run. Called with args, then the results of
+                the input stages, in order. Must be a module level function
+                if the stage isn't local, so it can be sent to a worker.
+        :param args: Tuple of fixed arguments.
+        :param inputs: Names of stages whose results func needs.
+        :param local: True if the stage must run in this process.
+        """
+        if name in self.stages:
+            message = 'StageScheduler: stage "{name}" already added.'
+            raise ValueError(message.format(name=name))
+        for input_name in inputs:
+            if input_name not in self.stages:
+                message = 'StageScheduler: stage "{name}" needs unknown ' \
+                          'stage "{input}".'
+                raise ValueError(message.format(name=name, input=input_name))
+        self.stages[name] = Stage(name, func, tuple(args), tuple(inputs),
+                                  local)
+
+    def run(self):
+        """
+        Run all of the stages.
+        :return: Dict of the results of stages that no other stage needs,
+                keyed by stage name.
+        """
+        self.timings = dict()
+        self.run_start = time.time()
+        # Number of stages still to start that need each stage's result.
+        uses_left = {name: 0 for name in self.stages}
+        for stage in self.stages.values():
+            for input_name in stage.inputs:
+                uses_left[input_name] += 1
+        results = dict()
+        waiting = list(self.stages.values())
+        if self.max_workers == 1:
+            for stage in waiting:
+                self.run_local(stage, results, uses_left)
+            return results
+        running = dict()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            while waiting or running:
+                started = True
+                while started:
+                    started = False
+                    for stage in waiting:
+                        if not all(input_name in results
+                                   for input_name in stage.inputs):
+                            continue
+                        if stage.local:
+                            waiting.remove(stage)
+                            self.run_local(stage, results, uses_left)
+                            # A new result: look again from the start.
+                            started = True
+                            break
+                        if len(running) < self.max_workers:
+                            waiting.remove(stage)
+                            future = executor.submit(
+                                run_timed, stage.func,
+                                self.take_args(stage, results, uses_left))
+                            running[future] = stage.name
+                            started = True
+                            break
+                if not running:
+                    if waiting:
+                        message = 'StageScheduler: stages can\'t start: ' \
+                                  '{names}'
+                        raise RuntimeError(message.format(
+                            names=', '.join(s.name for s in waiting)))
+                    break
+                finished, not_finished = wait(running,
+                                              return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    start, end, result = future.result()
+                    self.timings[name] = (start, end)
+                    results[name] = result
+        return results
+
+    def run_local(self, stage, results, uses_left):
+        """ Run a stage in this process, and keep its result. """
+        start, end, result = run_timed(
+            stage.func, self.take_args(stage, results, uses_left))
+        self.timings[stage.name] = (start, end)
+        results[stage.name] = result
+
+    def take_args(self, stage, results, uses_left):
+        """
+        Make a stage's arguments, dropping input results that no stage
+        still needs.
+        :return: Tuple of arguments.
+        """
+        args = stage.args + tuple(results[input_name]
+                                  for input_name in stage.inputs)
+        for input_name in stage.inputs:
+            uses_left[input_name] -= 1
+            if uses_left[input_name] == 0:
+                del results[input_name]
+        return args
+
+    def stage_seconds(self, name):
+        start, end = self.timings[name]
+        return end - start
+
+    def critical_path(self):
+        """
+        Find the chain of dependent stages that took the longest, which
+        sets the least wall-clock time the run could take.
+        :return: Tuple: list of stage names, in order, total seconds.
+        """
+        # Longest chain ending at each stage, found in topological order.
+        chain_seconds = dict()
+        chain_previous = dict()
+        for stage in self.stages.values():
+            previous = None
+            for input_name in stage.inputs:
+                if previous is None \
+                        or chain_seconds[input_name] > chain_seconds[previous]:
+                    previous = input_name
+            chain_previous[stage.name] = previous
+            chain_seconds[stage.name] = self.stage_seconds(stage.name) \
+                + (chain_seconds[previous] if previous else 0)
+        if not chain_seconds:
+            return list(), 0
+        name = max(chain_seconds, key=chain_seconds.get)
+        total_seconds = chain_seconds[name]
+        path = list()
+        while name is not None:
+            path.append(name)
+            name = chain_previous[name]
+        path.reverse()
+        return path, total_seconds
+
+    def report(self):
+        """
+        Log and return the timings of the last run.
+        :return: Dict: stages, a list of dicts with each stage's name, start
+                (seconds after the run started) and seconds; critical_path,
+                a list of stage names; critical_path_seconds, the least
+                time the run could take with enough workers; stage_seconds,
+                the total time of all stages; and wall_seconds, for the
+                whole run.
+        """
+        stages = list()
+        for name in self.stages:
+            start, end = self.timings[name]
+            stages.append({
+                'stage': name,
+                'start': start - self.run_start,
+                'seconds': end - start,
+            })
+        path, path_seconds = self.critical_path()
+        stage_seconds = sum(stage['seconds'] for stage in stages)
+        wall_seconds = max([end for start, end in self.timings.values()]
+                           + [self.run_start]) - self.run_start
+        for stage in stages:
+            message = 'Stage {stage}: started at {start:.2f}s, ' \
+                      'took {seconds:.2f}s.'
+            logger.info(message.format(**stage))
+        message = 'Ran {stages} stages, {stage_seconds:.2f}s of work, in ' \
+                  '{wall:.2f}s on {workers} workers. Critical path, ' \
+                  '{path_seconds:.2f}s: {path}.'
+        logger.info(message.format(
+            stages=len(stages), stage_seconds=stage_seconds,
+            wall=wall_seconds, workers=self.max_workers,
+            path_seconds=path_seconds, path=' -> '.join(path)))
+        return {
+            'stages': stages,
+            'critical_path': path,
+            'critical_path_seconds': path_seconds,
+            'stage_seconds': stage_seconds,
+            'wall_seconds': wall_seconds,
+        }
+
+
+def run_timed(func, args):
+    """
+    Run a stage's function, timing it. Wall-clock time, so times from
+    different processes line up.
+    :return: Tuple: start time, end time, result.
+    """
+    start = time.time()
+    result = func(*args)
+    return start, time.time(), result
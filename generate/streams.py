@@ -0,0 +1,48 @@
+"""
+Seeded random number streams for the generator.
+
+A project's seed is split into independent child streams, one per kind of
+data, each split again by chunk, the way SeedSequence.spawn() does it.
+Chunk k of a table always gets the same stream, however many chunks there
+are and wherever it is made, so a chunk comes out bit-identical whether
+it's made serially or by another worker. Streams don't overlap, so chunks
+made in parallel aren't correlated.
+
+Keys below are part of the seed's meaning. Changing them changes every
+data set, so only add new ones.
+"""
+
+import numpy as np
+
+# Number of customers and products to make. Chunk 0 is customers,
+# chunk 1 products.
+PROJECT_SIZE_STREAM = 0
+PRODUCT_STREAM = 1
+CUSTOMER_STREAM = 2
+# Number of invoices for each customer.
+INVOICE_COUNT_STREAM = 3
+# Number of detail lines on each invoice.
+LINE_COUNT_STREAM = 4
+# Everything else about invoices and their detail lines.
+INVOICE_STREAM = 5
+# Invoices tampered with for the Benford's law anomaly.
+BENFORD_STREAM = 6
+# Rows given anomalies, split by anomaly.
+ANOMALY_STREAM = 7
+
+
+def make_rng(seed, stream_key, chunk_index=0, sub_key=None):
+    """
+    Make the generator for one chunk of one stream.
+    :param seed: The project's seed.
+    :param stream_key: Which stream, e.g., CUSTOMER_STREAM.
+    :param chunk_index: Which chunk of the stream, from 0.
+    :param sub_key: Optional int, to split a chunk's stream again, e.g.,
+            one stream per anomaly.
+    :return: numpy.random.Generator
+    """
+    spawn_key = (stream_key, chunk_index)
+    if sub_key is not None:
+        spawn_key += (sub_key,)
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=spawn_key)
+    return np.random.default_rng(seed_sequence)
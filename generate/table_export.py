@@ -0,0 +1,79 @@
+"""
+Stream rows out of generated tables, without loading whole tables.
+
+MySQL/MariaDB use an unbuffered SSCursor, so rows come off the socket as
+they are read. PostgreSQL uses a named, server-side cursor. Other DBs,
+like SQLite, read fetchmany() batches from a normal cursor.
+"""
+
+from django.db import connection, transaction
+
+from feds.settings import DATABASES, FEDS_EXPORT_BATCH_SIZE
+
+
+def iterate_table_rows(table_name, field_names, order_by,
+                       batch_size=FEDS_EXPORT_BATCH_SIZE):
+    """
+    Read a table's rows, a batch at a time.
+    :param table_name: Name of the table.
+    :param field_names: Fields to read, in order.
+    :param order_by: Field to sort the rows by.
+    :param batch_size: Number of rows read from the DB at a time.
+    :return: Iterator of row tuples.
+    """
+    sql = 'SELECT {fields} FROM {table} ORDER BY {order_by}'.format(
+        fields=', '.join(field_names),
+        table=table_name,
+        order_by=order_by
+    )
+    engine = DATABASES['default']['ENGINE']
+    if 'mysql' in engine:
+        return iterate_mysql(sql, batch_size)
+    if 'postgresql' in engine:
+        return iterate_postgres(sql, table_name, batch_size)
+    return iterate_batches(sql, batch_size)
+
+
+def iterate_mysql(sql, batch_size):
+    """ Read rows with an unbuffered MySQLdb SSCursor. """
+    from MySQLdb.cursors import SSCursor
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(SSCursor)
+    try:
+        cursor.execute(sql)
+        yield from fetch_batches(cursor, batch_size)
+    finally:
+        # Unread rows have to be drained before the connection is used
+        # again. close() does that.
+        cursor.close()
+
+
+def iterate_postgres(sql, table_name, batch_size):
+    """ Read rows with a psycopg2 named cursor. """
+    # Named cursors only live inside a transaction.
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            name='feds_export_{table}'.format(table=table_name))
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(sql)
+            yield from fetch_batches(cursor, batch_size)
+        finally:
+            cursor.close()
+
+
+def iterate_batches(sql, batch_size):
+    """ Read rows with fetchmany() on a normal cursor. """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [])
+        yield from fetch_batches(cursor, batch_size)
+
+
+def fetch_batches(cursor, batch_size):
+    """ Yield a cursor's rows, fetching batch_size at a time. """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
@@ -1,3 +1,1410 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import os
+import pickle
+import sqlite3
+import struct
+import tempfile
+import types
+import zipfile
+from collections import OrderedDict
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from feds.settings import FEDS_NORMAL_DISTRIBUTION, \
+    FEDS_SKEWED_DISTRIBUTION, FEDS_MIXED_DISTRIBUTION
+from generate.anomalies import Anomaly, AnomalyPlan, AnomalyRows, \
+    ANOMALY_KERNELS, ARITHMETIC_ERRORS, NEGATIVE_NUMBERS, OUT_OF_RANGE, \
+    DUPLICATE_VALUES, MISSING, BENFORDS_LAW, order_anomalies, \
+    table_anomalies, inject_anomalies, add_anomaly_rows, \
+    anomaly_answer_key_csv, bitmap_member_name
+from generate.archive import ChunkedZipWriter, StreamingZipWriter, \
+    StreamBuffer, ZIP64_MARKER, compress_piece
+from generate.archive_cache import ArchiveCache, archive_key
+from generate.benford import BenfordTampering, leading_digits, \
+    tamper_amounts, add_benford_counts, benford_statistics, \
+    benford_summary_csv, benford_digits_csv
+from generate.bitmaps import RowBitmap
+from generate.bulk_load import BulkLoader, encode_rows
+from generate.columns import CUSTOMER_FIELDS, PRODUCT_FIELDS, \
+    INVOICE_FIELDS, INVOICE_DETAIL_FIELDS, make_customer_columns, \
+    make_product_columns, make_invoice_columns, days_in_range, column_rows, \
+    concatenate_offsets, concatenate_columns, JOINED_TABLE, JOINED_FIELDS, \
+    key_positions, join_invoice_lines, \
+    tamper_invoice_amounts
+from generate.chunks import plan_chunks, make_customer_chunk, \
+    make_invoice_chunk
+from generate.distributions import make_total_distribution, \
+    sample_distribution, fit_lines
+from generate.feds_generator import FedsGenerator
+from generate.exporters import CsvArchiveExporter, \
+    ParquetArchiveExporter, ArrowArchiveExporter, SqliteArchiveExporter, \
+    money_array
+from generate.jobs import claim_next_job, requeue_running_jobs
+from generate.models import GenerationJobDb
+from generate.scheduler import StageScheduler
+from generate.streams import CUSTOMER_STREAM, INVOICE_STREAM, make_rng
+from generate.table_export import fetch_batches
+from generate.variants import parse_variant_labels, plan_variants
+from generate.vocabulary import VocabularyStore, WordColumn, WordIndices, \
+    get_vocabulary_store, resolve_column
+from businessareas.models import BusinessAreaDb
+from projects.models import ProjectDb
+
+
+class CustomerColumnsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vocabularies = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Fiona'],
+            'last_names': ['Huff', 'Myers'],
+            'street_names': ['Holly Drive'],
+            'street_types': ['Lane'],
+            'town_names': ['Clover'],
+            'zip_codes': ['52402'],
+            'tlds': ['com'],
+        })
+
+    def test_columns_shape(self):
+        columns = make_customer_columns(np.random.default_rng(), 50,
+                                        self.vocabularies, first_id=11)
+        self.assertEqual(tuple(columns.keys()), CUSTOMER_FIELDS)
+        for field_name in CUSTOMER_FIELDS:
+            self.assertEqual(len(columns[field_name]), 50)
+        self.assertEqual(columns['CustomerId'][0], 11)
+        self.assertEqual(columns['CustomerId'][-1], 60)
+
+    def test_row_values(self):
+        columns = make_customer_columns(np.random.default_rng(), 20,
+                                        self.vocabularies)
+        for row in column_rows(columns, CUSTOMER_FIELDS):
+            customer_id, name, address, zip_code, phone, email = row
+            first, last = name.split(' ')
+            self.assertEqual(email, first.lower() + '@' + last.lower()
+                             + '.com')
+            self.assertTrue(address.endswith(' Holly Drive Lane, Clover'))
+            self.assertEqual(zip_code, '52402')
+            self.assertEqual(len(phone), 10)
+
+
+class ProductColumnsTests(SimpleTestCase):
+
+    def test_prices_in_range(self):
+        vocabularies = VocabularyStore.from_lists({
+            'product_adjectives': ['long'],
+            'product_types': ['boots'],
+            'product_descriptions': ["Won't last."],
+        })
+        columns = make_product_columns(np.random.default_rng(), 100,
+                                       vocabularies, 6, 178)
+        self.assertEqual(tuple(columns.keys()), PRODUCT_FIELDS)
+        self.assertTrue((columns['ProdPrice'] >= 6).all())
+        self.assertTrue((columns['ProdPrice'] <= 178).all())
+        self.assertEqual(resolve_column(columns['ProductName'])[0],
+                         'Long boots')
+
+
+class InvoiceColumnsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.days = days_in_range(datetime.date(2017, 1, 1),
+                                  datetime.date(2017, 1, 31), '1111100')
+        self.invoices, self.details, self.offsets = make_invoice_columns(
+            np.random.default_rng(), np.array([1, 2, 3]), np.array([2, 0, 5]),
+            np.array([6.00, 10.50, 99.99]), 0.06, self.days)
+
+    def test_layout(self):
+        self.assertEqual(tuple(self.invoices.keys()), INVOICE_FIELDS)
+        self.assertEqual(tuple(self.details.keys()), INVOICE_DETAIL_FIELDS)
+        self.assertEqual(list(self.invoices['CustomerId']),
+                         [1, 1, 3, 3, 3, 3, 3])
+        self.assertEqual(len(self.offsets), 8)
+        self.assertEqual(self.offsets[-1], len(self.details['InvoiceNumber']))
+        # Each invoice's lines point back to it.
+        for i, invoice_number in enumerate(self.invoices['InvoiceNumber']):
+            lines = self.details['InvoiceNumber'][
+                self.offsets[i]:self.offsets[i + 1]]
+            self.assertTrue(len(lines) > 0)
+            self.assertTrue((lines == invoice_number).all())
+
+    def test_totals(self):
+        for i in range(len(self.invoices['InvoiceNumber'])):
+            subtotals = self.details['SubtotalProduct'][
+                self.offsets[i]:self.offsets[i + 1]]
+            self.assertAlmostEqual(self.invoices['TotalBTax'][i],
+                                   subtotals.sum(), places=2)
+            self.assertAlmostEqual(
+                self.invoices['Total'][i],
+                self.invoices['TotalBTax'][i] + self.invoices['SalesTax'][i],
+                places=2)
+
+    def test_dates(self):
+        self.assertTrue(np.isin(self.invoices['InvoiceDate'],
+                                self.days).all())
+        self.assertTrue((self.invoices['DueDate']
+                         >= self.invoices['InvoiceDate']).all())
+        is_cash = self.invoices['PaymentType'] == 'cash'
+        self.assertTrue((self.invoices['DueDate'][is_cash]
+                         == self.invoices['InvoiceDate'][is_cash]).all())
+
+    def test_weekends_skipped(self):
+        # Jan 1, 2017 was a Sunday.
+        self.assertEqual(self.days[0], np.datetime64('2017-01-02'))
+        self.assertEqual(len(self.days), 22)
+
+
+class BulkLoaderTests(SimpleTestCase):
+
+    def test_bad_chunk_size(self):
+        with self.assertRaises(ValueError):
+            BulkLoader(chunk_size=0)
+
+
+class EncodeRowsTests(SimpleTestCase):
+
+    def test_quoting_and_nulls(self):
+        rows = [(1, 'Won\'t "break"', 2.5, None)]
+        self.assertEqual(encode_rows(rows, null_text='NULL'),
+                         '1,"Won\'t ""break""",2.5,NULL\n')
+        self.assertEqual(encode_rows(rows, null_text=''),
+                         '1,"Won\'t ""break""",2.5,\n')
+
+
+class ChunkedZipWriterTests(SimpleTestCase):
+
+    def write_archive(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        # Interleave the members, like the generator does.
+        for chunk in range(3):
+            archive.write('customers.csv', 'customer chunk {}\n'.format(chunk))
+            archive.write('invoices.csv', b'invoice chunk %d\n' % chunk)
+        archive.write('project.html', '<p>Caf\u00e9</p>')
+        archive.close()
+        return zipfile.ZipFile(io.BytesIO(output.getvalue()))
+
+    def check_archive(self, zip_file):
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(),
+                         ['customers.csv', 'invoices.csv', 'project.html'])
+        self.assertEqual(zip_file.read('customers.csv'),
+                         b'customer chunk 0\ncustomer chunk 1\n'
+                         b'customer chunk 2\n')
+        self.assertEqual(zip_file.read('project.html').decode('utf-8'),
+                         '<p>Caf\u00e9</p>')
+
+    def test_interleaved_members(self):
+        self.check_archive(self.write_archive())
+
+    def test_zip64(self):
+        # Make every size and offset count as too big for classic zip.
+        with mock.patch('generate.archive.ZIP64_LIMIT', 1), \
+                mock.patch('generate.archive.ZIP64_COUNT_LIMIT', 1):
+            zip_file = self.write_archive()
+        self.check_archive(zip_file)
+
+    def test_pieces_joined(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        # Pieces compressed elsewhere, mixed with plain writes.
+        archive.write_piece('invoices.csv', compress_piece('one\n'))
+        archive.write('invoices.csv', 'two\n')
+        archive.write_piece('invoices.csv', compress_piece(b'three\n' * 1000))
+        archive.close()
+        zip_file = zipfile.ZipFile(output)
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.read('invoices.csv'),
+                         b'one\ntwo\n' + b'three\n' * 1000)
+
+    def test_write_after_close(self):
+        archive = ChunkedZipWriter(io.BytesIO())
+        archive.close()
+        with self.assertRaises(ValueError):
+            archive.write('customers.csv', 'late')
+
+
+class StreamingZipWriterTests(SimpleTestCase):
+
+    def write_archive(self):
+        stream_buffer = StreamBuffer()
+        archive = StreamingZipWriter(stream_buffer)
+        blocks = list()
+        for member_name in ('customers.csv', 'invoices.csv'):
+            for chunk in range(3):
+                archive.write(member_name, '{name} chunk {chunk}\n'.format(
+                    name=member_name[:-4], chunk=chunk))
+                blocks.append(stream_buffer.take())
+        archive.close()
+        blocks.append(stream_buffer.take())
+        # Data goes out as it's written, not at close().
+        self.assertTrue(all(blocks))
+        return zipfile.ZipFile(io.BytesIO(b''.join(blocks)))
+
+    def check_archive(self, zip_file):
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(), ['customers.csv', 'invoices.csv'])
+        self.assertEqual(zip_file.read('invoices.csv'),
+                         b'invoices chunk 0\ninvoices chunk 1\n'
+                         b'invoices chunk 2\n')
+
+    def test_members_in_sequence(self):
+        self.check_archive(self.write_archive())
+
+    def test_zip64(self):
+        with mock.patch('generate.archive.ZIP64_LIMIT', 1), \
+                mock.patch('generate.archive.ZIP64_COUNT_LIMIT', 1):
+            zip_file = self.write_archive()
+        self.check_archive(zip_file)
+
+    def test_zip64_local_header(self):
+        stream_buffer = StreamBuffer()
+        archive = StreamingZipWriter(stream_buffer)
+        archive.write('customers.csv', 'one\n')
+        archive.close()
+        data = stream_buffer.take()
+        # Sizes aren't known yet, so they're in a Zip64 extra field, zeroed.
+        self.assertEqual(struct.unpack('<II', data[18:26]),
+                         (ZIP64_MARKER, ZIP64_MARKER))
+        name_length, extra_length = struct.unpack('<HH', data[26:30])
+        extra_start = 30 + name_length
+        self.assertEqual(
+            struct.unpack('<HHQQ',
+                          data[extra_start:extra_start + extra_length]),
+            (0x0001, 16, 0, 0))
+        # So the data descriptor has Zip64 sizes.
+        info = zipfile.ZipFile(io.BytesIO(data)).getinfo('customers.csv')
+        descriptor_start = extra_start + extra_length + info.compress_size
+        self.assertEqual(
+            struct.unpack('<IIQQ',
+                          data[descriptor_start:descriptor_start + 24]),
+            (0x08074b50, info.CRC, info.compress_size, info.file_size))
+
+    def test_stored(self):
+        stream_buffer = StreamBuffer()
+        archive = StreamingZipWriter(stream_buffer)
+        archive.write('variants.csv', 'Student,File\n')
+        for block in (b'PK\x03\x04', b'compressed'):
+            archive.write_stored('project1_a.zip', block)
+        with self.assertRaises(ValueError):
+            archive.write('project1_a.zip', 'more')
+        archive.close()
+        zip_file = zipfile.ZipFile(io.BytesIO(stream_buffer.take()))
+        self.assertIsNone(zip_file.testzip())
+        info = zip_file.getinfo('project1_a.zip')
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(info.compress_size, info.file_size)
+        self.assertEqual(zip_file.read('project1_a.zip'),
+                         b'PK\x03\x04compressed')
+        self.assertEqual(zip_file.getinfo('variants.csv').compress_type,
+                         zipfile.ZIP_DEFLATED)
+
+    def test_finished_member_not_reopened(self):
+        archive = StreamingZipWriter(io.BytesIO())
+        archive.write('customers.csv', 'one\n')
+        archive.write('invoices.csv', 'two\n')
+        with self.assertRaises(ValueError):
+            archive.write('customers.csv', 'three\n')
+
+
+class ArchiveCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ArchiveCache(os.path.join(self.dir.name, 'cache'), 10)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_file(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_hit_and_miss(self):
+        target_path = os.path.join(self.dir.name, 'project1.zip')
+        self.assertFalse(self.cache.get('ab12', target_path))
+        self.cache.put('ab12', self.make_file('made.zip', b'zip'))
+        self.assertTrue(self.cache.get('ab12', target_path))
+        with open(target_path, 'rb') as file:
+            self.assertEqual(file.read(), b'zip')
+        with self.cache.open('ab12') as file:
+            self.assertEqual(file.read(), b'zip')
+        self.assertIsNone(self.cache.open('cd34'))
+
+    def test_least_recently_used_evicted(self):
+        for age, key in enumerate(['aa01', 'bb02']):
+            self.cache.put(key, self.make_file(key, b'1234'))
+            os.utime(self.cache.path_for(key), (age, age))
+        # Using the oldest makes the other one least recently used.
+        self.cache.get('aa01', os.path.join(self.dir.name, 'project1.zip'))
+        self.cache.put('cc03', self.make_file('cc03', b'1234'))
+        self.assertTrue(os.path.exists(self.cache.path_for('aa01')))
+        self.assertFalse(os.path.exists(self.cache.path_for('bb02')))
+        self.assertTrue(os.path.exists(self.cache.path_for('cc03')))
+
+    def test_hit_leaves_part_file(self):
+        target_path = os.path.join(self.dir.name, 'project1.zip')
+        # An archive being written to the same target.
+        part_file_path = self.make_file('project1.zip.part', b'half')
+        self.cache.put('ab12', self.make_file('made.zip', b'zip'))
+        self.assertTrue(self.cache.get('ab12', target_path))
+        with open(part_file_path, 'rb') as file:
+            self.assertEqual(file.read(), b'half')
+        self.assertEqual(sorted(os.listdir(self.dir.name)),
+                         ['cache', 'made.zip', 'project1.zip',
+                          'project1.zip.part'])
+
+    def test_tee(self):
+        blocks = [b'z', b'i', b'p']
+        self.assertEqual(list(self.cache.tee('ab12', iter(blocks))), blocks)
+        with self.cache.open('ab12') as file:
+            self.assertEqual(file.read(), b'zip')
+
+    def test_tee_cut_short(self):
+        stream = self.cache.tee('ab12', iter([b'z', b'i', b'p']))
+        next(stream)
+        # The client went away.
+        stream.close()
+        self.assertIsNone(self.cache.open('ab12'))
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.cache.path_for('ab12'))), [])
+
+    def test_no_budget(self):
+        cache = ArchiveCache(os.path.join(self.dir.name, 'off'), 0)
+        cache.put('ab12', self.make_file('made.zip', b'zip'))
+        self.assertFalse(os.path.exists(cache.path_for('ab12')))
+        self.assertEqual(list(cache.tee('ab12', iter([b'zip']))), [b'zip'])
+        self.assertFalse(os.path.exists(cache.path_for('ab12')))
+
+    def test_key(self):
+        def make_project(value):
+            setting = types.SimpleNamespace(
+                machine_name='ba_setting', params={'value': value})
+            item = dict(title='T', description='', machine_name='m')
+            return types.SimpleNamespace(
+                owner=types.SimpleNamespace(
+                    username='u', first_name='', last_name=''),
+                business_area=types.SimpleNamespace(settings=[setting],
+                                                    **item),
+                notional_tables=[], settings=[], **item)
+        vocabularies = VocabularyStore.from_lists({'tlds': ['com']})
+        days = (datetime.date(2017, 1, 1), datetime.date(2017, 12, 31))
+        key = archive_key(make_project(1), 5, {'a': 1}, vocabularies, days)
+        self.assertEqual(key, archive_key(make_project(1), 5, {'a': 1},
+                                          vocabularies, days))
+        self.assertNotEqual(key, archive_key(make_project(2), 5, {'a': 1},
+                                             vocabularies, days))
+        self.assertNotEqual(key, archive_key(make_project(1), 6, {'a': 1},
+                                             vocabularies, days))
+        self.assertNotEqual(key, archive_key(make_project(1), 5, {'a': 2},
+                                             vocabularies, days))
+        # Last year's data isn't handed out once the year changes.
+        next_days = (datetime.date(2018, 1, 1), datetime.date(2018, 12, 31))
+        self.assertNotEqual(key, archive_key(make_project(1), 5, {'a': 1},
+                                             vocabularies, next_days))
+
+
+class CsvArchiveExporterTests(SimpleTestCase):
+
+    def test_chunks_appended(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        exporter = CsvArchiveExporter(archive)
+        for first_id in (1, 3):
+            exporter.write_chunk('products', ('ProductId', 'ProductName'), {
+                'ProductId': np.array([first_id, first_id + 1]),
+                'ProductName': np.array(['Long boots', 'Red "hat"']),
+            })
+        archive.close()
+        content = zipfile.ZipFile(output).read('products.csv').decode()
+        self.assertEqual(content.splitlines(), [
+            '1,"Long boots"', '2,"Red ""hat"""',
+            '3,"Long boots"', '4,"Red ""hat"""',
+        ])
+
+    def test_encoded_in_workers(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        exporter = CsvArchiveExporter(archive)
+        columns = {'ProductId': np.array([1, 2])}
+        exporter.write_encoded(exporter.encode_tables(
+            [('products', ('ProductId',), columns)]))
+        archive.close()
+        content = zipfile.ZipFile(output).read('products.csv').decode()
+        self.assertEqual(content.splitlines(), ['1', '2'])
+
+
+class ColumnarArchiveExporterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vocabularies = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Fiona'],
+            'last_names': ['Huff', 'Myers'],
+            'street_names': ['Holly Drive'],
+            'street_types': ['Lane'],
+            'town_names': ['Clover'],
+            'zip_codes': ['52402', '52403'],
+            'tlds': ['com'],
+        })
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 1, 31), '1111100')
+        rng = np.random.default_rng(5)
+        # Two chunks of each table.
+        self.chunks = list()
+        for first_id in (1, 4):
+            invoices, details, offsets = make_invoice_columns(
+                rng, np.arange(first_id, first_id + 3), np.array([2, 1, 3]),
+                np.array([6.00, 10.50, 99.99]), 0.06, days)
+            self.chunks.append({
+                'customers': make_customer_columns(
+                    rng, 3, self.vocabularies, first_id),
+                'invoices': invoices,
+            })
+
+    def export(self, exporter_class, archive):
+        exporter = exporter_class(archive)
+        for table_name, field_names in [('customers', CUSTOMER_FIELDS),
+                                        ('invoices', INVOICE_FIELDS)]:
+            for chunk in self.chunks:
+                exporter.write_chunk(table_name, field_names,
+                                     chunk[table_name])
+        exporter.close()
+
+    def check_table(self, table):
+        self.assertEqual(table.num_rows, 12)
+        self.assertEqual(table.schema.field('TotalBTax').type,
+                         pa.decimal128(12, 2))
+        self.assertEqual(table.schema.field('InvoiceDate').type, pa.date32())
+        self.assertTrue(pa.types.is_dictionary(
+            table.schema.field('PaymentType').type))
+        expected = np.concatenate([chunk['invoices']['TotalBTax']
+                                   for chunk in self.chunks])
+        self.assertEqual([float(value) for value
+                          in table.column('TotalBTax').to_pylist()],
+                         list(expected))
+        expected = np.concatenate([chunk['invoices']['PaymentType']
+                                   for chunk in self.chunks])
+        self.assertEqual(table.column('PaymentType').to_pylist(),
+                         list(expected))
+
+    def test_parquet(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        self.export(ParquetArchiveExporter, archive)
+        archive.close()
+        zip_file = zipfile.ZipFile(output)
+        self.check_table(pq.read_table(
+            io.BytesIO(zip_file.read('invoices.parquet'))))
+        customers = pq.read_table(
+            io.BytesIO(zip_file.read('customers.parquet')))
+        self.assertEqual(customers.column('CZipCode').to_pylist(), list(
+            np.concatenate([resolve_column(chunk['customers']['CZipCode'])
+                            for chunk in self.chunks])))
+
+    def test_arrow_streamed(self):
+        stream_buffer = StreamBuffer()
+        archive = StreamingZipWriter(stream_buffer)
+        self.export(lambda archive: ArrowArchiveExporter(
+            archive, sequential=True), archive)
+        archive.close()
+        zip_file = zipfile.ZipFile(io.BytesIO(stream_buffer.take()))
+        self.check_table(pa.ipc.open_file(
+            io.BytesIO(zip_file.read('invoices.arrow'))).read_all())
+
+
+class SqliteArchiveExporterTests(SimpleTestCase):
+
+    def setUp(self):
+        vocabularies = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Fiona'],
+            'last_names': ['Huff', 'Myers'],
+            'street_names': ['Holly Drive'],
+            'street_types': ['Lane'],
+            'town_names': ['Clover'],
+            'zip_codes': ['52402', '52403'],
+            'tlds': ['com'],
+        })
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 1, 31), '1111100')
+        rng = np.random.default_rng(5)
+        self.products = {
+            'ProductId': np.array([1, 2, 3]),
+            'ProductName': np.array(['Boots', 'Hat', 'Scarf']),
+            'Description': np.array(['Long boots', 'Red hat', 'Scarf']),
+            'ProdPrice': np.array([6.00, 10.50, 99.99]),
+        }
+        self.customers = make_customer_columns(rng, 4, vocabularies)
+        self.invoices, self.details, offsets = make_invoice_columns(
+            rng, np.arange(1, 5), np.array([2, 1, 3, 1]),
+            self.products['ProdPrice'], 0.06, days)
+
+    def export(self, archive, anomaly_plan=None):
+        # A small transaction size, so the load takes several commits.
+        exporter = SqliteArchiveExporter(archive, anomaly_plan,
+                                         transaction_rows=5)
+        exporter.write_chunk('products', PRODUCT_FIELDS, self.products)
+        exporter.write_chunk('customers', CUSTOMER_FIELDS, self.customers)
+        exporter.write_chunk('invoices', INVOICE_FIELDS, self.invoices)
+        exporter.write_chunk('invoice_details', INVOICE_DETAIL_FIELDS,
+                             self.details)
+        exporter.close()
+        self.assertFalse(os.path.exists(exporter.database_path))
+
+    def open_database(self, zip_file):
+        database_file = tempfile.NamedTemporaryFile(suffix='.sqlite',
+                                                    delete=False)
+        self.addCleanup(os.unlink, database_file.name)
+        with database_file:
+            database_file.write(zip_file.read('project.sqlite'))
+        connection = sqlite3.connect(database_file.name)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_tables_loaded(self):
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        self.export(archive)
+        archive.close()
+        connection = self.open_database(zipfile.ZipFile(output))
+        for table_name, columns in [('products', self.products),
+                                    ('customers', self.customers),
+                                    ('invoices', self.invoices),
+                                    ('invoice_details', self.details)]:
+            count, = connection.execute(
+                'SELECT COUNT(*) FROM ' + table_name).fetchone()
+            self.assertEqual(count, len(next(iter(columns.values()))))
+        rows = connection.execute(
+            'SELECT InvoiceNumber, InvoiceDate, Total FROM invoices '
+            'ORDER BY InvoiceNumber').fetchall()
+        self.assertEqual(rows, [
+            (number, str(date), total) for number, date, total in zip(
+                self.invoices['InvoiceNumber'].tolist(),
+                self.invoices['InvoiceDate'].tolist(),
+                self.invoices['Total'].tolist())])
+        # Detail lines join back to their invoices, and add up.
+        rows = connection.execute(
+            'SELECT i.InvoiceNumber, i.TotalBTax, '
+            'ROUND(SUM(d.SubtotalProduct), 2) FROM invoices i '
+            'JOIN invoice_details d ON d.InvoiceNumber = i.InvoiceNumber '
+            'GROUP BY i.InvoiceNumber').fetchall()
+        self.assertEqual(len(rows), len(self.invoices['InvoiceNumber']))
+        for invoice_number, total_before_tax, lines_total in rows:
+            self.assertAlmostEqual(total_before_tax, lines_total)
+
+    def test_keys_indexed(self):
+        stream_buffer = StreamBuffer()
+        archive = StreamingZipWriter(stream_buffer)
+        self.export(archive)
+        archive.close()
+        connection = self.open_database(
+            zipfile.ZipFile(io.BytesIO(stream_buffer.take())))
+        indexes = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertLessEqual({'products_id', 'customers_id',
+                              'invoices_number', 'invoices_customer',
+                              'invoices_date', 'invoice_details_number',
+                              'invoice_details_invoice',
+                              'invoice_details_product'}, indexes)
+        count, = connection.execute(
+            'SELECT COUNT(*) FROM invoice_lines').fetchone()
+        self.assertEqual(count, len(self.details['InvDetailNumber']))
+        # With no anomalies, the keys are declared too.
+        self.assertEqual(self.declared_keys(connection), {
+            'products': ['ProductId'],
+            'customers': ['CustomerId'],
+            'invoices': ['InvoiceNumber', 'CustomerId customers'],
+            'invoice_details': ['InvDetailNumber', 'InvoiceNumber invoices',
+                                'ProductId products'],
+        })
+        self.assertEqual(
+            connection.execute('PRAGMA foreign_key_check').fetchall(), [])
+
+    def declared_keys(self, connection):
+        """ Primary keys, and foreign keys with their tables, by table. """
+        keys = dict()
+        for table_name in ('products', 'customers', 'invoices',
+                           'invoice_details'):
+            keys[table_name] = [
+                row[1] for row in connection.execute(
+                    'PRAGMA table_info({table})'.format(table=table_name))
+                if row[5]]
+            keys[table_name] += sorted(
+                '{field} {table}'.format(field=row[3], table=row[2])
+                for row in connection.execute(
+                    'PRAGMA foreign_key_list({table})'.format(
+                        table=table_name)))
+        return keys
+
+    def test_duplicate_and_missing_keys(self):
+        # Anomalies can duplicate keys, or leave them out.
+        numbers = self.invoices['InvoiceNumber'].copy()
+        numbers[1] = numbers[0]
+        self.invoices['InvoiceNumber'] = np.ma.masked_array(
+            numbers, mask=[False] * (len(numbers) - 1) + [True])
+        self.invoices['Total'] = np.ma.masked_array(
+            self.invoices['Total'], mask=[True] + [False] * (len(numbers) - 1))
+        anomaly_plan = AnomalyPlan(5, (
+            Anomaly(DUPLICATE_VALUES, 'invoices', 'InvoiceNumber'),
+            Anomaly(MISSING, 'invoices', 'InvoiceNumber'),
+            Anomaly(MISSING, 'invoices', 'Total'),
+        ), np.datetime64('2017-01-01'), np.datetime64('2017-01-31'))
+        output = io.BytesIO()
+        archive = ChunkedZipWriter(output)
+        self.export(archive, anomaly_plan)
+        archive.close()
+        connection = self.open_database(zipfile.ZipFile(output))
+        rows = connection.execute(
+            'SELECT InvoiceNumber, Total FROM invoices '
+            'ORDER BY rowid').fetchall()
+        self.assertEqual(len(rows), len(numbers))
+        self.assertEqual(rows[0][0], rows[1][0])
+        self.assertIsNone(rows[0][1])
+        self.assertIsNone(rows[-1][0])
+        # The invoice number key isn't declared, nor references to it.
+        keys = self.declared_keys(connection)
+        self.assertEqual(keys['invoices'], ['CustomerId customers'])
+        self.assertEqual(keys['invoice_details'],
+                         ['InvDetailNumber', 'ProductId products'])
+
+
+class JoinTests(SimpleTestCase):
+
+    def test_key_positions(self):
+        positions = key_positions(np.array([12, 10, 12, 13]),
+                                  np.array([13, 10, 12]))
+        self.assertEqual(positions.tolist(), [2, 1, 2, 0])
+        self.assertEqual(len(key_positions(np.array([], dtype=int),
+                                           np.array([1, 2]))), 0)
+
+    def test_missing_key(self):
+        for keys in ([11], [9], [14]):
+            with self.assertRaises(ValueError):
+                key_positions(np.array(keys), np.array([13, 10, 12]))
+
+    def test_invoice_lines(self):
+        vocabularies = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Fiona', 'Jo'],
+            'last_names': ['Huff', 'Myers'],
+            'street_names': ['Holly Drive'],
+            'street_types': ['Lane'],
+            'town_names': ['Clover'],
+            'zip_codes': ['52402', '52403'],
+            'tlds': ['com'],
+        })
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 1, 31), '1111100')
+        products = {
+            'ProductId': np.array([1, 2, 3]),
+            'ProductName': np.array(['Boots', 'Hat', 'Scarf']),
+            'Description': np.array(['Long boots', 'Red hat', 'Scarf']),
+            'ProdPrice': np.array([6.00, 10.50, 99.99]),
+        }
+        plan = list(plan_chunks(7, 25, (1, 4), 10))[1]
+        customers = make_customer_chunk(7, plan, vocabularies)
+        invoice_chunk = make_invoice_chunk(7, plan, (1, 4), 0.06, days,
+                                           None, None, products)
+        joined = join_invoice_lines(products, customers, invoice_chunk)
+        self.assertEqual(tuple(joined), JOINED_FIELDS)
+        # Words are still indices.
+        self.assertIsInstance(joined['CName'], WordColumn)
+        # Same rows as joining them one at a time.
+        invoices = invoice_chunk.invoice_columns
+        details = invoice_chunk.detail_columns
+        invoice_rows = {row[0]: row for row
+                        in column_rows(invoices, INVOICE_FIELDS)}
+        customer_rows = {row[0]: row for row
+                         in column_rows(customers, CUSTOMER_FIELDS)}
+        product_rows = {row[0]: row for row
+                        in column_rows(products, PRODUCT_FIELDS)}
+        expected = list()
+        for detail in column_rows(details, INVOICE_DETAIL_FIELDS):
+            values = dict(zip(INVOICE_DETAIL_FIELDS, detail))
+            invoice = invoice_rows[values['InvoiceNumber']]
+            values.update(zip(INVOICE_FIELDS, invoice))
+            values.update(zip(CUSTOMER_FIELDS,
+                              customer_rows[values['CustomerId']]))
+            values.update(zip(PRODUCT_FIELDS,
+                              product_rows[values['ProductId']]))
+            expected.append(tuple(values[field_name]
+                                  for field_name in JOINED_FIELDS))
+        self.assertEqual(list(column_rows(joined, JOINED_FIELDS)), expected)
+
+
+class StreamsTests(SimpleTestCase):
+
+    def test_chunk_reproducible(self):
+        # Chunk 3 is the same whatever was drawn before it.
+        make_rng(1234, CUSTOMER_STREAM, 2).integers(0, 100, 1000)
+        first = make_rng(1234, CUSTOMER_STREAM, 3).integers(0, 10 ** 9, 50)
+        second = make_rng(1234, CUSTOMER_STREAM, 3).integers(0, 10 ** 9, 50)
+        self.assertTrue((first == second).all())
+
+    def test_streams_independent(self):
+        draws = [
+            make_rng(1234, CUSTOMER_STREAM, 0).integers(0, 10 ** 9, 50),
+            make_rng(1234, CUSTOMER_STREAM, 1).integers(0, 10 ** 9, 50),
+            make_rng(1234, INVOICE_STREAM, 0).integers(0, 10 ** 9, 50),
+            make_rng(1235, CUSTOMER_STREAM, 0).integers(0, 10 ** 9, 50),
+        ]
+        for i in range(len(draws)):
+            for j in range(i + 1, len(draws)):
+                self.assertFalse((draws[i] == draws[j]).all())
+
+
+class ConcatenateOffsetsTests(SimpleTestCase):
+
+    def test_offsets_joined(self):
+        offsets = concatenate_offsets([np.array([0, 2, 5]),
+                                       np.array([0, 1]),
+                                       np.array([0, 3, 4])])
+        self.assertEqual(list(offsets), [0, 2, 5, 6, 9, 10])
+
+
+def add_numbers(*numbers):
+    return sum(numbers)
+
+
+class StageSchedulerTests(SimpleTestCase):
+
+    def make_scheduler(self, max_workers):
+        self.exported = list()
+        scheduler = StageScheduler(max_workers=max_workers)
+        scheduler.add_stage('a', add_numbers, args=(1, 2))
+        scheduler.add_stage('b', add_numbers, args=(10,))
+        scheduler.add_stage('c', add_numbers, inputs=('a', 'b'))
+        scheduler.add_stage('export', self.exported.append, inputs=('c',),
+                            local=True)
+        return scheduler
+
+    def test_serial(self):
+        scheduler = self.make_scheduler(1)
+        results = scheduler.run()
+        self.assertEqual(self.exported, [13])
+        # Only results no stage needs are kept.
+        self.assertEqual(list(results.keys()), ['export'])
+
+    def test_parallel(self):
+        scheduler = self.make_scheduler(2)
+        scheduler.run()
+        self.assertEqual(self.exported, [13])
+        report = scheduler.report()
+        self.assertEqual([stage['stage'] for stage in report['stages']],
+                         ['a', 'b', 'c', 'export'])
+
+    def test_critical_path(self):
+        scheduler = self.make_scheduler(1)
+        scheduler.run_start = 100
+        scheduler.timings = {'a': (100, 103), 'b': (100, 101),
+                             'c': (103, 105), 'export': (105, 106)}
+        self.assertEqual(scheduler.critical_path(),
+                         (['a', 'c', 'export'], 6))
+
+    def test_unknown_input(self):
+        scheduler = StageScheduler(max_workers=1)
+        with self.assertRaises(ValueError):
+            scheduler.add_stage('c', add_numbers, inputs=('a',))
+
+
+class ChunksTests(SimpleTestCase):
+
+    def test_chunks_line_up(self):
+        plans = list(plan_chunks(99, 25, (1, 4), 10))
+        self.assertEqual([plan.number_customers for plan in plans],
+                         [10, 10, 5])
+        products = {'ProdPrice': np.array([6.0, 12.5])}
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 1, 31), '1111100')
+        next_invoice = next_detail = 1
+        for plan in plans:
+            invoice_chunk = make_invoice_chunk(
+                99, plan, (1, 4), 0.06, days, None, None, products)
+            invoices = invoice_chunk.invoice_columns
+            details = invoice_chunk.detail_columns
+            self.assertEqual(invoices['InvoiceNumber'][0], next_invoice)
+            self.assertEqual(details['InvDetailNumber'][0], next_detail)
+            next_invoice = invoices['InvoiceNumber'][-1] + 1
+            next_detail = details['InvDetailNumber'][-1] + 1
+
+    def test_chunk_reproducible(self):
+        vocabularies = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Fiona', 'Jo'],
+            'last_names': ['Huff', 'Myers'],
+            'street_names': ['Holly Drive'],
+            'street_types': ['Lane'],
+            'town_names': ['Clover'],
+            'zip_codes': ['52402'],
+            'tlds': ['com'],
+        })
+        plan = list(plan_chunks(99, 25, (1, 4), 10))[2]
+        first = make_customer_chunk(99, plan, vocabularies)
+        second = make_customer_chunk(99, plan, vocabularies)
+        self.assertTrue((resolve_column(first['CName'])
+                         == resolve_column(second['CName'])).all())
+        self.assertEqual(first['CustomerId'][0], 21)
+
+
+class VocabularyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = VocabularyStore.from_lists({
+            'first_names': ['Avery', 'Zo\u00eb', ''],
+            'tlds': ['com', 'org'],
+        })
+
+    def test_words(self):
+        first_names = self.store['first_names']
+        self.assertEqual(len(first_names), 3)
+        self.assertEqual(first_names.word(1), 'Zo\u00eb')
+        self.assertEqual(first_names.word(2), '')
+        self.assertEqual(list(first_names.strings('lower')),
+                         ['avery', 'zo\u00eb', ''])
+
+    def test_binary_round_trip(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            path = os.path.join(dir_path, 'vocabulary.bin')
+            self.store.write_binary(path)
+            mapped = VocabularyStore.from_binary(path)
+            self.assertEqual(sorted(mapped.names()), ['first_names', 'tlds'])
+            for name in mapped.names():
+                self.assertEqual(list(mapped[name].strings()),
+                                 list(self.store[name].strings()))
+
+    def test_shared_pickled_by_name(self):
+        shared = get_vocabulary_store()
+        first_names = shared['first_names']
+        pickled = pickle.dumps(first_names)
+        self.assertLess(len(pickled), 200)
+        self.assertIs(pickle.loads(pickled), first_names)
+        self.assertIs(pickle.loads(pickle.dumps(shared)), shared)
+
+    def test_word_column(self):
+        column = WordColumn([
+            WordIndices(self.store['first_names'], np.array([1, 0]), 'lower'),
+            '@', np.array([7, 8]), '.',
+            WordIndices(self.store['tlds'], np.array([0, 1]), None),
+        ])
+        self.assertEqual(len(column), 2)
+        self.assertEqual(list(column.resolve()),
+                         ['zo\u00eb@7.com', 'avery@8.org'])
+
+
+class VariantsTests(SimpleTestCase):
+
+    def test_number_of_variants(self):
+        self.assertEqual(parse_variant_labels(' 3\n'),
+                         ['student1', 'student2', 'student3'])
+
+    def test_roster(self):
+        self.assertEqual(parse_variant_labels('Avery Huff\n\n  Zo\u00eb \n'),
+                         ['Avery Huff', 'Zo\u00eb'])
+
+    def test_bad_variants(self):
+        for variants_value in ('', '0', '100000'):
+            with self.assertRaises(ValueError):
+                parse_variant_labels(variants_value)
+
+    def test_plan(self):
+        labels = ['Avery Huff', 'Zo\u00eb', '\u674e']
+        variants = plan_variants(7, 1234, labels)
+        self.assertEqual([variant.file_name for variant in variants],
+                         ['project7-avery-huff.zip', 'project7-zoe.zip',
+                          'project7-student3.zip'])
+        # Seeds differ, and come out the same every time.
+        seeds = [variant.seed for variant in variants]
+        self.assertEqual(len(set(seeds + [1234])), 4)
+        self.assertEqual(seeds, [variant.seed for variant
+                                 in plan_variants(7, 1234, labels)])
+        self.assertNotEqual(seeds, [variant.seed for variant
+                                    in plan_variants(7, 1235, labels)])
+        self.assertTrue(all(0 <= seed < 2 ** 63 for seed in seeds))
+
+    def test_same_file_name(self):
+        with self.assertRaises(ValueError):
+            plan_variants(7, 1234, ['Avery Huff', 'avery huff'])
+
+
+class DistributionsTests(SimpleTestCase):
+
+    def test_bounds_and_mean(self):
+        for kind in (FEDS_NORMAL_DISTRIBUTION, FEDS_SKEWED_DISTRIBUTION,
+                     FEDS_MIXED_DISTRIBUTION):
+            distribution = make_total_distribution(kind, 800, 10, 5000)
+            values = sample_distribution(np.random.default_rng(1),
+                                         distribution, 100000)
+            self.assertEqual(len(values), 100000)
+            self.assertTrue((values >= 10).all())
+            self.assertTrue((values <= 5000).all())
+            self.assertAlmostEqual(values.mean(), 800, delta=40)
+
+    def test_skewed(self):
+        values = sample_distribution(
+            np.random.default_rng(1),
+            make_total_distribution(FEDS_SKEWED_DISTRIBUTION, 800), 100000)
+        # A long right tail: the median is below the mean.
+        self.assertLess(np.median(values), values.mean())
+
+    def test_bad_kind(self):
+        with self.assertRaises(ValueError):
+            make_total_distribution('uniform', 800)
+
+    def test_lines_fitted_to_targets(self):
+        rng = np.random.default_rng(2)
+        prices = np.rint((6 + rng.random(200) * 172) * 100).astype(np.int64)
+        lines_per_invoice = rng.integers(1, 6, 10000)
+        targets = np.rint(sample_distribution(
+            rng, make_total_distribution(FEDS_NORMAL_DISTRIBUTION, 800),
+            10000) * 100)
+        product_index, quantities = fit_lines(rng, targets,
+                                              lines_per_invoice, prices)
+        self.assertEqual(len(product_index), lines_per_invoice.sum())
+        self.assertTrue(((quantities >= 1) & (quantities <= 10)).all())
+        invoice_index = np.repeat(np.arange(10000), lines_per_invoice)
+        totals = np.bincount(invoice_index,
+                             quantities * prices[product_index], 10000)
+        errors = np.abs(totals - targets) / targets
+        self.assertLess(np.median(errors), 0.05)
+
+    def test_invoice_totals(self):
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 12, 31), '1111100')
+        prices = np.round(6 + np.random.default_rng(3).random(100) * 172, 2)
+        invoices, details, offsets = make_invoice_columns(
+            np.random.default_rng(4), np.arange(1, 1001),
+            np.full(1000, 5), prices, 0.06, days,
+            total_distribution=make_total_distribution(
+                FEDS_SKEWED_DISTRIBUTION, 800))
+        subtotals = np.add.reduceat(details['SubtotalProduct'], offsets[:-1])
+        self.assertTrue(np.allclose(invoices['TotalBTax'], subtotals))
+        self.assertAlmostEqual(invoices['TotalBTax'].mean(), 800, delta=80)
+
+
+class BenfordTests(SimpleTestCase):
+
+    def test_leading_digits(self):
+        first, first_two, powers = leading_digits(
+            np.array([5, 45, 100, 1999, 98765, 0, -250]))
+        self.assertEqual(list(first), [5, 4, 1, 1, 9, 0, 2])
+        self.assertEqual(list(first_two), [0, 45, 10, 19, 98, 0, 25])
+        self.assertEqual(list(powers), [1, 10, 100, 1000, 10000, 1, 100])
+
+    def test_tamper(self):
+        rng = np.random.default_rng(1)
+        # Benford distributed amounts, from $1 to $100,000.
+        clean = np.rint(10 ** rng.uniform(2, 7, 100000)).astype(np.int64)
+        cents = clean.copy()
+        tampered, counts = tamper_amounts(
+            rng, cents, 0.2, (0, 0, 0, 0, 1, 1, 0, 0, 0))
+        self.assertAlmostEqual(tampered.mean(), 0.2, delta=0.01)
+        self.assertTrue((cents[~tampered] == clean[~tampered]).all())
+        # Only the first digit changed.
+        first, first_two, powers = leading_digits(cents)
+        self.assertTrue(np.isin(first[tampered], [5, 6]).all())
+        self.assertTrue((cents % powers == clean % powers).all())
+        # Counts are the same as counting again.
+        self.assertEqual(list(counts.tampered_first),
+                         list(np.bincount(first, minlength=10)))
+        self.assertEqual(list(counts.tampered_first_two),
+                         list(np.bincount(first_two, minlength=100)))
+        statistics = benford_statistics(counts)
+        self.assertEqual(
+            [(row['data'], row['digits']) for row in statistics],
+            [('clean', 'first'), ('clean', 'first two'),
+             ('tampered', 'first'), ('tampered', 'first two')])
+        self.assertEqual(statistics[0]['conformity'], 'Close conformity')
+        self.assertLess(statistics[0]['chi_square'],
+                        statistics[0]['chi_square_critical'])
+        self.assertEqual(statistics[2]['conformity'], 'Nonconformity')
+        self.assertGreater(statistics[2]['chi_square'],
+                           statistics[2]['chi_square_critical'])
+
+    def test_counts_added(self):
+        rng = np.random.default_rng(2)
+        tampered, counts = tamper_amounts(
+            rng, rng.integers(1, 10 ** 6, 1000), 0.5, (1,) * 9)
+        self.assertIs(add_benford_counts(None, counts), counts)
+        self.assertIs(add_benford_counts(counts, None), counts)
+        both = add_benford_counts(counts, counts)
+        self.assertEqual(both.clean_first.sum(), 2000)
+        summary = benford_summary_csv('invoices', 'TotalBTax', both)
+        self.assertEqual(len(summary.splitlines()), 5)
+        self.assertTrue(summary.splitlines()[1].startswith(
+            'invoices,TotalBTax,clean,first,2000,'))
+        digits = benford_digits_csv(both).splitlines()
+        self.assertEqual(len(digits), 100)
+        self.assertEqual(digits[1].split(',')[:2], ['1', '0.301030'])
+
+    def test_invoices_add_up(self):
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 1, 31), '1111100')
+        invoices, details, offsets = make_invoice_columns(
+            np.random.default_rng(3), np.arange(1, 201), np.full(200, 3),
+            np.array([6.00, 10.50, 99.99]), 0.06, days)
+        clean_totals = invoices['TotalBTax'].copy()
+        tampered, counts = tamper_invoice_amounts(
+            np.random.default_rng(4), invoices,
+            BenfordTampering('TotalBTax', 0.5, (1,) * 9), 0.06)
+        self.assertTrue(tampered.any())
+        self.assertTrue((invoices['TotalBTax'][~tampered]
+                         == clean_totals[~tampered]).all())
+        self.assertTrue(np.allclose(
+            invoices['SalesTax'], np.round(invoices['TotalBTax'] * 0.06, 2)))
+        self.assertTrue(np.allclose(
+            invoices['Total'], invoices['TotalBTax'] + invoices['SalesTax']))
+
+
+class AnomaliesTests(SimpleTestCase):
+
+    def setUp(self):
+        days = days_in_range(datetime.date(2017, 1, 1),
+                             datetime.date(2017, 12, 31), '1111100')
+        self.invoices, self.details, offsets = make_invoice_columns(
+            np.random.default_rng(6), np.arange(1, 2001), np.full(2000, 5),
+            np.array([6.00, 10.50, 99.99]), 0.06, days)
+        self.plan = AnomalyPlan(8, (), days[0], days[-1])
+
+    def run_kernel(self, kind, field_name):
+        columns = dict(self.invoices)
+        columns[field_name] = columns[field_name].copy()
+        is_touched = ANOMALY_KERNELS[kind](
+            np.random.default_rng(9), columns, field_name, self.plan)
+        self.assertTrue(is_touched.any())
+        return columns[field_name], is_touched
+
+    def test_arithmetic_errors(self):
+        clean = self.invoices['Total']
+        totals, is_touched = self.run_kernel(ARITHMETIC_ERRORS, 'Total')
+        self.assertTrue((totals[~is_touched] == clean[~is_touched]).all())
+        self.assertTrue((totals[is_touched] != clean[is_touched]).all())
+        self.assertTrue(np.allclose(totals, np.round(totals, 2)))
+
+    def test_negative_numbers(self):
+        clean = self.invoices['SalesTax']
+        taxes, is_touched = self.run_kernel(NEGATIVE_NUMBERS, 'SalesTax')
+        self.assertTrue((taxes[is_touched] == -clean[is_touched]).all())
+        self.assertTrue((taxes[~is_touched] == clean[~is_touched]).all())
+
+    def test_out_of_range(self):
+        dates, is_touched = self.run_kernel(OUT_OF_RANGE, 'InvoiceDate')
+        is_in_range = (dates >= self.plan.first_day) \
+            & (dates <= self.plan.last_day)
+        self.assertTrue((is_in_range == ~is_touched).all())
+        with self.assertRaises(ValueError):
+            self.run_kernel(OUT_OF_RANGE, 'Total')
+
+    def test_duplicate_values(self):
+        numbers, is_touched = self.run_kernel(DUPLICATE_VALUES,
+                                              'InvoiceNumber')
+        values, counts = np.unique(numbers, return_counts=True)
+        self.assertTrue(np.isin(numbers[is_touched],
+                                numbers[~is_touched]).all())
+        self.assertGreater(counts.max(), 1)
+
+    def test_missing(self):
+        numbers, is_touched = self.run_kernel(MISSING, 'InvoiceNumber')
+        self.assertTrue((np.ma.getmaskarray(numbers) == is_touched).all())
+        rows = list(column_rows({'InvoiceNumber': numbers},
+                                ['InvoiceNumber']))
+        self.assertIsNone(rows[int(np.flatnonzero(is_touched)[0])][0])
+
+    def test_order(self):
+        anomalies = order_anomalies([
+            Anomaly(MISSING, 'invoices', 'Total'),
+            Anomaly(NEGATIVE_NUMBERS, 'invoices', 'Total'),
+            Anomaly(ARITHMETIC_ERRORS, 'invoices', 'Total')])
+        self.assertEqual([anomaly.kind for anomaly in anomalies],
+                         [ARITHMETIC_ERRORS, NEGATIVE_NUMBERS, MISSING])
+        with self.assertRaises(ValueError):
+            order_anomalies([Anomaly('anomaly_typos', 'invoices', 'Total')])
+
+    def test_inject(self):
+        plan = self.plan._replace(anomalies=order_anomalies([
+            Anomaly(NEGATIVE_NUMBERS, 'invoices', 'Total'),
+            Anomaly(MISSING, 'invoices', 'Total'),
+            Anomaly(ARITHMETIC_ERRORS, 'invoice_details',
+                    'SubtotalProduct')]))
+        clean = self.invoices['Total'].copy()
+        columns, anomaly_rows = inject_anomalies(plan, 2, 100, 'invoices',
+                                                 self.invoices)
+        # The clean columns aren't changed.
+        self.assertTrue((self.invoices['Total'] == clean).all())
+        self.assertEqual([rows.anomaly.kind for rows in anomaly_rows],
+                         [NEGATIVE_NUMBERS, MISSING])
+        negative_rows, missing_rows = [rows.rows - 100
+                                       for rows in anomaly_rows]
+        self.assertTrue((columns['Total'].data[negative_rows] < 0).all())
+        self.assertEqual(list(np.flatnonzero(columns['Total'].mask)),
+                         list(missing_rows))
+        # The same every time.
+        again, again_rows = inject_anomalies(plan, 2, 100, 'invoices',
+                                             self.invoices)
+        self.assertEqual([list(rows.rows) for rows in anomaly_rows],
+                         [list(rows.rows) for rows in again_rows])
+        # Nothing for tables with no anomalies.
+        columns, anomaly_rows = inject_anomalies(plan, 2, 100, 'customers',
+                                                 self.invoices)
+        self.assertIs(columns, self.invoices)
+        self.assertEqual(anomaly_rows, [])
+        # Joined tables only get the anomalies on the detail lines.
+        self.assertEqual(table_anomalies(plan, JOINED_TABLE),
+                         [plan.anomalies[0]])
+
+    def test_money_nulls(self):
+        totals = np.ma.masked_array(np.array([1.5, -2.25, 3.0]),
+                                    mask=[False, True, False])
+        self.assertEqual(money_array(totals).to_pylist(),
+                         [Decimal('1.50'), None, Decimal('3.00')])
+
+
+class RowBitmapTests(SimpleTestCase):
+
+    def test_rows_added(self):
+        bitmap = RowBitmap()
+        bitmap.add(np.array([70000, 3, 65536, 3]))
+        bitmap.add(np.array([], dtype=np.int64))
+        bitmap.add(np.array([1]))
+        self.assertEqual(len(bitmap), 4)
+        self.assertEqual(list(bitmap.rows()), [1, 3, 65536, 70000])
+        with self.assertRaises(ValueError):
+            bitmap.add(np.array([-1]))
+
+    def test_serialized(self):
+        bitmap = RowBitmap()
+        bitmap.add(np.array([1, 5, 65537]))
+        # Portable Roaring format: cookie, containers, keys and sizes less
+        # one, offsets, then the low 16 bits of the rows.
+        self.assertEqual(bitmap.serialize(), bytes([
+            0x3A, 0x30, 0, 0, 2, 0, 0, 0,
+            0, 0, 1, 0, 1, 0, 0, 0,
+            24, 0, 0, 0, 28, 0, 0, 0,
+            1, 0, 5, 0, 1, 0]))
+
+    def test_bitset_containers(self):
+        rows = np.random.default_rng(1).choice(300000, 50000, replace=False)
+        bitmap = RowBitmap()
+        for part in np.array_split(rows, 5):
+            bitmap.add(part)
+        self.assertTrue(all(container.dtype == bool
+                            for container in bitmap.containers.values()))
+        data = bitmap.serialize()
+        self.assertEqual(len(data), 8 + 8 * 5 + 8192 * 5)
+        self.assertEqual(list(RowBitmap.deserialize(data).rows()),
+                         sorted(rows.tolist()))
+
+    def test_answer_key(self):
+        anomaly_bitmaps = OrderedDict()
+        missing = Anomaly(MISSING, 'invoices', 'InvoiceNumber')
+        negative = Anomaly(NEGATIVE_NUMBERS, 'invoices', 'Total')
+        add_anomaly_rows(anomaly_bitmaps, [
+            AnomalyRows(negative, 'invoices', np.array([4, 0])),
+            AnomalyRows(missing, 'invoices', np.array([4]))])
+        add_anomaly_rows(anomaly_bitmaps, [
+            AnomalyRows(negative, 'invoices', np.array([9]))])
+        self.assertEqual(anomaly_answer_key_csv(anomaly_bitmaps).splitlines(),
+                         ['Table,Row,Field,Anomaly',
+                          'invoices,1,Total,Negative numbers',
+                          'invoices,5,Total,Negative numbers',
+                          'invoices,5,InvoiceNumber,Missing',
+                          'invoices,10,Total,Negative numbers'])
+        self.assertEqual(bitmap_member_name('invoices', missing),
+                         'answer_key/rows/invoices.InvoiceNumber.missing.'
+                         'roaring')
+
+
+class FetchBatchesTests(SimpleTestCase):
+
+    def test_rows_fetched_in_batches(self):
+        cursor = mock.Mock()
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        self.assertEqual(list(fetch_batches(cursor, 2)), [(1,), (2,), (3,)])
+        cursor.fetchmany.assert_called_with(2)
+        self.assertEqual(cursor.fetchmany.call_count, 3)
+
+
+class GenerationJobTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('jobs', 'jobs@example.com', 'pw')
+        business_area = BusinessAreaDb.objects.create(
+            title='Revenue', machine_name='ba_revenue')
+        self.project = ProjectDb.objects.create(
+            user=user, business_area=business_area, title='Jobs')
+        self.jobs = [GenerationJobDb.objects.create(project=self.project,
+                                                    user=user)
+                     for job in range(2)]
+
+    def test_jobs_claimed_oldest_first(self):
+        for job in self.jobs:
+            claimed = claim_next_job()
+            self.assertEqual(claimed.pk, job.pk)
+            self.assertEqual(claimed.status, GenerationJobDb.STATUS_RUNNING)
+            self.assertIsNotNone(claimed.when_started)
+        self.assertIsNone(claim_next_job())
+
+    def test_running_jobs_requeued(self):
+        claim_next_job()
+        self.assertEqual(requeue_running_jobs(), 1)
+        self.assertEqual(claim_next_job().pk, self.jobs[0].pk)
+
+    def test_progress(self):
+        job = self.jobs[0]
+        self.assertEqual(job.progress(), 0)
+        job.chunks_done, job.chunks_total = 1, 4
+        self.assertEqual(job.progress(), 0.25)
+        job.status = GenerationJobDb.STATUS_DONE
+        self.assertEqual(job.progress(), 1)
+
+
+class ChunkCollector:
+    """ Exporter that keeps the chunks written to it, by table. """
+
+    def __init__(self):
+        self.chunks = OrderedDict()
+
+    def write_chunk(self, table_name, field_names, columns):
+        self.chunks.setdefault(table_name, list()).append(columns)
+
+
+class GeneratorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.generator = self.make_generator({
+            'fld_spec_invc_tot_bt_anomaly_negative_numbers': 'true'})
+
+    def make_generator(self, extra_values):
+        """ Make a generator for a project with some settings. """
+        values = {
+            'tbl_customer_setting_num_cust_options': 'custom',
+            'tbl_customer_setting_cust_num_custs': '300',
+            'tbl_products_setting_num_product_options': 'custom',
+            'tbl_product_setting_cust_num_products': '5',
+            'tbl_customer_setting_num_invc_per_cust_options': 'standard',
+            'ba_revenue_setting_sales_tax': 0.06,
+            'ba_revenue_setting_project_date_choices': 'lastyear',
+            'ba_revenue_setting_working_days': 'weekdays',
+        }
+        values.update(extra_values)
+        project = types.SimpleNamespace(registry=types.SimpleNamespace(
+            settings={machine_name: types.SimpleNamespace(
+                params={'value': value})
+                for machine_name, value in values.items()}))
+        project_db = types.SimpleNamespace(seed=12)
+        with mock.patch('generate.feds_generator.read_project',
+                        return_value=project), \
+                mock.patch('generate.feds_generator.ProjectDb') as model:
+            model.objects.get.return_value = project_db
+            generator = FedsGenerator(1)
+        generator.generation_workers = 1
+        return generator
+
+    def test_anomaly_plan(self):
+        plan = self.generator.get_anomaly_plan()
+        self.assertEqual(plan.anomalies, (
+            Anomaly(NEGATIVE_NUMBERS, 'invoices', 'TotalBTax'),))
+        last_year = datetime.date.today().year - 1
+        self.assertEqual(plan.first_day,
+                         np.datetime64('{year}-01-01'.format(year=last_year)))
+        self.assertEqual(plan.last_day,
+                         np.datetime64('{year}-12-31'.format(year=last_year)))
+
+    def test_generate_tables(self):
+        exporter = ChunkCollector()
+        self.generator.generate_tables(exporter)
+        totals = np.concatenate([columns['TotalBTax'] for columns
+                                 in exporter.chunks['invoices']])
+        bitmap = self.generator.anomaly_bitmaps[(
+            'invoices', Anomaly(NEGATIVE_NUMBERS, 'invoices', 'TotalBTax'))]
+        self.assertGreater(len(bitmap), 0)
+        self.assertEqual(list(bitmap.rows()), list(np.flatnonzero(totals < 0)))
+        answer_key = dict(self.generator.make_answer_key())
+        self.assertIn('answer_key/anomalies.csv', answer_key)
+
+    def test_benford_rows_in_answer_key(self):
+        benford_values = {
+            'fld_spec_invc_tot_bt_anomaly_violates_benfords_law': 'true'}
+        totals = list()
+        for values in ({}, benford_values):
+            generator = self.make_generator(values)
+            exporter = ChunkCollector()
+            # Chunks, so rows are numbered across them.
+            with mock.patch('generate.feds_generator.'
+                            'FEDS_GENERATION_CHUNK_SIZE', 100):
+                generator.generate_tables(exporter)
+            totals.append(np.concatenate([
+                columns['TotalBTax']
+                for columns in exporter.chunks['invoices']]))
+        clean, tampered = totals
+        anomaly = Anomaly(BENFORDS_LAW, 'invoices', 'TotalBTax')
+        rows = generator.anomaly_bitmaps[('invoices', anomaly)].rows()
+        # Some tampered amounts keep their first digit.
+        changed = np.flatnonzero(clean != tampered)
+        self.assertGreater(len(changed), 0)
+        self.assertTrue(np.isin(changed, rows).all())
+        self.assertGreater(rows.max(), len(clean) // 3)
+        answer_key = dict(generator.make_answer_key())
+        lines = list(csv.reader(io.StringIO(
+            answer_key['answer_key/anomalies.csv'])))[1:]
+        self.assertEqual(
+            [int(row) - 1 for table_name, row, field_name, label in lines
+             if label == 'Violates Benford\'s law'],
+            rows.tolist())
+
+    def test_joined_invoices_agree(self):
+        joined_values = {'ba_revenue_setting_export_objects': 'joined'}
+        exporter = ChunkCollector()
+        self.make_generator(joined_values).generate_tables(exporter)
+        clean = concatenate_columns(exporter.chunks[JOINED_TABLE])
+        generator = self.make_generator(dict(joined_values, **{
+            'fld_spec_customer_pk_anomaly_duplicate_values': 'true',
+            'fld_spec_invc_num_anomaly_missing': 'true',
+            'fld_spec_invc_tot_bt_anomaly_negative_numbers': 'true',
+            'fld_spec_invc_deets_subtotal_anomaly_negative_numbers': 'true',
+        }))
+        exporter = ChunkCollector()
+        generator.generate_tables(exporter)
+        lines = concatenate_columns(exporter.chunks[JOINED_TABLE])
+        # Each invoice's lines have the same invoice and customer values.
+        starts = np.flatnonzero(np.diff(clean['InvoiceNumber'], prepend=0))
+        invoice_index = np.cumsum(np.isin(
+            np.arange(len(clean['InvoiceNumber'])), starts)) - 1
+        for field_name in ('InvoiceNumber', 'CustomerId', 'TotalBTax'):
+            values = np.ma.getdata(lines[field_name])
+            is_missing = np.ma.getmaskarray(lines[field_name])
+            self.assertTrue((values == values[starts][invoice_index]).all())
+            self.assertTrue(
+                (is_missing == is_missing[starts][invoice_index]).all())
+        # The answer key has the invoices, not their lines.
+        negative_invoices = generator.anomaly_bitmaps[(
+            'invoices', Anomaly(NEGATIVE_NUMBERS, 'invoices', 'TotalBTax'))]
+        self.assertGreater(len(negative_invoices), 0)
+        self.assertEqual(len(negative_invoices),
+                         int((lines['TotalBTax'][starts] < 0).sum()))
+        missing_numbers = generator.anomaly_bitmaps[(
+            'invoices', Anomaly(MISSING, 'invoices', 'InvoiceNumber'))]
+        self.assertGreater(len(missing_numbers), 0)
+        self.assertEqual(
+            len(missing_numbers),
+            int(np.ma.getmaskarray(lines['InvoiceNumber'])[starts].sum()))
+        # Detail line anomalies are on the lines.
+        negative_lines = generator.anomaly_bitmaps[(
+            JOINED_TABLE, Anomaly(NEGATIVE_NUMBERS, 'invoice_details',
+                                  'SubtotalProduct'))]
+        self.assertEqual(list(negative_lines.rows()),
+                         list(np.flatnonzero(lines['SubtotalProduct'] < 0)))
+        # Streamed tables come out the same.
+        streamed = concatenate_columns(
+            columns for table_name, field_names, columns
+            in generator.iterate_table_chunks(joined=True))
+        for field_name in ('InvoiceNumber', 'CustomerId', 'TotalBTax',
+                           'SubtotalProduct'):
+            self.assertTrue((np.ma.getmaskarray(streamed[field_name])
+                             == np.ma.getmaskarray(lines[field_name])).all())
+            self.assertTrue((np.ma.getdata(streamed[field_name])
+                             == np.ma.getdata(lines[field_name])).all())
@@ -1,8 +1,12 @@
 from django.conf.urls import url
-from .views import generate, delete_archive
+from .views import generate, stream_generate, submit_job, job_status, \
+    delete_archive
 
 app_name = 'generate'
 urlpatterns = [
    url(r'^$', generate, name='generate'),
+   url(r'^stream/$', stream_generate, name='stream_generate'),
+   url(r'^ajax/submitjob/$', submit_job, name='submit_job'),
+   url(r'^ajax/jobstatus/$', job_status, name='job_status'),
    url(r'^ajax/deletearchive/$', delete_archive, name='delete_archive'),
 ]
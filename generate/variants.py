@@ -0,0 +1,99 @@
+"""
+Per-student variants of a project's data set.
+
+Each variant is the project with its own seed, worked out from the
+project's seed and the variant's label, so a student's data set can be
+made again, and comes out the same. Labels are student names from a
+roster, or student1, student2, ... when an instructor just asks for a
+number of variants.
+"""
+
+import csv
+import hashlib
+import io
+from collections import namedtuple
+
+from django.utils.text import slugify
+
+from feds.settings import FEDS_MAX_VARIANTS
+
+# A variant: the label it was asked for with, the seed its data is made
+# from, and the name of its archive file.
+Variant = namedtuple('Variant', ['label', 'seed', 'file_name'])
+
+
+def parse_variant_labels(variants_value):
+    """
+    Work out the variants' labels from what the instructor entered.
+    :param variants_value: Number of variants, or a roster: one student
+            per line.
+    :return: List of labels, in order.
+    """
+    variants_value = variants_value.strip()
+    if variants_value.isdigit():
+        number_variants = int(variants_value)
+        labels = ['student{number}'.format(number=number)
+                  for number in range(1, number_variants + 1)]
+    else:
+        labels = [line.strip() for line in variants_value.splitlines()
+                  if line.strip()]
+    if not labels:
+        raise ValueError('No variants asked for.')
+    if len(labels) > FEDS_MAX_VARIANTS:
+        message = 'Too many variants: {number}. The most is {max}.'
+        raise ValueError(message.format(number=len(labels),
+                                        max=FEDS_MAX_VARIANTS))
+    return labels
+
+
+def plan_variants(project_id, seed, labels):
+    """
+    Work out each variant's seed and file name.
+    :param project_id: Id of the project.
+    :param seed: The project's seed.
+    :param labels: The variants' labels.
+    :return: List of Variant, in the labels' order.
+    """
+    variants = list()
+    file_names = set()
+    for number, label in enumerate(labels, 1):
+        # Names with no ASCII letters or digits get a number.
+        slug = slugify(label) or 'student{number}'.format(number=number)
+        file_name = 'project{project_id}-{slug}.zip'.format(
+            project_id=project_id, slug=slug)
+        if file_name in file_names:
+            message = 'Two variants would have the same file name: "{label}".'
+            raise ValueError(message.format(label=label))
+        file_names.add(file_name)
+        variants.append(Variant(label, variant_seed(seed, label), file_name))
+    return variants
+
+
+def variant_seed(seed, label):
+    """
+    Work out a variant's seed from the project's seed and its label.
+    :return: Non-negative int that fits in the project seed's field.
+    """
+    digest = hashlib.sha256(
+        '{seed}\0{label}'.format(seed=seed, label=label).encode('utf-8')
+    ).digest()
+    return int.from_bytes(digest[:8], 'big') >> 1
+
+
+def bundle_file_name(project_id):
+    """ Name of the archive holding all of a project's variants. """
+    return 'project{project_id}-variants.zip'.format(project_id=project_id)
+
+
+def variants_index(variants):
+    """
+    Make a CSV listing the variants, for the bundle.
+    :param variants: List of Variant.
+    :return: CSV text.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Student', 'Archive', 'Seed'])
+    for variant in variants:
+        writer.writerow([variant.label, variant.file_name, variant.seed])
+    return buffer.getvalue()
@@ -1,16 +1,30 @@
 import os
+import copy
 import errno
+import glob
 import zipfile
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from django.contrib.auth.decorators import login_required
+from django.db import connections
 from django.http import HttpResponseForbidden, HttpResponseServerError, \
-    HttpResponse, JsonResponse
+    HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
+from generate.archive import ChunkedZipWriter, StreamingZipWriter, \
+    StreamBuffer, COPY_BUFFER_SIZE
+from generate.archive_cache import get_archive_cache
+from generate.exporters import make_archive_exporter
 from generate.feds_generator import FedsGenerator
+from generate.models import GenerationJobDb
+from generate.variants import parse_variant_labels, plan_variants, \
+    bundle_file_name, variants_index
+from generate.vocabulary import get_vocabulary_store
 from projects.models import ProjectDb
-from feds.settings import DATA_SETS_LOCATION
+from feds.settings import DATA_SETS_LOCATION, FEDS_GENERATION_MODE, \
+    FEDS_GENERATION_MODE_DATABASE, FEDS_GENERATION_WORKERS
 
 def generate(request):
     # Get the project id from the post.
@@ -28,53 +42,358 @@ def generate(request):
     visible_settings = json.loads(visible_settings_stringed)
     try:
         generator = FedsGenerator(project_id)
-        # Create each of the tables with SQL.
-        generator.create_customer_table()
-        generator.create_product_table()
-        generator.create_invoice_table()
-        # Compute how many objects we need.
-        # How many customers? One value.
-        generator.get_num_customers_to_make()
-        # How many products? One value.
-        generator.get_num_products_to_make()
-        # How many invoices for each customer? Dict.
-        generator.get_num_invoices_per_customer()
-        # First pass: correct data with given settings.
-        generator.create_customers()
-        generator.create_products()
-        generator.get_num_invoices_per_customer()
-        # Create a temp dir.
-        module_dir = os.path.dirname(__file__)  # get current directory
-        export_dir_path = os.path.join(module_dir,
-                                       'generated/project' + str(project_id))
-        # Make the dir if it does not exist.
-        if not os.path.exists(export_dir_path):
-            os.makedirs(export_dir_path)
-        # Erase all files in it.
-        erase_files_in_dir(export_dir_path)
-        # Save customer data.
-        generator.save_customer_data(export_dir_path, 'customers.csv')
-        # Save product data.
-        generator.save_product_data(export_dir_path, 'products.csv')
-        # Make the project description document.
-        generator.save_proj_spec_file(visible_settings,
-                                      export_dir_path, 'project.html')
-        # Zip all the things. Zip file is above the project dir, named
-        # projectXXX.zip
+        # Zip file is in the data sets dir, named projectXXX.zip
         zip_file_path = get_path_to_project_archive(project_id)
-        zip_dir(export_dir_path, zip_file_path)
-        # Erase the files that were just zipped.
-        erase_files_in_dir(export_dir_path)
+        make_project_archive(generator, visible_settings, project_id,
+                             zip_file_path)
         # Send the archive's path to the client.
         response = {
             'status': 'ok',
-            'archiveurl': '/uploads/project' + str(project_id) + '.zip'
+            'archiveurl': get_project_archive_url(project_id)
         }
         return JsonResponse(response)
     except Exception as e:
         return JsonResponse({'status': 'Error: ' + e.__str__()})
 
 
+def submit_job(request):
+    """
+    Queue a job to generate a data set. Returns at once, with the job's id
+    to poll job_status with. If the project already has a job waiting or
+    running, returns that one.
+
+    If the post has variants, a number or a roster with one student per
+    line, the job makes a data set for each student instead.
+    """
+    # Get the project id from the post.
+    project_id = request.POST.get('projectid', None)
+    if project_id is None:
+        return JsonResponse({'status': 'Error: project id missing'})
+    # Check that the user has generate access.
+    if not user_can_generate(request, project_id):
+        return JsonResponse({'status': 'Error: access denied'})
+    # Get the visible settings.
+    visible_settings_stringed = request.POST.get('settingsstate', None)
+    if visible_settings_stringed is None:
+        return JsonResponse({'status': 'Error: settingsstate missing'})
+    variants_value = request.POST.get('variants', '').strip()
+    try:
+        job = GenerationJobDb.objects.filter(
+            project_id=project_id,
+            status__in=GenerationJobDb.ACTIVE_STATUSES
+        ).first()
+        if job is None:
+            job = GenerationJobDb(
+                project_id=project_id,
+                user=request.user,
+                visible_settings=visible_settings_stringed
+            )
+            if variants_value:
+                job.variants = json.dumps(
+                    parse_variant_labels(variants_value))
+            # An archive made before with the same settings and seed is
+            # handed out at once, without queueing.
+            generator = FedsGenerator(project_id)
+            if not variants_value and get_archive_cache().get(
+                    generator.archive_key(
+                        json.loads(visible_settings_stringed)),
+                    get_path_to_project_archive(project_id)):
+                job.status = GenerationJobDb.STATUS_DONE
+                job.archive_url = get_project_archive_url(project_id)
+                job.when_started = job.when_finished = timezone.now()
+            job.save()
+        return JsonResponse({'status': 'ok', 'jobid': job.pk})
+    except Exception as e:
+        return JsonResponse({'status': 'Error: ' + e.__str__()})
+
+
+def job_status(request):
+    """ Report a generation job's status, progress, and archive URL. """
+    job_id = request.GET.get('jobid', None)
+    if job_id is None:
+        return JsonResponse({'status': 'Error: job id missing'})
+    job = GenerationJobDb.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'status': 'Error: job not found'})
+    # Check that the user has generate access.
+    if not user_can_generate(request, str(job.project_id)):
+        return JsonResponse({'status': 'Error: access denied'})
+    # Per-student downloads, for a batch of variants.
+    variant_urls = list()
+    if job.variants and job.status == GenerationJobDb.STATUS_DONE:
+        for variant in plan_variants(job.project_id, job.project.seed,
+                                     json.loads(job.variants)):
+            variant_urls.append({
+                'label': variant.label,
+                'url': get_data_set_url(variant.file_name),
+            })
+    return JsonResponse({
+        'status': 'ok',
+        'jobstatus': job.status,
+        'progress': job.progress(),
+        'archiveurl': job.archive_url,
+        'varianturls': variant_urls,
+        'message': job.message,
+    })
+
+
+def stream_generate(request):
+    """
+    Make a data set, and send it to the client as a zip file while it's
+    being made. Only a chunk of each table is in memory at a time. The
+    archive is copied into the archive cache as it goes out, so the next
+    request with the same settings is sent the stored one.
+    """
+    # Get the project id from the post.
+    project_id = request.POST.get('projectid', None)
+    if project_id is None:
+        return HttpResponseServerError('Error: project id missing')
+    # Check that the user has generate access.
+    if not user_can_generate(request, project_id):
+        return HttpResponseForbidden('Error: access denied')
+    # Get the visible settings.
+    visible_settings_stringed = request.POST.get('settingsstate', None)
+    if visible_settings_stringed is None:
+        return HttpResponseServerError('Error: settingsstate missing')
+    visible_settings = json.loads(visible_settings_stringed)
+    generator = FedsGenerator(project_id)
+    archive_cache = get_archive_cache()
+    key = generator.archive_key(visible_settings)
+    cached_archive = archive_cache.open(key)
+    if cached_archive is not None:
+        response = FileResponse(cached_archive,
+                                content_type='application/zip')
+    else:
+        response = StreamingHttpResponse(
+            archive_cache.tee(key,
+                              stream_archive(generator, visible_settings)),
+            content_type='application/zip')
+    response['Content-Disposition'] = \
+        'attachment; filename="project{id}.zip"'.format(id=project_id)
+    return response
+
+
+def stream_archive(generator, visible_settings):
+    """
+    Make the data set, and zip it, a chunk at a time.
+    :return: Iterator of bytes of the zip file.
+    """
+    stream_buffer = StreamBuffer()
+    archive = StreamingZipWriter(stream_buffer)
+    exporter = make_archive_exporter(generator.get_export_format(), archive,
+                                     sequential=True,
+                                     anomaly_plan=generator.get_anomaly_plan())
+    for table_name, field_names, columns in generator.iterate_table_chunks(
+            generator.exports_joined(exporter)):
+        exporter.write_chunk(table_name, field_names, columns)
+        yield stream_buffer.take()
+    exporter.close()
+    archive.write('project.html', generator.make_proj_spec(visible_settings))
+    for member_name, content in generator.make_answer_key():
+        archive.write(member_name, content)
+    archive.close()
+    yield stream_buffer.take()
+
+
+def make_project_archive(generator, visible_settings, project_id,
+                         zip_file_path, progress=None):
+    """
+    Put a project's archive at zip_file_path. Uses the archive cache if
+    the same settings and seed made an archive before. Otherwise, makes
+    it, and adds it to the cache.
+    :param progress: Optional function, see FedsGenerator.generate_tables().
+    :return: True if the archive came from the cache.
+    """
+    archive_cache = get_archive_cache()
+    key = generator.archive_key(visible_settings)
+    if archive_cache.get(key, zip_file_path):
+        return True
+    if FEDS_GENERATION_MODE == FEDS_GENERATION_MODE_DATABASE:
+        generate_through_database(generator, visible_settings,
+                                  project_id, zip_file_path)
+    else:
+        # Stream the data a chunk at a time, straight into the archive.
+        write_archive(generator, visible_settings, zip_file_path, progress)
+    archive_cache.put(key, zip_file_path)
+    return False
+
+
+# The generator, visible settings and project id a batch of variants is
+# made from. Set just before the variant workers are forked, so they
+# inherit them.
+variant_batch = None
+
+
+def make_variant_archives(generator, visible_settings, project_id, labels,
+                          progress=None, max_workers=FEDS_GENERATION_WORKERS):
+    """
+    Make a data set for each student, each from its own seed, and bundle
+    them into one archive.
+
+    The project, its settings and the vocabularies are loaded once, here.
+    Variants are made on a pool of worker processes forked from this one,
+    one variant to a worker, so every worker shares them. In database
+    mode, variants would share the project's tables, so they are made one
+    after another.
+    :param labels: Labels of the variants, e.g., student names.
+    :param progress: Optional function called with the number of variants
+            made so far, and the number of variants.
+    :param max_workers: Number of variants to make at a time.
+    :return: List of Variant.
+    """
+    global variant_batch
+    variants = plan_variants(project_id, generator.seed, labels)
+    if progress is not None:
+        progress(0, len(variants))
+    if FEDS_GENERATION_MODE == FEDS_GENERATION_MODE_DATABASE \
+            or max_workers == 1:
+        for variants_done, variant in enumerate(variants, 1):
+            make_variant_archive(generator, visible_settings, project_id,
+                                 variant)
+            if progress is not None:
+                progress(variants_done, len(variants))
+    else:
+        # Loaded before the fork, so the workers share its pages.
+        get_vocabulary_store()
+        # Forked workers must not share this process' DB connections.
+        connections.close_all()
+        variant_batch = (generator, visible_settings, project_id)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(make_batch_variant, variant)
+                           for variant in variants]
+                for variants_done, future in enumerate(
+                        as_completed(futures), 1):
+                    future.result()
+                    if progress is not None:
+                        progress(variants_done, len(variants))
+        finally:
+            variant_batch = None
+    write_variant_bundle(project_id, variants)
+    return variants
+
+
+def make_batch_variant(variant):
+    """
+    Make one variant in a worker forked by make_variant_archives(). Chunks
+    are made in the worker, as the other workers are busy with other
+    variants.
+    """
+    generator, visible_settings, project_id = variant_batch
+    make_variant_archive(generator, visible_settings, project_id, variant,
+                         generation_workers=1)
+
+
+def make_variant_archive(generator, visible_settings, project_id, variant,
+                         generation_workers=FEDS_GENERATION_WORKERS):
+    """
+    Make one student's archive, with the project's settings and the
+    variant's seed.
+    :param variant: Variant to make.
+    :param generation_workers: Worker processes to make chunks on.
+    """
+    variant_generator = copy.copy(generator)
+    variant_generator.seed = variant.seed
+    variant_generator.generation_workers = generation_workers
+    make_project_archive(variant_generator, visible_settings, project_id,
+                         get_path_to_data_set(variant.file_name))
+
+
+def write_variant_bundle(project_id, variants):
+    """
+    Put every variant's archive into one archive, with a CSV listing which
+    student has which. The archives are compressed already, so they are
+    stored as they are.
+    """
+    bundle_path = get_path_to_data_set(bundle_file_name(project_id))
+    part_file_path = bundle_path + '.part'
+    try:
+        with open(part_file_path, 'wb') as part_file:
+            # Members go in one after another, so nothing is spooled.
+            archive = StreamingZipWriter(part_file)
+            archive.write('variants.csv', variants_index(variants))
+            for variant in variants:
+                with open(get_path_to_data_set(variant.file_name),
+                          'rb') as variant_file:
+                    while True:
+                        block = variant_file.read(COPY_BUFFER_SIZE)
+                        if not block:
+                            break
+                        archive.write_stored(variant.file_name, block)
+            archive.close()
+        os.replace(part_file_path, bundle_path)
+    finally:
+        if os.path.exists(part_file_path):
+            os.unlink(part_file_path)
+
+
+def generate_through_database(generator, visible_settings, project_id,
+                              zip_file_path):
+    """
+    Make the data set in per-project DB tables, export it to files, and
+    zip them.
+    """
+    # Create a temp dir.
+    module_dir = os.path.dirname(__file__)  # get current directory
+    export_dir_path = os.path.join(module_dir,
+                                   'generated/project' + str(project_id))
+    # Make the dir if it does not exist.
+    if not os.path.exists(export_dir_path):
+        os.makedirs(export_dir_path)
+    # Erase all files in it.
+    erase_files_in_dir(export_dir_path)
+    # Create each of the tables with SQL.
+    generator.create_customer_table()
+    generator.create_product_table()
+    generator.create_invoice_table()
+    generator.create_invoice_deets_table()
+    # Make the data with the given settings, anomalies and all.
+    generator.reset_answer_key()
+    generator.create_customers()
+    generator.create_products()
+    generator.create_invoices()
+    # Export the tables, streaming rows from the DB.
+    generator.save_tables_data(export_dir_path)
+    # Make the project description document.
+    generator.save_proj_spec_file(visible_settings,
+                                  export_dir_path, 'project.html')
+    # Zip all the things.
+    zip_dir(export_dir_path, zip_file_path)
+    with zipfile.ZipFile(zip_file_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
+        for member_name, content in generator.make_answer_key():
+            zipf.writestr(member_name, content)
+    # Erase the files that were just zipped.
+    erase_files_in_dir(export_dir_path)
+
+
+def write_archive(generator, visible_settings, zip_file_path,
+                  progress=None):
+    """
+    Make the data set, and write it straight into a zip file, a chunk at
+    a time. The archive is built under a temporary name, so a failed run
+    doesn't leave a broken archive behind.
+    :param progress: Optional function, see FedsGenerator.generate_tables().
+    """
+    part_file_path = zip_file_path + '.part'
+    try:
+        with open(part_file_path, 'wb') as part_file:
+            archive = ChunkedZipWriter(part_file)
+            exporter = make_archive_exporter(
+                generator.get_export_format(), archive,
+                anomaly_plan=generator.get_anomaly_plan())
+            generator.generate_tables(exporter, progress)
+            exporter.close()
+            archive.write('project.html',
+                          generator.make_proj_spec(visible_settings))
+            for member_name, content in generator.make_answer_key():
+                archive.write(member_name, content)
+            archive.close()
+        os.replace(part_file_path, zip_file_path)
+    finally:
+        if os.path.exists(part_file_path):
+            os.unlink(part_file_path)
+
+
 @login_required
 def user_can_generate(request, project_id):
     # Check whether the user has permission.
@@ -101,6 +420,10 @@ def erase_files_in_dir(dir_path):
 
 
 def get_path_to_project_archive(project_id):
+    return get_path_to_data_set('project' + project_id + '.zip')
+
+
+def get_path_to_data_set(file_name):
     app_dir = os.path.dirname(__file__)  # get current directory
     # Relative path from app dir to dir where data sets will be stores.
     relative_path = '/../' + DATA_SETS_LOCATION + '/'
@@ -111,11 +434,19 @@ def get_path_to_project_archive(project_id):
         os.makedirs(data_set_dir)
     except OSError as e:
         if e.errno != errno.EEXIST:
-            raise IOError('get_path_to_project_archive: bad: ' + e.__str__())
-    path = os.path.join(data_set_dir, 'project' + project_id + '.zip')
+            raise IOError('get_path_to_data_set: bad: ' + e.__str__())
+    path = os.path.join(data_set_dir, file_name)
     return path
 
 
+def get_project_archive_url(project_id):
+    return get_data_set_url('project' + str(project_id) + '.zip')
+
+
+def get_data_set_url(file_name):
+    return '/uploads/' + file_name
+
+
 def zip_dir(export_dir_path, zip_file_path):
     if os.path.exists(zip_file_path):
         os.remove(zip_file_path)
@@ -136,7 +467,13 @@ def delete_archive(request):
         return JsonResponse({'status': 'Error: access denied'})
     try:
         zip_file_path = get_path_to_project_archive(project_id)
-        os.unlink(zip_file_path)
+        # Per-student variants, and their bundle, too.
+        zip_file_paths = glob.glob(
+            get_path_to_data_set('project' + project_id + '-*.zip'))
+        if os.path.exists(zip_file_path) or not zip_file_paths:
+            zip_file_paths.append(zip_file_path)
+        for zip_file_path in zip_file_paths:
+            os.unlink(zip_file_path)
         return JsonResponse({'status': 'ok'})
     except Exception as e:
         return JsonResponse({'status': 'Error: ' + e.__str__()})
@@ -0,0 +1,341 @@
+"""
+Word lists used to make names, addresses, products, and such.
+
+Each list is kept as one contiguous UTF-8 buffer, and an array of offsets
+into it: word i is buffer[offsets[i]:offsets[i + 1]]. The lists are
+loaded once per process, from a prebuilt binary file if there is one, or
+from the names_lists/*.txt files. The binary file is memory-mapped, so
+every process shares the same pages. Worker processes forked from the web
+server share the store it loaded.
+
+Column makers draw indices into the lists, and keep them in WordColumns.
+Words are only looked up when a column is exported, with
+resolve_column().
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Where the word lists are.
+NAMES_LISTS_DIR = os.path.join(os.path.dirname(__file__), 'names_lists')
+# Prebuilt binary of all of the lists. Made by manage.py build_vocabulary.
+BINARY_PATH = os.path.join(NAMES_LISTS_DIR, 'vocabulary.bin')
+BINARY_MAGIC = b'FEDSVOC1'
+
+
+class Vocabulary:
+    """
+    A list of words, in a UTF-8 buffer with offsets.
+    :param name: Name of the list, e.g., first_names.
+    :param buffer: bytes-like, the words' UTF-8, end to end.
+    :param offsets: Array of len(words) + 1 offsets into buffer.
+    :param shared: True if the list belongs to the process' shared store,
+            so it can be pickled by name.
+    """
+
+    def __init__(self, name, buffer, offsets, shared=False):
+        self.name = name
+        self.buffer = buffer
+        self.offsets = offsets
+        self.shared = shared
+        # Words as NumPy string arrays, decoded on first use, by case.
+        self.decoded = dict()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def word(self, index):
+        """ Look up one word. """
+        start = int(self.offsets[index])
+        end = int(self.offsets[index + 1])
+        return bytes(self.buffer[start:end]).decode('utf-8')
+
+    def strings(self, case=None):
+        """
+        Get all of the words, as an array to index into.
+        :param case: None, 'lower' or 'capitalize'.
+        :return: NumPy array of str.
+        """
+        if case not in self.decoded:
+            words = [self.word(index) for index in range(len(self))]
+            if case == 'lower':
+                words = [word.lower() for word in words]
+            elif case == 'capitalize':
+                words = [word.capitalize() for word in words]
+            elif case is not None:
+                raise ValueError('Vocabulary: bad case: ' + str(case))
+            self.decoded[case] = np.array(words)
+        return self.decoded[case]
+
+    def __reduce__(self):
+        # Workers have the shared store already. Send the name, not the
+        # words.
+        if self.shared:
+            return shared_vocabulary, (self.name,)
+        return Vocabulary, (self.name, bytes(self.buffer), self.offsets)
+
+
+class VocabularyStore:
+    """
+    A set of Vocabulary lists, by name.
+    :param vocabularies: Dict of Vocabulary, keyed by name.
+    :param shared: True for the process' shared store.
+    """
+
+    def __init__(self, vocabularies, shared=False):
+        self.vocabularies = vocabularies
+        self.shared = shared
+        # Hash of the words, worked out on first use.
+        self.words_digest = None
+
+    def __reduce__(self):
+        if self.shared:
+            return get_vocabulary_store, ()
+        return VocabularyStore, (self.vocabularies,)
+
+    def __getitem__(self, name):
+        return self.vocabularies[name]
+
+    def __contains__(self, name):
+        return name in self.vocabularies
+
+    def names(self):
+        return list(self.vocabularies.keys())
+
+    def digest(self):
+        """
+        Hash all of the lists, so data made from different words can be
+        told apart.
+        :return: Hex SHA-256.
+        """
+        if self.words_digest is None:
+            hasher = hashlib.sha256()
+            for name in sorted(self.vocabularies):
+                vocabulary = self.vocabularies[name]
+                hasher.update(name.encode('utf-8') + b'\0')
+                hasher.update(np.asarray(vocabulary.offsets,
+                                         dtype='<i8').tobytes())
+                hasher.update(vocabulary.buffer)
+            self.words_digest = hasher.hexdigest()
+        return self.words_digest
+
+    @classmethod
+    def from_lists(cls, word_lists, shared=False):
+        """
+        Make a store from lists of words.
+        :param word_lists: Dict of lists of str, keyed by name.
+        :param shared: True for the process' shared store.
+        :return: VocabularyStore
+        """
+        vocabularies = dict()
+        for name, words in word_lists.items():
+            encoded = [word.encode('utf-8') for word in words]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(word) for word in encoded], out=offsets[1:])
+            vocabularies[name] = Vocabulary(name, b''.join(encoded), offsets,
+                                            shared)
+        return cls(vocabularies, shared)
+
+    @classmethod
+    def from_text_files(cls, dir_path=NAMES_LISTS_DIR, shared=False):
+        """
+        Load every *.txt list in a directory, one word per line.
+        :return: VocabularyStore
+        """
+        word_lists = dict()
+        for file_name in sorted(os.listdir(dir_path)):
+            if file_name.endswith('.txt'):
+                with open(os.path.join(dir_path, file_name),
+                          encoding='utf-8') as file:
+                    word_lists[file_name[:-4]] = [line.strip()
+                                                  for line in file]
+        return cls.from_lists(word_lists, shared)
+
+    @classmethod
+    def from_binary(cls, path=BINARY_PATH, shared=False):
+        """
+        Memory-map a binary made by write_binary(). The words and offsets
+        are read straight from the mapped file, not copied.
+        :return: VocabularyStore
+        """
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise ValueError('VocabularyStore: not a vocabulary binary: '
+                             + path)
+        view = memoryview(mapped)
+        position = len(BINARY_MAGIC)
+        number_lists, = struct.unpack_from('<Q', mapped, position)
+        position += 8
+        vocabularies = dict()
+        for list_index in range(number_lists):
+            name_length, number_words, buffer_length = struct.unpack_from(
+                '<QQQ', mapped, position)
+            position += 24
+            name = bytes(view[position:position + name_length]).decode(
+                'utf-8')
+            position = aligned(position + name_length)
+            offsets = np.frombuffer(mapped, dtype='<i8',
+                                    count=number_words + 1, offset=position)
+            position += 8 * (number_words + 1)
+            buffer = view[position:position + buffer_length]
+            position = aligned(position + buffer_length)
+            vocabularies[name] = Vocabulary(name, buffer, offsets, shared)
+        return cls(vocabularies, shared)
+
+    def write_binary(self, path=BINARY_PATH):
+        """
+        Write the store to a binary that from_binary() can map. Offsets
+        are 8-byte aligned.
+        """
+        pieces = [BINARY_MAGIC, struct.pack('<Q', len(self.vocabularies))]
+        position = len(BINARY_MAGIC) + 8
+
+        def add(piece):
+            nonlocal position
+            pieces.append(piece)
+            position += len(piece)
+
+        def pad():
+            add(b'\0' * (aligned(position) - position))
+
+        for name, vocabulary in self.vocabularies.items():
+            encoded_name = name.encode('utf-8')
+            add(struct.pack('<QQQ', len(encoded_name), len(vocabulary),
+                            len(vocabulary.buffer)))
+            add(encoded_name)
+            pad()
+            add(np.asarray(vocabulary.offsets, dtype='<i8').tobytes())
+            add(bytes(vocabulary.buffer))
+            pad()
+        part_path = path + '.part'
+        with open(part_path, 'wb') as file:
+            file.write(b''.join(pieces))
+        os.replace(part_path, path)
+
+
+def aligned(position):
+    """ Round a position up to a multiple of 8. """
+    return (position + 7) // 8 * 8
+
+
+# The process' shared store, loaded by get_vocabulary_store().
+shared_store = None
+
+
+def get_vocabulary_store():
+    """
+    Get the shared store, loading it the first time. Uses the prebuilt
+    binary if it's there, and newer than the text lists.
+    :return: VocabularyStore
+    """
+    global shared_store
+    if shared_store is None:
+        if binary_is_current():
+            shared_store = VocabularyStore.from_binary(shared=True)
+        else:
+            shared_store = VocabularyStore.from_text_files(shared=True)
+    return shared_store
+
+
+def binary_is_current():
+    """ Check whether the prebuilt binary exists, and is up to date. """
+    if not os.path.exists(BINARY_PATH):
+        return False
+    binary_time = os.path.getmtime(BINARY_PATH)
+    for file_name in os.listdir(NAMES_LISTS_DIR):
+        if file_name.endswith('.txt') and os.path.getmtime(
+                os.path.join(NAMES_LISTS_DIR, file_name)) > binary_time:
+            logger.warning('Vocabulary binary is older than ' + file_name
+                           + ', using the text lists. Run build_vocabulary.')
+            return False
+    return True
+
+
+def shared_vocabulary(name):
+    """ Get a list from the shared store. Used to unpickle lists. """
+    return get_vocabulary_store()[name]
+
+
+# Part of a WordColumn: indices into a vocabulary, and the case to use.
+WordIndices = namedtuple('WordIndices', ['vocabulary', 'indices', 'case'])
+
+
+class WordColumn:
+    """
+    A column of text made of words, kept as vocabulary indices until it's
+    exported. Each value is its parts, joined.
+    :param parts: List of parts, each a WordIndices, an array of values,
+            or a str to put in every value.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __len__(self):
+        for part in self.parts:
+            if isinstance(part, WordIndices):
+                return len(part.indices)
+            if not isinstance(part, str):
+                return len(part)
+        return 0
+
+    def resolve(self):
+        """
+        Look up the words and join the parts.
+        :return: NumPy array of str.
+        """
+        result = None
+        for part in self.parts:
+            if isinstance(part, WordIndices):
+                part = part.vocabulary.strings(part.case)[part.indices]
+            elif not isinstance(part, str) and part.dtype.kind != 'U':
+                part = part.astype(str)
+            result = part if result is None else np.char.add(result, part)
+        return result
+
+    def take(self, positions):
+        """
+        Pick values by position, still as vocabulary indices.
+        :param positions: Array of row positions.
+        :return: WordColumn
+        """
+        parts = list()
+        for part in self.parts:
+            if isinstance(part, WordIndices):
+                part = part._replace(indices=part.indices[positions])
+            elif not isinstance(part, str):
+                part = part[positions]
+            parts.append(part)
+        return WordColumn(parts)
+
+
+def resolve_column(column):
+    """
+    Get a column's values as an array, looking up words if needed.
+    :param column: Array, or WordColumn.
+    :return: Array.
+    """
+    if isinstance(column, WordColumn):
+        return column.resolve()
+    return column
+
+
+def take_column(column, positions):
+    """
+    Pick a column's values by position, without looking up words.
+    :param column: Array, or WordColumn.
+    :param positions: Array of row positions.
+    :return: Array, or WordColumn.
+    """
+    if isinstance(column, WordColumn):
+        return column.take(positions)
+    return column[positions]
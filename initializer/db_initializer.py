@@ -32,7 +32,8 @@ from feds.settings import FEDS_BOOLEAN_SETTING, \
     FEDS_DETERMINING_VALUE_PARAM, FEDS_VISIBILITY_TEST_PARAM, \
     FEDS_DATE_SETTING, FEDS_START_DATE_DEFAULT, FEDS_END_DATE_DEFAULT, \
     FEDS_MIN_DATE, FEDS_NUM_CUSTOMERS_CUSTOM, \
-    FEDS_NUM_INVOICES_PER_CUST_CUSTOM, FEDS_NUM_PRODUCTS_OPTIONS
+    FEDS_NUM_INVOICES_PER_CUST_CUSTOM, FEDS_NUM_PRODUCTS_OPTIONS, \
+    FEDS_EXPORT_FORMATS, FEDS_EXPORT_FORMAT_CSV
 
 
 # noinspection PyAttributeOutsideInit,PyMethodMayBeStatic
@@ -366,6 +367,29 @@ class DbInitializer:
             )
         self.ba_revenue_setting_number_style.save()
 
+        # Export file format.
+        self.export_format = FieldSettingDb(
+            title='Export format',
+            machine_name='export_format',
+            description='File format the tables are exported in.',
+            setting_group=FEDS_BASIC_SETTING_GROUP,
+            setting_type=FEDS_CHOICE_SETTING,
+            setting_params={
+                FEDS_CHOICES_PARAM: FEDS_EXPORT_FORMATS,
+                FEDS_VALUE_PARAM: FEDS_EXPORT_FORMAT_CSV
+            }
+        )
+        self.export_format.save()
+        # Link setting to business area.
+        self.ba_revenue_setting_export_format \
+            = AvailableBusinessAreaSettingDb(
+              business_area=self.revenue_business_area,
+              business_area_setting=self.export_format,
+              machine_name='ba_revenue_setting_export_format',
+              business_area_setting_order=8,
+            )
+        self.ba_revenue_setting_export_format.save()
+
     def make_notional_tables(self):
         NotionalTableDb.objects.all().delete()
         self.tbl_customer = NotionalTableDb(
@@ -1181,7 +1205,7 @@ class DbInitializer:
               field_setting_order=3,
               field_setting_params={}
             )
-        self.fld_spec_invc_tot_bt_setting_norm_distrib_mean.save()
+        self.fld_spec_invc_tot_bt_anomaly_arithmetic_errors.save()
 
         # Link negative numbers to total invoice cost before tax.
         self.fld_spec_invc_tot_bt_anomaly_negative_numbers \
@@ -1194,6 +1218,17 @@ class DbInitializer:
             )
         self.fld_spec_invc_tot_bt_anomaly_negative_numbers.save()
 
+        # Link Benford's law anomaly to total invoice cost before tax.
+        self.fld_spec_invc_tot_bt_anomaly_violates_benfords_law \
+            = AvailableFieldSpecSettingDb(
+              field_spec=self.invoice_total_before_tax,
+              field_setting=self.anomaly_violates_benfords_law,
+              machine_name='fld_spec_invc_tot_bt_anomaly_violates_benfords_law',
+              field_setting_order=5,
+              field_setting_params={}
+            )
+        self.fld_spec_invc_tot_bt_anomaly_violates_benfords_law.save()
+
         # Link arithmetic error to sales tax.
         self.fld_spec_invc_sales_tax_anomaly_arithmetic_errors \
             = AvailableFieldSpecSettingDb(
@@ -0,0 +1,293 @@
+"""
+Default projects, compiled once for each business area.
+
+A project's defaults only depend on its business area: its settings, and
+its tables, with their field specs and settings. They're compiled into a
+DefaultProject the first time a project in the business area is read,
+and kept. Projects share its objects, and copy only the settings the
+user has set, and the tables and field specs they're in. See
+projects.read_write_project.
+
+Saving or deleting any business area, table, field spec or setting row
+throws away every DefaultProject in this process. Other processes keep
+theirs for up to FEDS_DEFAULT_PROJECT_CACHE_SECONDS.
+"""
+
+import time
+from collections import defaultdict
+
+from django.db.models.signals import post_save, post_delete
+
+from feds.settings import FEDS_DEFAULT_PROJECT_CACHE_SECONDS
+from projects.internal_representation_classes import FedsNotionalTable, \
+    FedsBusinessArea, FedsFieldSpec, ProjectRegistry
+from fieldsettings.models import FieldSettingDb
+from businessareas.models import BusinessAreaDb, NotionalTableDb, \
+    AvailableNotionalTableSettingDb, AvailableBusinessAreaSettingDb
+from fieldspecs.models import FieldSpecDb, NotionalTableMembershipDb, \
+    AvailableFieldSpecSettingDb
+from projects.settings_gatherer import SettingsGatherer
+
+# Compiled default projects, by business area id. Tuples: when compiled,
+# from time.time(), and the DefaultProject.
+default_projects = dict()
+
+
+class DefaultProject:
+    """
+    A business area's default settings, tables, and field specs, shared
+    by its projects. Don't change it.
+    :param business_area: FedsBusinessArea.
+    :param settings: List of the project's FedsXXXSettings.
+    :param notional_tables: List of FedsNotionalTable.
+    :param registry: ProjectRegistry the objects registered with. Projects
+            copy it.
+    """
+
+    def __init__(self, business_area, settings, notional_tables, registry):
+        self.business_area = business_area
+        self.settings = settings
+        self.notional_tables = notional_tables
+        self.registry = registry
+
+
+def get_default_project(business_area_db):
+    """
+    Get a business area's compiled default project, compiling it if it
+    isn't cached, or is too old.
+    :param business_area_db: The DB record for the business area.
+    :return: DefaultProject
+    """
+    cached = default_projects.get(business_area_db.pk)
+    if cached is not None:
+        when_compiled, default_project = cached
+        if time.time() - when_compiled < FEDS_DEFAULT_PROJECT_CACHE_SECONDS:
+            return default_project
+    when_compiled = time.time()
+    default_project = compile_default_project(business_area_db)
+    default_projects[business_area_db.pk] = (when_compiled, default_project)
+    return default_project
+
+
+def clear_default_projects(**kwargs):
+    """ Throw away the compiled default projects. A signal receiver. """
+    default_projects.clear()
+
+
+# Rows the default projects are compiled from.
+for model in (BusinessAreaDb, NotionalTableDb, AvailableBusinessAreaSettingDb,
+              AvailableNotionalTableSettingDb, FieldSpecDb,
+              NotionalTableMembershipDb, AvailableFieldSpecSettingDb,
+              FieldSettingDb):
+    post_save.connect(clear_default_projects, sender=model,
+                      dispatch_uid='clear_default_projects')
+    post_delete.connect(clear_default_projects, sender=model,
+                        dispatch_uid='clear_default_projects')
+
+
+def compile_default_project(business_area_db):
+    """
+    Compile a business area's default project.
+
+    The business area's tree, its tables, their field specs, and all of
+    their settings, is fetched in a fixed number of queries, however many
+    tables and fields there are, and put together in memory.
+    :param business_area_db: The DB record for the business area.
+    :return: DefaultProject
+    """
+    # Objects register their machine names as they're made.
+    registry = ProjectRegistry()
+    business_area = FedsBusinessArea(
+        db_id=business_area_db.pk,
+        title=business_area_db.title,
+        machine_name=business_area_db.machine_name,
+        description=business_area_db.description,
+        registry=registry
+    )
+    # Get the tree from the DB.
+    business_area_settings = list(
+        AvailableBusinessAreaSettingDb.objects.filter(
+            business_area=business_area_db
+        ).order_by('business_area_setting_order').values())
+    tables_db_records = list(NotionalTableDb.objects.filter(
+        business_area=business_area_db
+    ).order_by('display_order'))
+    table_settings = group_records(
+        AvailableNotionalTableSettingDb.objects.filter(
+            table__business_area=business_area_db
+        ).order_by('table_setting_order').values(),
+        'table_id')
+    # The field specs in each table, in order.
+    field_specs_db_records = defaultdict(list)
+    for membership_db in NotionalTableMembershipDb.objects.filter(
+            notional_table__business_area=business_area_db
+    ).select_related('field_spec').order_by('field_order', 'pk'):
+        field_specs_db_records[membership_db.notional_table_id].append(
+            membership_db.field_spec)
+    field_spec_ids = {field_spec_db_record.pk
+                      for field_spec_db_records
+                      in field_specs_db_records.values()
+                      for field_spec_db_record in field_spec_db_records}
+    field_spec_settings = group_records(
+        AvailableFieldSpecSettingDb.objects.filter(
+            field_spec_id__in=field_spec_ids
+        ).order_by('field_setting_order').values(),
+        'field_spec_id')
+    # The base settings of every setting in the tree.
+    base_setting_ids = set()
+    base_setting_ids.update(relationship_setting['business_area_setting_id']
+                            for relationship_setting
+                            in business_area_settings)
+    for relationship_settings in table_settings.values():
+        base_setting_ids.update(relationship_setting['table_setting_id']
+                                for relationship_setting
+                                in relationship_settings)
+    for relationship_settings in field_spec_settings.values():
+        base_setting_ids.update(relationship_setting['field_setting_id']
+                                for relationship_setting
+                                in relationship_settings)
+    base_settings = {
+        base_setting_db['id']: base_setting_db
+        for base_setting_db in FieldSettingDb.objects.filter(
+            pk__in=base_setting_ids).values()
+    }
+
+    # Gather the project's settings, merging setting and relationship
+    # params.
+    settings = gather_default_project_settings(base_settings,
+                                               business_area_settings,
+                                               registry)
+    notional_tables = list()
+    for table_db_record in tables_db_records:
+        # Create the internal rep of the table
+        table = FedsNotionalTable(
+            db_id=table_db_record.pk,
+            title=table_db_record.title,
+            machine_name=table_db_record.machine_name,
+            description=table_db_record.description,
+            registry=registry
+        )
+        # Add settings to the table, merging setting and relationship params.
+        add_default_table_settings(table, base_settings,
+                                   table_settings[table_db_record.pk],
+                                   registry)
+        for field_spec_db_record in field_specs_db_records[
+                table_db_record.pk]:
+            field_spec = FedsFieldSpec(
+                db_id=field_spec_db_record.pk,
+                title=field_spec_db_record.title,
+                machine_name=field_spec_db_record.machine_name,
+                description=field_spec_db_record.description,
+                field_type=field_spec_db_record.field_type,
+                registry=registry
+            )
+            # Add settings to the field spec, merging setting
+            # and relationship params.
+            add_default_field_spec_settings(
+                field_spec, base_settings,
+                field_spec_settings[field_spec_db_record.pk], registry)
+            table.add_field_spec(field_spec)
+        notional_tables.append(table)
+    return DefaultProject(
+        business_area=business_area,
+        settings=settings,
+        notional_tables=notional_tables,
+        registry=registry,
+    )
+
+
+def group_records(records, key_field):
+    """
+    Group records by one of their fields, keeping their order.
+    :param records: Iterable of dicts, e.g., from values().
+    :param key_field: Name of the field to group by.
+    :return: defaultdict of lists of records, by the field's value.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        groups[record[key_field]].append(record)
+    return groups
+
+
+def referenced_base_settings(base_settings, relationship_settings,
+                             relationship_setting_id_field):
+    """
+    Find the base settings some relationship settings refer to.
+    :param base_settings: Dict of base settings, from FieldSettingDb, by id.
+    :param relationship_settings: List of relationship settings.
+    :param relationship_setting_id_field: Name of the setting id field in
+            relationship_settings.
+    :return: List of base settings. Ones that can't be found are left out,
+            for SettingsGatherer to report.
+    """
+    return [base_settings[setting_id] for setting_id in
+            {relationship_setting[relationship_setting_id_field]
+             for relationship_setting in relationship_settings}
+            if setting_id in base_settings]
+
+
+def gather_default_project_settings(base_settings, relationship_settings,
+                                    registry):
+    """
+    Gather the default settings for a project.
+    :param base_settings: Dict of base settings, from FieldSettingDb, by id.
+    :param relationship_settings: The business area's
+            AvailableBusinessAreaSettingDb records, as dicts, in order.
+    :param registry: ProjectRegistry to register the settings with.
+    :return: List of FedsXXXSettings.
+    """
+    settings_gatherer = SettingsGatherer(
+        base_settings=referenced_base_settings(
+            base_settings, relationship_settings,
+            'business_area_setting_id'),
+        relationship_settings=relationship_settings,
+        relationship_setting_id_field='business_area_setting_id',
+        relationship_setting_order_field='business_area_setting_order',
+        relationship_setting_params_field='business_area_setting_params',
+        registry=registry,
+    )
+    return settings_gatherer.gather_settings()
+
+
+def add_default_table_settings(table, base_settings, relationship_settings,
+                               registry):
+    """
+    Add default settings for a table.
+    :param table: The table's internal rep.
+    :param base_settings: Dict of base settings, from FieldSettingDb, by id.
+    :param relationship_settings: The table's
+            AvailableNotionalTableSettingDb records, as dicts, in order.
+    :param registry: ProjectRegistry to register the settings with.
+    """
+    settings_gatherer = SettingsGatherer(
+        base_settings=referenced_base_settings(
+            base_settings, relationship_settings, 'table_setting_id'),
+        relationship_settings=relationship_settings,
+        relationship_setting_id_field='table_setting_id',
+        relationship_setting_order_field='table_setting_order',
+        relationship_setting_params_field='table_setting_params',
+        registry=registry,
+    )
+    table.settings = settings_gatherer.gather_settings()
+
+
+def add_default_field_spec_settings(field_spec_model, base_settings,
+                                    relationship_settings, registry):
+    """
+    Add default settings for field spec.
+    :param field_spec_model: Internal rep of the field spec.
+    :param base_settings: Dict of base settings, from FieldSettingDb, by id.
+    :param relationship_settings: The field spec's
+            AvailableFieldSpecSettingDb records, as dicts, in order.
+    :param registry: ProjectRegistry to register the settings with.
+    """
+    settings_gatherer = SettingsGatherer(
+        base_settings=referenced_base_settings(
+            base_settings, relationship_settings, 'field_setting_id'),
+        relationship_settings=relationship_settings,
+        relationship_setting_id_field='field_setting_id',
+        relationship_setting_order_field='field_setting_order',
+        relationship_setting_params_field='field_setting_params',
+        registry=registry,
+    )
+    field_spec_model.settings = settings_gatherer.gather_settings()
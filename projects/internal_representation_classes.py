@@ -37,27 +37,127 @@ Classes are:
 * FedsFieldSpec: represents a field in a notional table
 * FedsXXXSetting: settings of different types: integer, currency,
   choices, others.
+* ProjectRegistry: a project's machine names, settings by machine name,
+  and visibility testers.
 
 All instances know how to render themselves for display. Settings
 know how to render input widgets, we well.
 """
 
 
+class ProjectRegistry:
+    """
+    A project's machine names, its settings by machine name, and their
+    visibility testers.
+
+    Objects register with the registry they're given when they're made.
+    Each project read has its own, kept in FedsProject.registry, so
+    requests reading projects at the same time don't share anything.
+    """
+
+    def __init__(self):
+        # Machine names of the objects in the project.
+        self.machine_names = set()
+        # Setting machine names, linked to their FedsXXXSetting instances.
+        self.settings = dict()
+        # Setting visibility testers, by machine name.
+        self.visibility_testers = dict()
+
+    def add_machine_name(self, machine_name, title):
+        """
+        Register an object's machine name.
+        :param machine_name: The machine name.
+        :param title: The object's title, for the error message.
+        """
+        if machine_name in self.machine_names:
+            message = 'Machine name "{mn}" already defined. Title: "{title}"'
+            raise ValueError(message.format(mn=machine_name, title=title))
+        self.machine_names.add(machine_name)
+
+    def add_setting(self, setting):
+        """ Link a setting's machine name to it, replacing any setting. """
+        self.settings[setting.machine_name] = setting
+
+    def add_visibility_tester(self, machine_name, visibility_tester):
+        """ Register the visibility tester for a setting. """
+        self.visibility_testers[machine_name] = visibility_tester
+
+    def copy(self):
+        """
+        Copy the registry, sharing the settings.
+        :return: ProjectRegistry
+        """
+        registry = ProjectRegistry()
+        registry.machine_names = set(self.machine_names)
+        registry.settings = dict(self.settings)
+        registry.visibility_testers = dict(self.visibility_testers)
+        return registry
+
+    def generate_js_settings_values_object(self):
+        """
+        Return the values of the params in the settings as a JS object.
+        """
+        result = '{\n'
+        for machine_name, setting in self.settings.items():
+            if FEDS_VALUE_PARAM in setting.params:
+                result += '"{mn}": "{val}", \n'.format(
+                    mn=machine_name,
+                    val=setting.params[FEDS_VALUE_PARAM]
+                )
+        result += '}'
+        return result
+
+    def generate_js_visibility_testers_object(self):
+        """
+        Return visibility testers in a JS object.
+
+        mn = machine name of the setting whose visibility is being controlled.
+        dmn = machine name of the setting that controls visibility.
+        dv = if dmn has this value, controlled setting is visible.
+
+        dmn_key = key of the dmn in the JS object.
+        dv_key = key of the dv in the JS object.
+        """
+        result = '{\n'
+        for machine_name, determiner_pair \
+                in self.visibility_testers.items():
+            determiner = determiner_pair[FEDS_MACHINE_NAME_PARAM]
+            determining_value = determiner_pair[FEDS_DETERMINING_VALUE_PARAM]
+            entry = '''
+                "{mn}": {{
+                  "{dmn_key}":"{dmn}",
+            "{dv_key}": "{dv}"
+                }},
+            '''
+            entry = entry.format(
+                mn=machine_name,
+                dmn_key=FEDS_MACHINE_NAME_PARAM,
+                dmn=determiner,
+                dv_key=FEDS_DETERMINING_VALUE_PARAM,
+                dv=determining_value,
+            )
+            result += entry
+        result += '}'
+        return result
+
+
 class FedsBase:
     """
     Base class with common properties.
 
     Treat it as abstract. Don't instantiate.
+    :param registry: ProjectRegistry to register the machine name with, or
+            None, for an object that isn't part of a project.
     """
 
-    # List of existing machine names.
-    machine_name_list = list()
-
-    def __init__(self, db_id, title, description, machine_name):
+    def __init__(self, db_id, title, description, machine_name,
+                 registry=None):
         self.db_id = db_id
         self.title = title
         self.description = description
         self.machine_name = machine_name
+        if registry is not None:
+            registry.add_machine_name(self.machine_name, self.title)
 
     @property
     def db_id(self):
@@ -112,16 +212,6 @@ class FedsBase:
                     sep=FEDS_AGGREGATE_MACHINE_NAME_SEPARATOR
                 )
             )
-        if machine_name in FedsBase.machine_name_list:
-            message = 'Machine name "{mn}" already defined. Title: "{title}"'
-            raise ValueError(message.format(mn=machine_name, title=self.title))
-        FedsBase.machine_name_list.append(machine_name)
-
-    def __del__(self):
-        """ Remove machine name from list once object destroyed. """
-        if hasattr(self, 'machine_name'):
-            if self.machine_name in FedsBase.machine_name_list:
-                FedsBase.machine_name_list.remove(self.machine_name)
 
     def display_deets(self):
         """ Display an HTML rep of the instance. """
@@ -135,8 +225,9 @@ class FedsBaseWithSettingsList(FedsBase):
     have settings.
     """
 
-    def __init__(self, db_id, title, description, machine_name):
-        super().__init__(db_id, title, description, machine_name)
+    def __init__(self, db_id, title, description, machine_name,
+                 registry=None):
+        super().__init__(db_id, title, description, machine_name, registry)
         self.settings = list()
 
     def add_setting(self, setting):
@@ -150,16 +241,25 @@ class FedsBaseWithSettingsList(FedsBase):
 class FedsBusinessArea(FedsBaseWithSettingsList):
     """ A business area. """
 
-    def __init__(self, db_id, title, description, machine_name):
-        super().__init__(db_id, title, description, machine_name)
+    def __init__(self, db_id, title, description, machine_name,
+                 registry=None):
+        super().__init__(db_id, title, description, machine_name, registry)
 
 
 class FedsProject(FedsBaseWithSettingsList):
-    """ A user project. """
+    """
+    A user project.
+    :param registry: ProjectRegistry for the project's objects. A new one
+            if None.
+    """
 
     def __init__(self, db_id, owner, title, # slug,
-                 business_area, description, machine_name, when_created):
-        super().__init__(db_id, title, description, machine_name)
+                 business_area, description, machine_name, when_created,
+                 registry=None):
+        if registry is None:
+            registry = ProjectRegistry()
+        super().__init__(db_id, title, description, machine_name, registry)
+        self.registry = registry
         self.owner = owner
         # self.slug = slug
         self.business_area = business_area
@@ -202,8 +302,9 @@ class FedsProject(FedsBaseWithSettingsList):
 class FedsNotionalTable(FedsBaseWithSettingsList):
     """ A notional table for a user project. """
 
-    def __init__(self, db_id, title, description, machine_name):
-        super().__init__(db_id, title, description, machine_name)
+    def __init__(self, db_id, title, description, machine_name,
+                 registry=None):
+        super().__init__(db_id, title, description, machine_name, registry)
         self.field_specs = list()
 
     def add_field_spec(self, field_spec):
@@ -217,8 +318,9 @@ class FedsNotionalTable(FedsBaseWithSettingsList):
 class FedsFieldSpec(FedsBaseWithSettingsList):
     """ A field for a user project. In a notional table. """
 
-    def __init__(self, db_id, title, field_type, description, machine_name):
-        super().__init__(db_id, title, description, machine_name)
+    def __init__(self, db_id, title, field_type, description, machine_name,
+                 registry=None):
+        super().__init__(db_id, title, description, machine_name, registry)
         self.field_type = field_type
 
     @property
@@ -252,15 +354,9 @@ class FedsSetting(FedsBase):
     Treat this as an abstract class. Don't instantiate it.
     """
 
-    # Setting machine names, linked to their FedsXXXSetting instances.
-    setting_machine_names = dict()
-
-    # Setting visibility testers.
-    setting_visibility_testers = dict()
-
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
-        super().__init__(db_id, title, description, machine_name)
+                 group, params, setting_order, registry=None):
+        super().__init__(db_id, title, description, machine_name, registry)
         if not isinstance(setting_order, int):
             message = 'Setting "{title}": order "{order}" not numeric.'
             raise TypeError(message.format(title=title, order=setting_order))
@@ -298,7 +394,8 @@ class FedsSetting(FedsBase):
             message = '"{title}": bad params type'
             raise ValidationError(message.format(title=self.title))
         # Link machine name to self. Convenient lookup given machine name.
-        FedsSetting.setting_machine_names[self.machine_name] = self
+        if registry is not None:
+            registry.add_setting(self)
         # Use the label property if it is given, otherwise use the title
         # as the setting label.
         if FEDS_LABEL_PARAM in self.params:
@@ -321,11 +418,11 @@ class FedsSetting(FedsBase):
                 [FEDS_MACHINE_NAME_PARAM]
             determining_value = self.params[FEDS_VISIBILITY_TEST_PARAM] \
                 [FEDS_DETERMINING_VALUE_PARAM]
-            FedsSetting.setting_visibility_testers[self.machine_name] \
-                = {
+            if registry is not None:
+                registry.add_visibility_tester(self.machine_name, {
                     FEDS_MACHINE_NAME_PARAM: determiner_machine_name,
                     FEDS_DETERMINING_VALUE_PARAM: determining_value,
-                  }
+                })
 
     @property
     def order(self):
@@ -404,65 +501,15 @@ class FedsSetting(FedsBase):
         html = template.format(description=self.description)
         return html
 
-    @classmethod
-    def generate_js_settings_values_object(cls):
-        """
-        Return the values of the params in the settings in
-        setting_machine_name() as a JS object.
-        """
-        result = '{\n'
-        for machine_name, setting in cls.setting_machine_names.items():
-            if FEDS_VALUE_PARAM in setting.params:
-                result += '"{mn}": "{val}", \n'.format(
-                    mn=machine_name,
-                    val=setting.params[FEDS_VALUE_PARAM]
-                )
-        result += '}'
-        return result
-
-    @classmethod
-    def generate_js_visibility_testers_object(cls):
-        """
-        Return visibility testers in a JS object.
-
-        mn = machine name of the setting whose visibility is being controlled.
-        dmn = machine name of the setting that controls visibility.
-        dv = if dmn has this value, controlled setting is visible.
-
-        dmn_key = key of the dmn in the JS object.
-        dv_key = key of the dv in the JS object.
-        """
-        result = '{\n'
-        for machine_name, determiner_pair \
-                in cls.setting_visibility_testers.items():
-            determiner = determiner_pair[FEDS_MACHINE_NAME_PARAM]
-            determining_value = determiner_pair[FEDS_DETERMINING_VALUE_PARAM]
-            entry = '''
-                "{mn}": {{
-                  "{dmn_key}":"{dmn}",
-            "{dv_key}": "{dv}"
-                }},
-            '''
-            entry = entry.format(
-                mn=machine_name,
-                dmn_key=FEDS_MACHINE_NAME_PARAM,
-                dmn=determiner,
-                dv_key=FEDS_DETERMINING_VALUE_PARAM,
-                dv=determining_value,
-            )
-            result += entry
-        result += '}'
-        return result
-
 
 class FedsDateSetting(FedsSetting):
     """
     A setting that is a date.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_DATE_SETTING
         if FEDS_VALUE_PARAM in self.params:
             if isinstance(self.params[FEDS_VALUE_PARAM], datetime.date):
@@ -550,9 +597,9 @@ class FedsBooleanSetting(FedsSetting):
     A setting that is a boolean value.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_BOOLEAN_SETTING
         # if FEDS_VALUE_PARAM in self.params:
         #     self.value = \
@@ -620,9 +667,9 @@ class FedsIntegerSetting(FedsSetting):
     A setting that is an integer value.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_INTEGER_SETTING
         self.convert_value_to_int()
 
@@ -703,9 +750,9 @@ class FedsChoiceSetting(FedsSetting):
     A setting that is one of a set of choices.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_CHOICE_SETTING
         # Are there choices?
         if FEDS_CHOICES_PARAM not in self.params:
@@ -820,9 +867,9 @@ class FedsCurrencySetting(FedsSetting):
     A setting that is a currency value.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_CURRENCY_SETTING
         self.convert_value_to_currency()
 
@@ -903,9 +950,9 @@ class FedsFloatSetting(FedsSetting):
     A setting that is a currency value.
     """
     def __init__(self, db_id, title, description, machine_name,
-                 group, params, setting_order):
+                 group, params, setting_order, registry=None):
         super().__init__(db_id, title, description, machine_name,
-                         group, params, setting_order)
+                         group, params, setting_order, registry)
         self.type = FEDS_FLOAT_SETTING
         # if FEDS_VALUE_PARAM in self.params:
         #     self.value = self.params[FEDS_VALUE_PARAM]
@@ -0,0 +1,105 @@
+import json
+import time
+
+from django.core.management import BaseCommand
+
+from feds.settings import FEDS_BOOLEAN_SETTING, FEDS_INTEGER_SETTING, \
+    FEDS_CHOICE_SETTING, FEDS_FLOAT_SETTING, FEDS_VALUE_PARAM, \
+    FEDS_MIN_PARAM, FEDS_MAX_PARAM, FEDS_CHOICES_PARAM, \
+    FEDS_BOOLEAN_VALUE_FALSE, FEDS_BASIC_SETTING_GROUP
+from projects.internal_representation_classes import ProjectRegistry
+from projects.settings_gatherer import SettingsGatherer, \
+    parse_setting_params
+
+# Base settings for the synthetic business area: type and params.
+SYNTHETIC_SETTINGS = [
+    (FEDS_BOOLEAN_SETTING, {FEDS_VALUE_PARAM: FEDS_BOOLEAN_VALUE_FALSE}),
+    (FEDS_INTEGER_SETTING, {FEDS_VALUE_PARAM: 5, FEDS_MIN_PARAM: 0,
+                            FEDS_MAX_PARAM: 100}),
+    (FEDS_FLOAT_SETTING, {FEDS_VALUE_PARAM: 0.5, FEDS_MIN_PARAM: 0}),
+    (FEDS_CHOICE_SETTING, {FEDS_VALUE_PARAM: 'b',
+                           FEDS_CHOICES_PARAM: [['a', 'A'], ['b', 'B']]}),
+]
+
+
+def make_synthetic_business_area(tables, settings_per_table):
+    """
+    Make the settings records of a synthetic business area, as
+    values() would return them.
+    :param tables: Number of tables.
+    :param settings_per_table: Number of settings for each table.
+    :return: Tuple: list of base setting records, and list of each
+            table's relationship setting records.
+    """
+    base_settings = list()
+    for index in range(settings_per_table):
+        setting_type, params = SYNTHETIC_SETTINGS[
+            index % len(SYNTHETIC_SETTINGS)]
+        base_settings.append({
+            'id': index + 1,
+            'title': 'Setting {index}'.format(index=index),
+            'description': '',
+            'setting_group': FEDS_BASIC_SETTING_GROUP,
+            'setting_type': setting_type,
+            'setting_params': json.dumps(params),
+        })
+    table_settings = list()
+    for table_index in range(tables):
+        relationship_settings = list()
+        for index, base_setting in enumerate(base_settings):
+            relationship_settings.append({
+                'id': table_index * settings_per_table + index + 1,
+                'table_setting_id': base_setting['id'],
+                'machine_name': 'table_{table}_setting_{index}'.format(
+                    table=table_index, index=index),
+                'table_setting_order': index,
+                # Some tables override a few settings.
+                'table_setting_params': json.dumps(
+                    {'title': 'Table setting'}) if index % 10 == 0 else '',
+            })
+        table_settings.append(relationship_settings)
+    return base_settings, table_settings
+
+
+# The class must be named Command, and subclass BaseCommand
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Time gathering settings for a synthetic business area."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=10,
+                            help='Number of tables.')
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[100, 200, 400, 800],
+                            help='Numbers of settings per table to try.')
+
+    # A command must define handle()
+    def handle(self, *args, **options):
+        """ Gather every table's settings, for each size, and time it. """
+        self.stdout.write('{settings:>10} {seconds:>10} {per:>14}'.format(
+            settings='Per table', seconds='Seconds', per='us per setting'))
+        for settings_per_table in options['sizes']:
+            base_settings, table_settings = make_synthetic_business_area(
+                options['tables'], settings_per_table)
+            # Start each size afresh, as compiling a business area does.
+            registry = ProjectRegistry()
+            parse_setting_params.cache_clear()
+            gathered = list()
+            start = time.time()
+            for relationship_settings in table_settings:
+                settings_gatherer = SettingsGatherer(
+                    base_settings=base_settings,
+                    relationship_settings=relationship_settings,
+                    relationship_setting_id_field='table_setting_id',
+                    relationship_setting_order_field='table_setting_order',
+                    relationship_setting_params_field='table_setting_params',
+                    registry=registry,
+                )
+                gathered.append(settings_gatherer.gather_settings())
+            seconds = time.time() - start
+            number_settings = options['tables'] * settings_per_table
+            self.stdout.write(
+                '{settings:>10} {seconds:>10.3f} {per:>14.1f}'.format(
+                    settings=settings_per_table, seconds=seconds,
+                    per=seconds / number_settings * 1e6))
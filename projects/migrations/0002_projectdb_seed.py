@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import projects.models
+
+
+def seed_existing_projects(apps, schema_editor):
+    # A callable default is only called once for existing rows, so give
+    # each existing project its own seed.
+    ProjectDb = apps.get_model('projects', 'ProjectDb')
+    for project in ProjectDb.objects.all():
+        project.seed = projects.models.make_project_seed()
+        project.save(update_fields=['seed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectdb',
+            name='seed',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(seed_existing_projects,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='projectdb',
+            name='seed',
+            field=models.BigIntegerField(
+                default=projects.models.make_project_seed,
+                help_text='Seed for the generator. The same seed and '
+                          'settings make the same data set.'),
+        ),
+    ]
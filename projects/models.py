@@ -1,3 +1,5 @@
+import secrets
+
 from django.db import models
 from django.conf import settings
 # from django.utils.text import slugify
@@ -16,6 +18,12 @@ ready for display.
 """
 
 
+def make_project_seed():
+    """ Make a random seed for a new project's generator. """
+    # 63 bits, so it fits in a signed BIGINT.
+    return secrets.randbits(63)
+
+
 class ProjectDb(models.Model):
     """
         Data model for a project.
@@ -59,6 +67,11 @@ class ProjectDb(models.Model):
         auto_now=True,
         db_index=True
     )
+    seed = models.BigIntegerField(
+        default=make_project_seed,
+        help_text='Seed for the generator. The same seed and settings '
+                  'make the same data set.'
+    )
 
     def __str__(self):
         return self.title
@@ -1,47 +1,45 @@
+import copy
+
 from django.shortcuts import get_object_or_404
 
 from feds.settings import FEDS_VALUE_PARAM
-from projects.internal_representation_classes import FedsProject, \
-    FedsNotionalTable, FedsBusinessArea, FedsFieldSpec, FedsBase, FedsSetting
-from projects.models import ProjectDb, AvailableBusinessAreaSettingDb, \
-    UserSettingDb
-from fieldsettings.models import FieldSettingDb
-from businessareas.models import NotionalTableDb, BusinessAreaDb, \
-    AvailableNotionalTableSettingDb
-from fieldspecs.models import FieldSpecDb, AvailableFieldSpecSettingDb
-from projects.settings_gatherer import SettingsGatherer
+from projects.internal_representation_classes import FedsProject
+from projects.models import ProjectDb, UserSettingDb
+from projects.default_projects import get_default_project
 
 
 def read_project(project_id):
     """
     Return a representation of a project, using the internal representation
     classes.
+
+    The project shares its business area's compiled default project, and
+    copies only the settings the user has set. Once the default project
+    is cached, reading a project costs two queries: the project, and its
+    user settings.
+
+    The project has its own ProjectRegistry, in project.registry, so
+    projects can be read in several threads at once.
     """
-    # Erase existing machines names.
-    FedsBase.machine_name_list = list()
+    project_db = get_object_or_404(
+        ProjectDb.objects.select_related('business_area', 'user'),
+        pk=project_id)
+    default_project = get_default_project(project_db.business_area)
     # Load the project's default settings.
-    project = load_project_defaults(project_id)
+    project = load_project_defaults(project_db, default_project)
     # Merge the user's settings
-    merge_user_setting_values(project)
+    merge_user_setting_values(project, default_project)
     return project
 
 
-def load_project_defaults(project_id):
+def load_project_defaults(project_db, default_project):
     """
     Load the default rep of a project.
-    :param project_id: Id of the project.
-    :return: FedsProject
+    :param project_db: The project's DB record.
+    :param default_project: DefaultProject for the project's business area.
+    :return: FedsProject, sharing the default project's settings and
+            tables.
     """
-    # Get project's basic deets from the DB.
-    project_db = get_object_or_404(ProjectDb, pk=project_id)
-    business_area_db = get_object_or_404(
-        BusinessAreaDb, pk=project_db.business_area.pk)
-    business_area = FedsBusinessArea(
-        db_id=business_area_db.pk,
-        title=business_area_db.title,
-        machine_name=business_area_db.machine_name,
-        description=business_area_db.description
-    )
     project = FedsProject(
         db_id=project_db.pk,
         owner=project_db.user,
@@ -49,127 +47,103 @@ def load_project_defaults(project_id):
         machine_name='spiders!', # Not needed.
         description=project_db.description,
         # slug=project_db.slug,
-        business_area=business_area,
+        business_area=default_project.business_area,
         when_created=project_db.when_created,
+        # The machine names and settings registered by the default project.
+        registry=default_project.registry.copy(),
     )
-    # Add settings to the project, merging setting and relationship params.
-    add_default_project_settings(project, business_area_db)
-
-    # Get the tables from the DB.
-    tables_db_records = NotionalTableDb.objects.filter(
-        business_area=project_db.business_area
-    ).order_by('display_order')
-    for table_db_record in tables_db_records:
-        # Create the internal rep of the table
-        table = FedsNotionalTable(
-            db_id=table_db_record.pk,
-            title=table_db_record.title,
-            machine_name=table_db_record.machine_name,
-            description=table_db_record.description
-        )
-        # Add settings to the table, merging setting and relationship params.
-        add_default_table_settings(table, table_db_record)
-        # Get the field specs referenced in the table.
-        field_specs_db_records = FieldSpecDb.objects.filter(
-            notional_tables=table_db_record
-        )
-        for field_spec_db_record in field_specs_db_records:
-            field_spec = FedsFieldSpec(
-                db_id=field_spec_db_record.pk,
-                title=field_spec_db_record.title,
-                machine_name=field_spec_db_record.machine_name,
-                description=field_spec_db_record.description,
-                field_type=field_spec_db_record.field_type
-            )
-            # Add settings to the field spec, merging setting
-            # and relationship params.
-            add_default_field_spec_settings(field_spec, field_spec_db_record)
-            table.add_field_spec(field_spec)
-        project.add_notional_table(table)
+    project.settings = list(default_project.settings)
+    project.notional_tables = list(default_project.notional_tables)
     return project
 
 
-def add_default_project_settings(project, business_area_db):
+def merge_user_setting_values(project, default_project):
     """
-    Add default settings for a project.
-    :param project: The project's internal rep.
-    :param business_area_db: The DB record for the business area.
+    Merge the user's setting values into the project.
+
+    The default project's settings are shared, so each setting the user
+    has set is copied, with the user's value. So are the tables and field
+    specs it's in. The rest stay shared.
+    :param project: The project, default settings.
+    :param default_project: DefaultProject the project was loaded from.
     """
-    base_settings_db = FieldSettingDb.objects.filter(
-        availablebusinessareasettingdb__business_area=business_area_db).values()
-    relationship_settings = AvailableBusinessAreaSettingDb.objects.filter(
-        business_area=business_area_db).order_by('business_area_setting_order').values()
-    settings_gatherer = SettingsGatherer(
-        base_settings=base_settings_db,
-        relationship_settings=relationship_settings,
-        relationship_setting_id_field='business_area_setting_id',
-        relationship_setting_order_field='business_area_setting_order',
-        relationship_setting_params_field='business_area_setting_params',
-    )
-    project.settings = settings_gatherer.gather_settings()
+    # Load user's setting values
+    user_values_db = UserSettingDb.objects.filter(
+        project_id=project.db_id).values_list('machine_name', 'value')
+    # Copies of the settings, with the user's values, by machine name.
+    user_settings = dict()
+    for machine_name, user_value in user_values_db:
+        # Is it in the machine names list?
+        if machine_name not in default_project.registry.settings:
+            raise ReferenceError('Merge values: cannot find "{mn}"'
+                                 .format(mn=machine_name))
+        setting = default_project.registry.settings[machine_name]
+        if FEDS_VALUE_PARAM not in setting.params:
+            raise ValueError('Merge values: cannot find value param for "{mn}"'
+                             .format(mn=machine_name))
+        user_setting = copy.copy(setting)
+        user_setting.params = dict(setting.params)
+        user_setting.params[FEDS_VALUE_PARAM] = user_value
+        user_settings[machine_name] = user_setting
+        project.registry.add_setting(user_setting)
+    if not user_settings:
+        return
+    project.settings = overlay_settings(project.settings, user_settings)
+    project.notional_tables = [
+        overlay_table(table, user_settings)
+        for table in project.notional_tables]
 
 
-def add_default_table_settings(table, table_db_rec):
+def overlay_settings(settings, user_settings):
     """
-    Add default settings for a table.
-    :param table: The table's internal rep.
-    :param table_db_rec: The DB record for the table.
+    Swap settings the user has set for their copies.
+    :param settings: List of FedsXXXSettings.
+    :param user_settings: Dict of copies of settings, with the user's
+            values, by machine name.
+    :return: List of FedsXXXSettings.
     """
-    base_settings_db = FieldSettingDb.objects.filter(
-        availablenotionaltablesettingdb__table=table_db_rec
-    ).values()
-    relationship_settings = AvailableNotionalTableSettingDb.objects.filter(
-        table=table_db_rec).order_by('table_setting_order').values()
-    settings_gatherer = SettingsGatherer(
-        base_settings=base_settings_db,
-        relationship_settings=relationship_settings,
-        relationship_setting_id_field='table_setting_id',
-        relationship_setting_order_field='table_setting_order',
-        relationship_setting_params_field='table_setting_params',
-    )
-    table.settings = settings_gatherer.gather_settings()
+    return [user_settings.get(setting.machine_name, setting)
+            for setting in settings]
 
 
-def add_default_field_spec_settings(field_spec_model, field_spec_db_rec):
+def overlay_table(table, user_settings):
     """
-    Add default settings for field spec.
-    :param field_spec_model: Internal rep of the field spec.
-    :param field_spec_db_rec: The DB record for the field spec.
+    Copy a table if the user has set any of its settings, or its field
+    specs' settings.
+    :param table: FedsNotionalTable, from the default project.
+    :param user_settings: Dict of copies of settings, with the user's
+            values, by machine name.
+    :return: The table, or a copy of it.
     """
-    base_settings_db = FieldSettingDb.objects.filter(
-        availablefieldspecsettingdb__field_spec=field_spec_db_rec
-    ).values()
-    relationship_settings = AvailableFieldSpecSettingDb.objects.filter(
-        field_spec=field_spec_db_rec).order_by('field_setting_order').values()
-    settings_gatherer = SettingsGatherer(
-        base_settings=base_settings_db,
-        relationship_settings=relationship_settings,
-        relationship_setting_id_field='field_setting_id',
-        relationship_setting_order_field='field_setting_order',
-        relationship_setting_params_field='field_setting_params',
-    )
-    field_spec_model.settings = settings_gatherer.gather_settings()
+    settings = overlay_settings(table.settings, user_settings)
+    field_specs = [overlay_field_spec(field_spec, user_settings)
+                   for field_spec in table.field_specs]
+    if all_shared(settings, table.settings) \
+            and all_shared(field_specs, table.field_specs):
+        return table
+    table = copy.copy(table)
+    table.settings = settings
+    table.field_specs = field_specs
+    return table
 
 
-def merge_user_setting_values(project):
+def overlay_field_spec(field_spec, user_settings):
     """
-    Merge the user's setting values into the project.
-    :param project: The project, default settings.
+    Copy a field spec if the user has set any of its settings.
+    :param field_spec: FedsFieldSpec, from the default project.
+    :param user_settings: Dict of copies of settings, with the user's
+            values, by machine name.
+    :return: The field spec, or a copy of it.
     """
-    # Load user's setting values
-    user_values_db = UserSettingDb.objects.filter(project_id=project.db_id)
-    # Make a dict for fast reference.
-    user_values = dict()
-    for user_setting_db in user_values_db:
-        machine_name = user_setting_db.machine_name
-        user_value = user_setting_db.value
-        # Is it in the machine names list?
-        if machine_name not in FedsSetting.setting_machine_names:
-            raise ReferenceError('Merge values: cannot find "{mn}"'
-                                 .format(mn=machine_name))
-        if FEDS_VALUE_PARAM not in \
-                FedsSetting.setting_machine_names[machine_name].params:
-            raise ValueError('Merge values: cannot find value param for "{mn}"'
-                             .format(mn=machine_name))
-        FedsSetting.setting_machine_names[machine_name].params[FEDS_VALUE_PARAM] \
-            = user_value
+    settings = overlay_settings(field_spec.settings, user_settings)
+    if all_shared(settings, field_spec.settings):
+        return field_spec
+    field_spec = copy.copy(field_spec)
+    field_spec.settings = settings
+    return field_spec
+
+
+def all_shared(items, default_items):
+    """ Check whether a list has the same objects as the default's. """
+    return all(item is default_item
+               for item, default_item in zip(items, default_items))
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from feds.settings import FEDS_BOOLEAN_SETTING, \
     FEDS_INTEGER_SETTING, FEDS_CHOICE_SETTING, FEDS_CURRENCY_SETTING, \
     FEDS_FLOAT_SETTING, FEDS_DATE_SETTING
@@ -6,6 +8,20 @@ from projects.internal_representation_classes import \
     FedsBooleanSetting, FedsIntegerSetting, FedsChoiceSetting, \
     FedsCurrencySetting, FedsFloatSetting, FedsDateSetting
 
+# Most params strings to keep parsed.
+SETTING_PARAMS_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=SETTING_PARAMS_CACHE_SIZE)
+def parse_setting_params(setting_params):
+    """
+    Parse a setting's JSON params. Many settings have the same params,
+    so they're parsed once, and shared. Don't change the result.
+    :param setting_params: JSON string, from a setting's params field.
+    :return: dict
+    """
+    return json_string_to_dict(setting_params)
+
 
 class SettingsGatherer:
     """
@@ -20,6 +36,7 @@ class SettingsGatherer:
             field in relationship_settings.
     :param relationship_setting_params_field: Name of the params field
             in relationship_settings.
+    :param registry: ProjectRegistry to register the settings with.
     """
 
     def __init__(self,
@@ -27,7 +44,8 @@ class SettingsGatherer:
                  relationship_settings,
                  relationship_setting_id_field,
                  relationship_setting_order_field,
-                 relationship_setting_params_field
+                 relationship_setting_params_field,
+                 registry=None
                  ):
         self.base_settings_db = base_settings
         self.relationship_settings_db = relationship_settings
@@ -36,9 +54,15 @@ class SettingsGatherer:
             = relationship_setting_order_field
         self.relationship_setting_params_field_db \
             = relationship_setting_params_field
+        self.registry = registry
 
     def gather_settings(self):
         result = list()
+        # Index the base settings by id, reading them once.
+        base_settings_by_id = {
+            base_setting_db['id']: base_setting_db
+            for base_setting_db in self.base_settings_db
+        }
         # Loop over the relationship records for settings.
         # For each one, collect its attribs, add in data from
         # the base record, and make a FedsXXXObject.
@@ -46,17 +70,12 @@ class SettingsGatherer:
             attribs = dict()
             db_id = rel_setting_db['id']
             # Find the base setting data.
-            found = False
-            for base_setting_db in self.base_settings_db:
-                if base_setting_db['id'] == rel_setting_db[
-                            self.relationship_setting_id_field_db]:
-                    found = True
-                    break
-            if not found:
+            base_setting_id = rel_setting_db[
+                self.relationship_setting_id_field_db]
+            base_setting_db = base_settings_by_id.get(base_setting_id)
+            if base_setting_db is None:
                 message = 'gather_settings: base with id "{id}" not found.'
-                raise ReferenceError(message.format(
-                    id=rel_setting_db[self.relationship_setting_id_field_db])
-                )
+                raise ReferenceError(message.format(id=base_setting_id))
             # Collect attributes, with relation data overriding base.
             attribs['db_id'] = db_id
             attribs['group'] = base_setting_db['setting_group']
@@ -66,27 +85,18 @@ class SettingsGatherer:
             ]
             # Machine name comes from the relationship.
             attribs['machine_name'] = rel_setting_db['machine_name']
-            # Merge params.
-            # Get base params.
-            base_params = base_setting_db['setting_params']
-            base_params = json_string_to_dict(base_params)
-            # Get relation params.
-            relation_params = rel_setting_db[
-                self.relationship_setting_params_field_db
-            ]
-            relation_params = json_string_to_dict(relation_params)
-            # Merge, with relation params taking precedence.
-            merged_params = {}
-            merged_params.update(base_params)
-            merged_params.update(relation_params)
-            attribs['params'] = merged_params
+            # Merge params, with relation params taking precedence.
+            attribs['params'] = self.merge_params(
+                parse_setting_params(base_setting_db['setting_params']),
+                parse_setting_params(rel_setting_db[
+                    self.relationship_setting_params_field_db
+                ])
+            )
             # Title and description can be overridden.
-            attribs['title'] = base_setting_db['title']
-            if 'title' in attribs['params']:
-                attribs['title'] = attribs['params']['title']
-            attribs['description'] = base_setting_db['description']
-            if 'description' in attribs['params']:
-                attribs['description'] = attribs['params']['description']
+            attribs['title'] = attribs['params'].get(
+                'title', base_setting_db['title'])
+            attribs['description'] = attribs['params'].get(
+                'description', base_setting_db['description'])
             # Make a FedsXXXSetting.
             setting = self.setting_factory(attribs)
             # Attach to settings list.
@@ -101,8 +111,7 @@ class SettingsGatherer:
         :return: Merged params.
         :rtype: dict
         """
-        merged_params = {}
-        merged_params.update(default_params)
+        merged_params = dict(default_params)
         merged_params.update(overriding_params)
         return merged_params
 
@@ -121,7 +130,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         elif attribs['type'] == FEDS_BOOLEAN_SETTING:
             result = FedsBooleanSetting(
@@ -131,7 +141,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         elif attribs['type'] == FEDS_INTEGER_SETTING:
             result = FedsIntegerSetting(
@@ -141,7 +152,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         elif attribs['type'] == FEDS_CHOICE_SETTING:
             result = FedsChoiceSetting(
@@ -151,7 +163,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         elif attribs['type'] == FEDS_CURRENCY_SETTING:
             result = FedsCurrencySetting(
@@ -161,7 +174,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         elif attribs['type'] == FEDS_FLOAT_SETTING:
             result = FedsFloatSetting(
@@ -171,7 +185,8 @@ class SettingsGatherer:
                 machine_name=attribs['machine_name'],
                 group=attribs['group'],
                 params=attribs['params'],
-                setting_order=attribs['setting_order']
+                setting_order=attribs['setting_order'],
+                registry=self.registry
             )
         else:
             message = 'setting_factory: "{title}" with bad setting ' \
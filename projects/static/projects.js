@@ -23,6 +23,14 @@ var Feds = {
     settingDisplayUrl: '',
     //Ajax URL to generate a data set.
     generateUrl: '',
+    //Ajax URL to queue a job to generate a data set.
+    submitJobUrl: '',
+    //Ajax URL to check on a generation job.
+    jobStatusUrl: '',
+    //Milliseconds between checks on a generation job.
+    jobPollInterval: 2000,
+    //URL to generate a data set, and download it as it's made.
+    streamGenerateUrl: '',
     //Ajax URL to erase a data set archive file.
     deleteArchiveUrl: '',
     /**
@@ -286,9 +294,22 @@ var Feds = {
         });
     },
     /*
+    Generate a data set for each student in the students box.
+     */
+    generateVariants: function(){
+        var variants = $.trim($('#generate-variants').val());
+        if ( ! variants ) {
+            alert('Enter the number of students, or their names.');
+            return;
+        }
+        Feds.generate(variants);
+    },
+    /*
     Generate a data set.
+    @param variants Optional number of students, or roster, one per line,
+    to make a data set for each.
      */
-     generate: function(){
+     generate: function(variants){
         //Show the status modal.
         var $modal = $($('#generate-modal'));
         Feds.updateGenerateModalState('wait-for-generate');
@@ -297,32 +318,107 @@ var Feds = {
         //server.
         var settingsState = Feds.getSettingsState();
 
-        //Send a request to the server.
+        //Queue a job on the server.
         $.ajax({
             type: 'POST',
-            url: Feds.generateUrl,
+            url: Feds.submitJobUrl,
             data: {
                 'projectid': Feds.projectId,
                 'settingsstate': JSON.stringify(settingsState),
+                'variants': variants || ''
             },
             dataType: 'json'
         }).done(function (data) {
             //XHR success.
-            //Check the return data.
-            if ( ! data.archiveurl ) {
-                console.error('Bah! No archiveurl');
+            if ( data.status !== 'ok' ){
+                console.log(data.status);
+                Feds.showGenerateError(data.status);
+                return;
             }
+            //Wait for the job to finish.
+            Feds.pollJob(data.jobid);
+        }).fail(function (jqXHR, message) {
+            console.error(message);
+            Feds.showGenerateError(message);
+        });
+    },
+    /**
+     * Check on a generation job until it's finished.
+     * @param jobId Id of the job.
+     */
+    pollJob: function (jobId) {
+        var $modal = $($('#generate-modal'));
+        $.ajax({
+            type: 'GET',
+            url: Feds.jobStatusUrl,
+            data: {'jobid': jobId},
+            dataType: 'json'
+        }).done(function (data) {
+            //XHR success.
             if ( data.status !== 'ok' ){
                 console.log(data.status);
+                Feds.showGenerateError(data.status);
+                return;
+            }
+            if ( data.jobstatus === 'failed' ) {
+                console.error('Generation failed: ' + data.message);
+                Feds.showGenerateError(data.message || data.jobstatus);
+                return;
+            }
+            if ( data.jobstatus !== 'done' ) {
+                //Not done yet. Show progress, and check again later.
+                $modal.find("#generate-progress").text(
+                    Math.round(data.progress * 100) + '%');
+                setTimeout(function () {
+                    Feds.pollJob(jobId);
+                }, Feds.jobPollInterval);
                 return;
             }
+            //Check the return data.
+            if ( ! data.archiveurl ) {
+                console.error('Bah! No archiveurl');
+            }
             //Got the URL for the archive file.
             $modal.find("#archive-link").attr('href', data.archiveurl);
+            //Links to each student's archive, for a batch of variants.
+            var $variantLinks = $modal.find("#variant-links").empty();
+            $.each(data.varianturls, function (index, variant) {
+                $('<a></a>').attr('href', variant.url).text(variant.label)
+                    .appendTo($('<li></li>').appendTo($variantLinks));
+            });
             Feds.updateGenerateModalState('wait-for-download');
         }).fail(function (jqXHR, message) {
             console.error(message);
+            Feds.showGenerateError(message);
         });
     },
+    /**
+     * Show why a data set wasn't made, in place of the wait message.
+     * Polling has stopped, so the progress is cleared.
+     * @param message What went wrong.
+     */
+    showGenerateError: function (message) {
+        var $modal = $($('#generate-modal'));
+        $modal.find("#generate-progress").text('');
+        $modal.find("#generate-wait-text").text(
+            'Sorry, the data set could not be made: ' + message);
+    },
+    /*
+    Generate a data set, and download it while the server makes it.
+    Submits a form, so the browser saves the response as a file.
+     */
+    streamGenerate: function(){
+        var settingsState = Feds.getSettingsState();
+        var $form = $('<form method="post" style="display:none;"></form>')
+            .attr('action', Feds.streamGenerateUrl);
+        $('<input type="hidden" name="csrfmiddlewaretoken">')
+            .val(csrfToken).appendTo($form);
+        $('<input type="hidden" name="projectid">')
+            .val(Feds.projectId).appendTo($form);
+        $('<input type="hidden" name="settingsstate">')
+            .val(JSON.stringify(settingsState)).appendTo($form);
+        $form.appendTo('body').submit().remove();
+    },
     /**
      * Update the display state of the generate data set modal.
      * @param state State to show.
@@ -330,6 +426,8 @@ var Feds = {
     updateGenerateModalState: function (state) {
         var $modal = $($('#generate-modal'));
         if ( state === 'wait-for-generate') {
+            $modal.find("#generate-wait-text").text('Generating data set...');
+            $modal.find("#generate-progress").text('');
             $modal.find("#generate-wait-message").show();
             $modal.find("#delete-wait-message").hide();
             $modal.find("#archive-link-container").hide();
@@ -1,11 +1,11 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from feds.settings import FEDS_BASIC_SETTING_GROUP, FEDS_INTEGER_SETTING, \
-    FEDS_TEXT_NOTIONAL_FIELD
+    FEDS_FLOAT_SETTING, FEDS_TEXT_NOTIONAL_FIELD
 from fieldsettings.models import FieldSettingDb
 from fieldspecs.models import FieldSpecDb, NotionalTableMembershipDb, \
     AvailableFieldSpecSettingDb
-from .models import ProjectDb
+from .models import ProjectDb, UserSettingDb
 from .read_write_project import read_project
 from businessareas.models import BusinessAreaDb, \
     AvailableBusinessAreaSettingDb, NotionalTableDb, \
@@ -30,7 +30,7 @@ class FedsReadWriteProjectTests(TestCase):
             title='BA Setting 1 Sales tax',
             machine_name='sales_tax',
             setting_group=FEDS_BASIC_SETTING_GROUP,
-            setting_type=FEDS_INTEGER_SETTING,
+            setting_type=FEDS_FLOAT_SETTING,
             setting_params='{"title": "Sales tax", "value": "0.06"}'
         )
         self.sales_tax.save()
@@ -130,3 +130,103 @@ class FedsReadWriteProjectTests(TestCase):
     def test_things(self):
         p = read_project(self.p.pk)
         self.assertEqual(p.title, self.p.title)
+
+    def test_queries_per_project(self):
+        with self.assertNumQueries(8):
+            read_project(self.p.pk)
+        # The default project is compiled once.
+        with self.assertNumQueries(2):
+            read_project(self.p.pk)
+        # More tables and fields take no more queries.
+        tbl_cat = NotionalTableDb(
+            business_area=self.ba,
+            title='Table title Cat',
+            machine_name='tbl_cats',
+            display_order=2
+        )
+        tbl_cat.save()
+        AvailableNotionalTableSettingDb(
+            table=tbl_cat,
+            table_setting=self.pack_count,
+            machine_name='tbl_cat_pack_count',
+            table_setting_order=1,
+            table_setting_params='{"value": 2}'
+        ).save()
+        for field_order, machine_name in enumerate(['whiskers', 'tail'], 1):
+            field_spec = FieldSpecDb(
+                title='Fieldspec ' + machine_name,
+                machine_name=machine_name,
+                field_type=FEDS_TEXT_NOTIONAL_FIELD,
+            )
+            field_spec.save()
+            NotionalTableMembershipDb(
+                field_spec=field_spec,
+                notional_table=tbl_cat,
+                machine_name='tbl_cat_field_' + machine_name,
+                field_order=field_order
+            ).save()
+            AvailableFieldSpecSettingDb(
+                field_spec=field_spec,
+                field_setting=self.setting_complexity,
+                machine_name=machine_name + '_setting_complexity',
+                field_setting_order=1,
+                field_setting_params='{"value": 3}'
+            ).save()
+        with self.assertNumQueries(8):
+            p = read_project(self.p.pk)
+        self.assertEqual(
+            [table.machine_name for table in p.notional_tables],
+            ['tbl_dogs', 'tbl_cats'])
+        self.assertEqual(
+            [field_spec.machine_name
+             for field_spec in p.notional_tables[1].field_specs],
+            ['whiskers', 'tail'])
+        self.assertEqual(
+            p.notional_tables[1].field_specs[1].settings[0].params['value'],
+            3)
+
+    def test_user_settings_overlaid(self):
+        default_project = read_project(self.p.pk)
+        other_project = ProjectDb(user=self.u2, title='Other project',
+                                  business_area=self.ba)
+        other_project.save()
+        UserSettingDb(project=self.p, machine_name='name_setting_complexity',
+                      value='4').save()
+        with self.assertNumQueries(2):
+            p = read_project(self.p.pk)
+        self.assertEqual(
+            p.notional_tables[0].field_specs[0].settings[0].params['value'],
+            '4')
+        self.assertEqual(
+            p.registry.settings['name_setting_complexity'].params['value'],
+            '4')
+        # Only the changed setting, and the table and field spec it's in,
+        # are copied.
+        self.assertIsNot(p.notional_tables[0],
+                         default_project.notional_tables[0])
+        self.assertIs(p.notional_tables[0].settings[0],
+                      default_project.notional_tables[0].settings[0])
+        self.assertIs(p.settings[0], default_project.settings[0])
+        # Other projects keep the defaults.
+        other = read_project(other_project.pk)
+        self.assertEqual(
+            other.notional_tables[0].field_specs[0].settings[0]
+            .params['value'], 11)
+        self.assertIs(other.notional_tables[0],
+                      default_project.notional_tables[0])
+        # Each project has its own registry.
+        self.assertEqual(
+            other.registry.settings['name_setting_complexity']
+            .params['value'], 11)
+        self.assertEqual(
+            p.registry.settings['name_setting_complexity'].params['value'],
+            '4')
+
+    def test_default_project_recompiled_when_saved(self):
+        read_project(self.p.pk)
+        self.name_setting_complexity.field_setting_params = '{"value": 12}'
+        self.name_setting_complexity.save()
+        p = read_project(self.p.pk)
+        self.assertEqual(
+            p.notional_tables[0].field_specs[0].settings[0].params['value'],
+            12)
@@ -0,0 +1,76 @@
+from django.test import TestCase
+from feds.settings import FEDS_BASIC_SETTING_GROUP, FEDS_INTEGER_SETTING
+from .internal_representation_classes import ProjectRegistry
+from .settings_gatherer import SettingsGatherer, parse_setting_params
+
+
+class SettingsGathererTests(TestCase):
+
+    def setUp(self):
+        self.registry = ProjectRegistry()
+        self.base_settings = [
+            {
+                'id': setting_id,
+                'title': 'Setting {id}'.format(id=setting_id),
+                'description': 'Base description',
+                'setting_group': FEDS_BASIC_SETTING_GROUP,
+                'setting_type': FEDS_INTEGER_SETTING,
+                'setting_params': '{"value": 1, "min": 0}',
+            }
+            for setting_id in (3, 1, 2)
+        ]
+
+    def gather(self, relationship_settings):
+        settings_gatherer = SettingsGatherer(
+            base_settings=self.base_settings,
+            relationship_settings=relationship_settings,
+            relationship_setting_id_field='table_setting_id',
+            relationship_setting_order_field='table_setting_order',
+            relationship_setting_params_field='table_setting_params',
+            registry=self.registry,
+        )
+        return settings_gatherer.gather_settings()
+
+    def test_merge_with_base_settings(self):
+        settings = self.gather([
+            {'id': 10, 'table_setting_id': 2, 'machine_name': 'dogs',
+             'table_setting_order': 1,
+             'table_setting_params': '{"value": 5, "title": "Dogs"}'},
+            {'id': 11, 'table_setting_id': 3, 'machine_name': 'cats',
+             'table_setting_order': 2, 'table_setting_params': ''},
+        ])
+        self.assertEqual([setting.machine_name for setting in settings],
+                         ['dogs', 'cats'])
+        self.assertEqual(settings[0].title, 'Dogs')
+        self.assertEqual(settings[0].params, {'value': 5, 'min': 0,
+                                              'title': 'Dogs'})
+        self.assertEqual(settings[1].title, 'Setting 3')
+        self.assertEqual(settings[1].description, 'Base description')
+        self.assertEqual(settings[1].params, {'value': 1, 'min': 0})
+        self.assertEqual(self.registry.machine_names, {'dogs', 'cats'})
+        self.assertIs(self.registry.settings['cats'], settings[1])
+
+    def test_duplicate_machine_names(self):
+        with self.assertRaises(ValueError):
+            self.gather([
+                {'id': 10, 'table_setting_id': 1, 'machine_name': 'dogs',
+                 'table_setting_order': 1, 'table_setting_params': ''},
+                {'id': 11, 'table_setting_id': 2, 'machine_name': 'Dogs',
+                 'table_setting_order': 2, 'table_setting_params': ''},
+            ])
+
+    def test_parsed_params_not_changed(self):
+        settings = self.gather([
+            {'id': 10, 'table_setting_id': 1, 'machine_name': 'dogs',
+             'table_setting_order': 1, 'table_setting_params': ''},
+        ])
+        settings[0].params['value'] = 7
+        self.assertEqual(parse_setting_params('{"value": 1, "min": 0}'),
+                         {'value': 1, 'min': 0})
+
+    def test_missing_base_setting(self):
+        with self.assertRaises(ReferenceError):
+            self.gather([
+                {'id': 10, 'table_setting_id': 4, 'machine_name': 'dogs',
+                 'table_setting_order': 1, 'table_setting_params': ''},
+            ])
@@ -11,7 +11,7 @@ from businessareas.models import BusinessAreaDb, NotionalTableDb, \
 from projects.read_write_project import read_project
 from .models import ProjectDb, UserSettingDb
 from .forms import ProjectForm, ConfirmDeleteForm
-from .internal_representation_classes import FedsDateSetting, FedsSetting, \
+from .internal_representation_classes import FedsDateSetting, \
     FedsTitleDescription
 
 FORBIDDEN_MESSAGE = 'Forbidden'
@@ -38,8 +38,9 @@ def show_project(request, project_id):
     # Get project's basic deets.
     project_db = get_object_or_404(ProjectDb, pk=project_id)
     project = read_project(project_db.pk)
-    setting_values = FedsSetting.generate_js_settings_values_object()
-    visibility_testers = FedsSetting.generate_js_visibility_testers_object()
+    setting_values = project.registry.generate_js_settings_values_object()
+    visibility_testers \
+        = project.registry.generate_js_visibility_testers_object()
     return render(request, 'projects/show_project.html',
                   {
                       'project': project,
@@ -189,7 +190,7 @@ def request_setting_widget(request):
         # Identify the project and setting.
         project_id, setting_machine_name, project = get_setting_info(request)
         # Get the widget code.
-        widget_html, validators = FedsSetting.setting_machine_names[
+        widget_html, validators = project.registry.settings[
             setting_machine_name].display_widget()
         result = {
             'status': 'ok',
@@ -221,7 +222,7 @@ def get_setting_info(request):
     # Load the FedsXXXSettings for the project.
     project = read_project(project_id)
     # Is the machine name defined?
-    if setting_machine_name not in FedsSetting.setting_machine_names:
+    if setting_machine_name not in project.registry.settings:
         message = 'get_setting_info: machine name "{mn}" unknown.'
         raise LookupError(message.format(mn=setting_machine_name))
     return project_id, setting_machine_name, project
@@ -280,11 +281,11 @@ def load_setting_deets(request):
         # Identify the project and setting.
         project_id, setting_machine_name, project = get_setting_info(request)
         # Is it in the machine names list?
-        if setting_machine_name not in FedsSetting.setting_machine_names:
+        if setting_machine_name not in project.registry.settings:
             raise ReferenceError('load_setting_deets: cannot find "{mn}"'
                                  .format(mn=setting_machine_name))
         # Get the deets.
-        html = FedsSetting.setting_machine_names[
+        html = project.registry.settings[
             setting_machine_name].display_deets()
         return JsonResponse({'status': 'ok', 'deets': html})
     except Exception as e: